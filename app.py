@@ -1,10 +1,15 @@
-import io
-
-import pretty_midi
 import streamlit as st
 
 from melodycomp.agent import MelodyCompAgent
-from melodycomp.melody_generator import generate_melody_for_chords
+from melodycomp.algorithmic_melody import draft_melody_candidates
+from melodycomp.melody_generator import (
+    generate_melody_candidates,
+    melody_model_status,
+    warm_up_melody_model,
+)
+from melodycomp.melody_worker import MelodyQueueFull
+from melodycomp.midi import Track, render_midi
+from melodycomp.tracing import InMemoryCollector, tracer
 
 st.set_page_config(layout="wide")
 st.title("🎵 Melodycomp")
@@ -12,30 +17,82 @@ st.write("Your AI creative partner for music composition. Start by describing an
 
 @st.cache_resource
 def load_agent():
-    """Load the MelodyCompAgent once and cache it."""
+    """Create the MelodyCompAgent once and cache it. Its subsystems and the melody
+    worker processes warm up in the background, so chords can be served before
+    the melody model has finished loading."""
     try:
-        return MelodyCompAgent()
+        agent = MelodyCompAgent()
+        warm_up_melody_model()
+        return agent
     except Exception as e:
         st.error(f"Failed to load agent: {e}")
         return None
 
+@st.cache_resource
+def load_trace_collector():
+    """One in-process collector shared by all sessions."""
+    return tracer.add_hook(InMemoryCollector(max_traces=50))
+
 agent = load_agent()
+trace_collector = load_trace_collector()
+
+if agent:
+    with st.sidebar:
+        st.markdown("#### Status")
+        status = {**agent.readiness(), "melody_model": melody_model_status()}
+        icons = {"ready": "🟢", "loading": "🟡", "cold": "⚪", "failed": "🔴"}
+        for name, state in status.items():
+            st.caption(f"{icons[state]} {name.replace('_', ' ')}: {state}")
+
+        if st.toggle("Show request timings"):
+            num_traces = st.slider("Requests", min_value=1, max_value=20, value=5)
+            for trace in trace_collector.recent(num_traces):
+                with st.expander(f"{trace.name} · {trace.duration_ms:.0f} ms"):
+                    st.table([
+                        {
+                            "stage": span.name,
+                            "start (ms)": round(span.offset_ms, 1),
+                            "duration (ms)": round(span.duration_ms, 1),
+                            **span.attributes,
+                        }
+                        for span in trace.spans
+                    ])
+
+def set_melody_candidates(candidates):
+    """Stores ranked melody candidates and converts them to MIDI tracks once."""
+    st.session_state.melody_candidates = candidates
+    st.session_state.melody_tracks = [
+        Track.from_instrument(candidate.instrument) for candidate in candidates
+    ]
+    st.session_state.melody_track = (
+        st.session_state.melody_tracks[0] if candidates else None
+    )
 
 # --- State Management ---
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "notes_json" not in st.session_state:
     st.session_state.notes_json = None
+if "chord_track" not in st.session_state:
+    st.session_state.chord_track = None
 if "chords" not in st.session_state:
     st.session_state.chords = None
 if "tips" not in st.session_state:
     st.session_state.tips = None
-if "melody_instrument" not in st.session_state:
-    st.session_state.melody_instrument = None
+if "melody_track" not in st.session_state:
+    st.session_state.melody_track = None
+if "melody_candidates" not in st.session_state:
+    st.session_state.melody_candidates = []
+if "melody_tracks" not in st.session_state:
+    st.session_state.melody_tracks = []
 
 if not agent:
     st.warning("Agent could not be loaded. Please check the console for errors.")
 else:
+    if "conversation" not in st.session_state:
+        # Per-browser-session history; the agent itself is shared by all sessions.
+        st.session_state.conversation = agent.new_session()
+
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
@@ -44,37 +101,62 @@ else:
     if prompt := st.chat_input("What's your musical idea?"):
         st.session_state.chords = None
         st.session_state.notes_json = None
+        st.session_state.chord_track = None
         st.session_state.tips = None
-        st.session_state.melody_instrument = None
+        st.session_state.melody_track = None
+        st.session_state.melody_candidates = []
+        st.session_state.melody_tracks = []
 
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response_data = agent.run_conversation(prompt)
-
-                if response_data and response_data.get("chords"):
-                    st.session_state.chords = response_data["chords"]
-                    st.session_state.notes_json = response_data["notes"]
-                    st.session_state.tips = response_data.get(
-                        "tips",
-                        "No tips were generated."
-                    )
-
-                    chords_str = " -> ".join(st.session_state.chords)
+            status_placeholder = st.empty()
+            chords_placeholder = st.empty()
+            status_placeholder.caption("Thinking...")
+            response_content = None
+            tips = ""
+
+            for stage, payload in agent.stream_conversation(
+                prompt, session=st.session_state.conversation
+            ):
+                if stage == "chords":
+                    st.session_state.chords = payload
+                    chords_str = " -> ".join(payload)
                     response_content = f"Here is a progression for you:\n```\n{chords_str}\n```" # noqa: E501
-                    st.markdown(response_content)
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": response_content}
+                    status_placeholder.empty()
+                    chords_placeholder.markdown(response_content)
+                    tips_placeholder = st.expander(
+                        "💡 Tips & Theory", expanded=True
+                    ).empty()
+                elif stage == "notes":
+                    st.session_state.notes_json = payload
+                    # Built once per result; reruns only look up the cached MIDI.
+                    st.session_state.chord_track = Track.from_notes_json(payload)
+                elif stage == "tips_token":
+                    tips += payload
+                    tips_placeholder.markdown(tips)
+                elif stage == "done":
+                    st.session_state.tips = (
+                        payload.get("tips") or "No tips were generated."
                     )
-                else:
+                elif stage == "error":
+                    status_placeholder.empty()
                     response_content = "Sorry, I couldn't generate a valid progression. Please try again." # noqa: E501
                     st.error(response_content)
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": response_content}
-                    )
+
+            if st.session_state.chords:
+                # An instant algorithmic draft; the AI melodies are generated on demand.
+                with tracer.trace("melody_draft"):
+                    set_melody_candidates(draft_melody_candidates(
+                        st.session_state.chords,
+                        scale=agent.scale_pitch_classes(prompt),
+                    ))
+
+            st.session_state.messages.append(
+                {"role": "assistant", "content": response_content}
+            )
         st.rerun()
 
     # --- Tips and Melody Generation Section ---
@@ -85,80 +167,81 @@ else:
             with st.expander("💡 Tips & Theory", expanded=True):
                 st.markdown(st.session_state.tips)
 
-        if st.button("✨ Generate a Melody", use_container_width=True):
-            with st.spinner("Composing a melody..."):
-                melody = generate_melody_for_chords(st.session_state.chords)
-                st.session_state.melody_instrument = melody if melody else False
-                st.rerun()
+        if st.button("✨ Generate AI Melodies", use_container_width=True):
+            with st.spinner("Composing melodies..."):
+                try:
+                    candidates = generate_melody_candidates(
+                        st.session_state.chords, n=3
+                    )
+                except (MelodyQueueFull, TimeoutError):
+                    st.warning("The melody workers are busy right now. "
+                               "Please try again in a moment.")
+                else:
+                    if candidates:
+                        # AI melodies first; the drafts stay available to compare.
+                        drafts = [
+                            candidate
+                            for candidate in st.session_state.melody_candidates
+                            if candidate.source == "draft"
+                        ]
+                        set_melody_candidates(candidates + drafts)
+                        st.rerun()
+                    st.warning(
+                        "Could not generate an AI melody for this progression. "
+                        "Please try again."
+                    )
 
-        if st.session_state.melody_instrument is False:
-            st.warning(
-                "Could not generate a melody for this progression. Please try again."
+        if st.session_state.melody_candidates:
+            choice = st.radio(
+                "Melody candidates",
+                options=range(len(st.session_state.melody_candidates)),
+                format_func=lambda i: "{} {} (score {:.2f})".format(
+                    "Draft"
+                    if st.session_state.melody_candidates[i].source == "draft"
+                    else "AI melody",
+                    i + 1,
+                    st.session_state.melody_candidates[i].score,
+                ),
+                horizontal=True,
             )
+            st.session_state.melody_track = st.session_state.melody_tracks[choice]
 
 
     # --- MIDI Download Section ---
-    if st.session_state.notes_json:
+    if st.session_state.chord_track:
         st.markdown("---")
         st.markdown("#### Downloads")
 
-        chord_instrument = pretty_midi.Instrument(
-            program=pretty_midi.instrument_name_to_program("Acoustic Grand Piano")
-        )
-        for note_data in st.session_state.notes_json:
-            note = pretty_midi.Note(
-                velocity=note_data["velocity"],
-                pitch=note_data["pitch"],
-                start=note_data["start_time"],
-                end=note_data["end_time"]
-            )
-            chord_instrument.notes.append(note)
-
-
-        num_cols = 3 if st.session_state.melody_instrument else 1
-        cols = st.columns(num_cols)
-
-        with cols[0]:
-            chord_midi_io = io.BytesIO()
-            chord_midi = pretty_midi.PrettyMIDI()
-            chord_midi.instruments.append(chord_instrument)
-            chord_midi.write(chord_midi_io)
-            chord_midi_io.seek(0)
-            st.download_button(
-                label="📥 Download Chords",
-                data=chord_midi_io,
-                file_name="chords.mid",
-                mime="audio/midi",
-                use_container_width=True
-            )
+        with tracer.trace("midi_downloads"):
+            chord_track = st.session_state.chord_track
+            melody_track = st.session_state.melody_track
+            num_cols = 3 if melody_track else 1
+            cols = st.columns(num_cols)
 
-        melody_instrument = st.session_state.melody_instrument
-        if melody_instrument:
-            with cols[1]:
-                melody_midi_io = io.BytesIO()
-                melody_midi = pretty_midi.PrettyMIDI()
-                melody_midi.instruments.append(melody_instrument)
-                melody_midi.write(melody_midi_io)
-                melody_midi_io.seek(0)
+            with cols[0]:
                 st.download_button(
-                    label="📥 Download Melody",
-                    data=melody_midi_io,
-                    file_name="melody.mid",
+                    label="📥 Download Chords",
+                    data=render_midi(chord_track),
+                    file_name="chords.mid",
                     mime="audio/midi",
                     use_container_width=True
                 )
 
-            with cols[2]:
-                combined_midi_io = io.BytesIO()
-                combined_midi = pretty_midi.PrettyMIDI()
-                combined_midi.instruments.append(chord_instrument)
-                combined_midi.instruments.append(melody_instrument)
-                combined_midi.write(combined_midi_io)
-                combined_midi_io.seek(0)
-                st.download_button(
-                    label="📥 Download Combined",
-                    data=combined_midi_io,
-                    file_name="combined.mid",
-                    mime="audio/midi",
-                    use_container_width=True
-                )
+            if melody_track:
+                with cols[1]:
+                    st.download_button(
+                        label="📥 Download Melody",
+                        data=render_midi(melody_track),
+                        file_name="melody.mid",
+                        mime="audio/midi",
+                        use_container_width=True
+                    )
+
+                with cols[2]:
+                    st.download_button(
+                        label="📥 Download Combined",
+                        data=render_midi(chord_track, melody_track),
+                        file_name="combined.mid",
+                        mime="audio/midi",
+                        use_container_width=True
+                    )
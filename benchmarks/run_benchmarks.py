@@ -0,0 +1,297 @@
+"""
+Offline benchmark suite for the agent and melody pipelines.
+
+Runs every stage against deterministic stand-in models (see `stubs.py`) and
+reports latency percentiles, throughput and peak Python memory per stage.
+Results are written as JSON (one file per commit by default) so runs can be
+compared to catch regressions:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<old>.json
+"""
+import argparse
+import ast
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import (  # noqa: E402
+    ABC_RESPONSES,
+    CHORD_RESPONSES,
+    HashEmbeddingFunction,
+    LlamaStub,
+    gemini_stub,
+    mlx_stub,
+)
+
+from melodycomp.abc_parser import parse_abc  # noqa: E402
+from melodycomp.agent import MelodyCompAgent  # noqa: E402
+from melodycomp.algorithmic_melody import draft_melody_candidates  # noqa: E402
+from melodycomp.melody_generator import (  # noqa: E402
+    generate_melody_candidates,
+    generate_melody_for_chords,
+)
+from melodycomp.midi import Track, encode_midi, render_many, render_midi  # noqa: E402
+from melodycomp.router import Backend, ModelRouter  # noqa: E402
+
+PROMPTS = [
+    "I want an 8-bar atmospheric trip hop progression in A minor",
+    "Give me a 4-bar chicago house groove in F minor",
+    "A dreamy shoegaze progression in D major",
+    "Detroit techno pads in C dorian that slowly open up",
+    "Something glitchy and idm in E phrygian",
+]
+
+
+def measure(
+    fn: Callable[[int], Any],
+    iterations: int,
+    warmup: int = 1
+) -> Dict[str, float]:
+    """Runs fn(i) `iterations` times and summarizes latency, throughput and memory."""
+    for i in range(warmup):
+        fn(i)
+
+    tracemalloc.start()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "iterations": iterations,
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p90_ms": float(np.percentile(latencies_ms, 90)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "throughput_per_s": iterations / total if total else float("inf"),
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def build_agent(model: Any, persist_directory: str) -> MelodyCompAgent:
+    agent = MelodyCompAgent(
+        model=model,
+        persist_directory=persist_directory,
+        embedding_function=HashEmbeddingFunction(),
+        response_cache=False,
+        warmup=True,
+    )
+    if not agent.wait_until_ready():
+        raise RuntimeError(f"Agent failed to warm up: {agent.readiness()}")
+    return agent
+
+
+def run_suite(iterations: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    chords = [ast.literal_eval(response) for response in CHORD_RESPONSES]
+    index_dir = tempfile.mkdtemp(prefix="melodycomp-bench-")
+
+    # Cold start indexes the knowledge base; warm start reuses the persisted index.
+    cold_dirs = [tempfile.mkdtemp(prefix="melodycomp-bench-cold-") for _ in range(3)]
+    results["agent_construction_cold"] = measure(
+        lambda i: build_agent(gemini_stub(), cold_dirs[i]), iterations=3, warmup=0
+    )
+    build_agent(gemini_stub(), index_dir)
+    results["agent_construction_warm"] = measure(
+        lambda i: build_agent(gemini_stub(), index_dir),
+        iterations=max(3, iterations // 20),
+    )
+
+    agent = build_agent(gemini_stub(), index_dir)
+    # Repeated prompts hit the embedding function's query cache (if it has
+    # one); numbered ones never do.
+    results["retrieval"] = measure(
+        lambda i: agent._retrieve_context(PROMPTS[i % len(PROMPTS)]), iterations
+    )
+    takes = itertools.count()
+    results["retrieval_uncached"] = measure(
+        lambda i: agent._retrieve_context(
+            f"{PROMPTS[i % len(PROMPTS)]} take {next(takes)}"
+        ),
+        iterations,
+    )
+    results["intent_parsing"] = measure(
+        lambda i: agent.parse_intent(PROMPTS[i % len(PROMPTS)]), iterations * 10
+    )
+    results["intent_parsing_uncached"] = measure(
+        lambda i: agent.intent_parser._parse(f"{PROMPTS[i % len(PROMPTS)]} take {i}"),
+        iterations * 10
+    )
+    keys = [(root, mode) for root in agent.NOTES for mode in agent.SCALE_INTERVALS]
+    results["palette_building"] = measure(
+        lambda i: agent._get_diatonic_palette(*keys[i % len(keys)]), iterations * 10
+    )
+    results["note_rendering"] = measure(
+        lambda i: agent._chords_to_notes_json(chords[i % len(chords)]), iterations * 10
+    )
+    batch = chords * 100
+    results["note_rendering_batch_300"] = measure(
+        lambda i: agent.chord_index.render(batch), iterations
+    )
+
+    simple_prompts = [
+        "8-bar house in F minor",
+        "4-bar pop in G major",
+        "16 bars of reggae in D major",
+        "8-bar progression in D dorian",
+    ]
+    results["progression_model_fast_path"] = measure(
+        lambda i: agent._fast_path_response(
+            simple_prompts[i % len(simple_prompts)], agent.new_session()
+        ),
+        iterations * 10
+    )
+
+    results["conversation_gemini_stub"] = measure(
+        lambda i: agent.run_conversation(PROMPTS[i % len(PROMPTS)]), iterations
+    )
+    mlx_agent = build_agent(mlx_stub(), index_dir)
+    results["conversation_mlx_stub"] = measure(
+        lambda i: mlx_agent.run_conversation(PROMPTS[i % len(PROMPTS)]), iterations
+    )
+    router = ModelRouter([
+        Backend("mlx", mlx_stub(), accepts=frozenset({"allowed_chords"})),
+        Backend("gemini", gemini_stub(), max_concurrency=10),
+    ])
+    router_agent = build_agent(router, index_dir)
+    results["conversation_router_stub"] = measure(
+        lambda i: router_agent.run_conversation(PROMPTS[i % len(PROMPTS)]), iterations
+    )
+    router.close()
+
+    results["abc_conversion"] = measure(
+        lambda i: parse_abc(ABC_RESPONSES[i % len(ABC_RESPONSES)]), iterations * 10
+    )
+    llama = LlamaStub()
+    results["melody_generation_llama_stub"] = measure(
+        lambda i: generate_melody_for_chords(chords[i % len(chords)], llm=llama),
+        iterations,
+    )
+    results["melody_candidates_4_llama_stub"] = measure(
+        lambda i: generate_melody_candidates(
+            chords[i % len(chords)], n=4, llm=llama
+        ),
+        iterations,
+    )
+
+    scale = agent.scale_pitch_classes(PROMPTS[0])
+    results["melody_draft_4"] = measure(
+        lambda i: draft_melody_candidates(chords[i % len(chords)], scale, n=4, seed=i),
+        iterations * 10
+    )
+
+    melody = Track.from_instrument(generate_melody_for_chords(chords[0], llm=llama))
+    notes = agent._chords_to_notes_json(chords[0])
+    results["midi_serialization"] = measure(
+        lambda i: encode_midi([Track.from_notes_json(notes), melody]), iterations
+    )
+    chord_track = Track.from_notes_json(notes)
+    results["midi_serialization_cached"] = measure(
+        lambda i: render_midi(chord_track, melody), iterations * 10
+    )
+    rendered = agent.chord_index.render(batch)
+    results["midi_serialization_batch_300"] = measure(
+        lambda i: render_many([Track.from_notes_json(n)] for n in rendered), iterations
+    )
+    return results
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(
+    current: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float
+) -> List[str]:
+    """Prints p50 changes per stage and returns the stages that regressed."""
+    regressions = []
+    print(f"\n{'stage':34} {'baseline p50':>13} {'current p50':>12} {'change':>8}")
+    for stage, stats in current.items():
+        if stage not in baseline:
+            continue
+        old, new = baseline[stage]["p50_ms"], stats["p50_ms"]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(stage)
+            flag = "  ⚠️ regression"
+        print(f"{stage:34} {old:12.3f}ms {new:11.3f}ms {change:+7.1%}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--output", help="Result file (default: benchmarks/results/<commit>.json)"
+    )
+    parser.add_argument("--compare", help="Earlier result file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative p50 slowdown reported as a regression.")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)  # the agent resolves knowledge_base/ relative to the repo root
+    stages = run_suite(args.iterations)
+
+    print(f"\n{'stage':34} {'p50':>9} {'p90':>9} {'p99':>9} "
+          f"{'ops/s':>10} {'peak KB':>10}")
+    for stage, stats in stages.items():
+        print(f"{stage:34} {stats['p50_ms']:8.3f}ms {stats['p90_ms']:8.3f}ms "
+              f"{stats['p99_ms']:8.3f}ms {stats['throughput_per_s']:10.1f} "
+              f"{stats['peak_memory_kb']:10.1f}")
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "stages": stages,
+    }
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"{commit}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["stages"]
+        if compare(stages, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Deterministic, offline stand-ins for the models used by melodycomp, so the
+benchmarks measure our own code rather than network or GPU latency.
+"""
+import hashlib
+from typing import Any, Dict, List
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from melodycomp.local_llm import MLX, ScriptedBackend
+
+CHORD_RESPONSES = [
+    "['Am7', 'Gmaj7', 'Fmaj7', 'Gmaj7', 'Am7', 'Dm7', 'Fmaj7', 'E7']",
+    "['Cmaj7', 'Am7', 'Dm7', 'G7']",
+    "['Dm9', 'G13', 'Cmaj9', 'Cmaj9', 'Fmaj7', 'Bm7b5', 'E7b9', 'Am9']",
+]
+TIPS_RESPONSE = (
+    "- Voice the maj7 chords with the 7th on top.\n"
+    "- Try A Dorian over the whole progression.\n"
+)
+
+ABC_RESPONSES = [
+    '| "Am7" A2 c2 e2 c2 | "Gmaj7" B2 d2 g4 | "Fmaj7" A2 c2 f2 e2 | "E7" ^G2 B2 e4 |]',
+    '| "C" C2 E2 G2 c2 | "Am" A2 c2 e4 | "Dm" d2 f2 a2 f2 | "G" g2 d2 B,4 |]',
+    "| (3cde c>d e2 z2 | A,2 E2- E4 | [CEG]4 z4 | _B2 =B2 c4 |]",
+]
+
+
+def gemini_stub() -> FakeListChatModel:
+    """Stand-in for ChatGoogleGenerativeAI: alternates chord lists and tips."""
+    responses = []
+    for chords in CHORD_RESPONSES:
+        responses.extend([chords, TIPS_RESPONSE])
+    return FakeListChatModel(responses=responses)
+
+
+def mlx_stub() -> MLX:
+    """
+    The real MLX wrapper on the CPU stand-in backend, so streaming, stop handling
+    and constrained chord decoding are measured without Apple silicon.
+    """
+    responses = []
+    for chords in CHORD_RESPONSES:
+        responses.extend([chords, TIPS_RESPONSE])
+    return MLX(backend=ScriptedBackend(responses), model_path="scripted")
+
+
+class LlamaStub:
+    """Stand-in for llama_cpp.Llama returning canned ABC completions."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, prompt: str, seed: int = 0, **kwargs: Any) -> Dict:
+        text = ABC_RESPONSES[(self.calls + seed) % len(ABC_RESPONSES)]
+        self.calls += 1
+        return {"choices": [{"text": text}]}
+
+
+class HashEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Deterministic bag-of-words hashing embeddings (no model download)."""
+
+    def __init__(self, dimensions: int = 128) -> None:
+        self.dimensions = dimensions
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings: List[np.ndarray] = []
+        for text in input:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for word in text.lower().split():
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+                vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+            norm = np.linalg.norm(vector)
+            embeddings.append(vector / norm if norm else vector)
+        return embeddings
+
+    @staticmethod
+    def name() -> str:
+        return "melodycomp-hash"
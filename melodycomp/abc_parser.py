@@ -0,0 +1,359 @@
+"""
+Deterministic, streaming parser for the subset of ABC notation produced by the
+melody model. Times and durations are expressed in quarter notes, matching the
+note JSON the Gemini converter produces (an eighth note at L:1/8 lasts 0.5).
+"""
+import re
+from fractions import Fraction
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pretty_midi
+
+# Semitone offsets of the natural notes, and MIDI pitch of "C" (middle C, C4).
+NOTE_OFFSETS = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+MIDDLE_C = 60
+
+ACCIDENTALS = {"^^": 2, "^": 1, "=": 0, "_": -1, "__": -2}
+
+# Position of each major key on the circle of fifths, and how far each mode
+# shifts it (e.g. A minor has the signature of C major: 3 - 3 = 0).
+KEY_FIFTHS = {
+    "C": 0, "G": 1, "D": 2, "A": 3, "E": 4, "B": 5, "F#": 6, "C#": 7,
+    "F": -1, "Bb": -2, "Eb": -3, "Ab": -4, "Db": -5, "Gb": -6, "Cb": -7,
+    "G#": 8, "D#": 9, "A#": 10, "E#": 11, "B#": 12, "Fb": -8,
+}
+MODE_FIFTHS = {
+    "maj": 0, "ion": 0, "mix": -1, "dor": -2, "m": -3, "min": -3, "aeo": -3,
+    "phr": -4, "loc": -5, "lyd": 1,
+}
+SHARP_ORDER = "FCGDAEB"
+FLAT_ORDER = "BEADGCF"
+
+# Tuplet "(p" means p notes in the time of q.
+TUPLET_TIME = {2: 3, 3: 2, 4: 3, 5: 2, 6: 2, 7: 2, 8: 3, 9: 2}
+
+BROKEN_RHYTHM = {
+    ">": (Fraction(3, 2), Fraction(1, 2)),
+    ">>": (Fraction(7, 4), Fraction(1, 4)),
+    ">>>": (Fraction(15, 8), Fraction(1, 8)),
+    "<": (Fraction(1, 2), Fraction(3, 2)),
+    "<<": (Fraction(1, 4), Fraction(7, 4)),
+    "<<<": (Fraction(1, 8), Fraction(15, 8)),
+}
+
+_LENGTH = r"\d*/*\d*"
+_TOKEN_RE = re.compile(
+    rf"""
+    (?P<space>[\s`\\]+)
+  | (?P<comment>%.*)
+  | (?P<annotation>"[^"]*")
+  | (?P<decoration>![^!]*!|\+[^+\s]*\+|[.~HLMOPSTuv])
+  | (?P<field>\[[A-Za-z]:[^\]]*\])
+  | (?P<bar>(?::*\[?\|+\]?:*|::)(?:\d+(?:[-,]\d+)*)?|\[\d+(?:[-,]\d+)*)
+  | \[(?P<chord>[^\]]*)\](?P<chord_length>{_LENGTH})
+  | (?P<accidental>\^\^|\^|__|_|=)?(?P<letter>[A-Ga-g])(?P<octave>[',]*)
+    (?P<length>{_LENGTH})
+  | (?P<rest>[zx])(?P<rest_length>{_LENGTH})
+  | Z(?P<bar_rest>\d*)
+  | (?P<tie>-)
+  | (?P<broken>[<>]{{1,3}})
+  | \((?P<tuplet>[2-9])(?::\d*){{0,2}}
+  | (?P<slur>[()])
+  | (?P<grace>\{{[^}}]*\}})
+  | (?P<spacer>y)
+    """,
+    re.VERBOSE,
+)
+_CHORD_NOTE_RE = re.compile(
+    r"(?P<accidental>\^\^|\^|__|_|=)?(?P<letter>[A-Ga-g])(?P<octave>[',]*)"
+    rf"(?P<length>{_LENGTH})"
+)
+_HEADER_RE = re.compile(r"^([A-Za-z]):(.*)$")
+
+
+class AbcParseError(ValueError):
+    """Raised for ABC input the parser does not understand."""
+
+
+def parse_length(text: str) -> Fraction:
+    """Parses a note length multiplier: "" -> 1, "2" -> 2, "/" -> 1/2, "3/2" -> 3/2."""
+    if not text:
+        return Fraction(1)
+    if "/" not in text:
+        return Fraction(int(text))
+    numerator, _, denominator = text.partition("/")
+    slashes = text.count("/")
+    if slashes > 1:
+        if denominator.strip("/"):
+            raise AbcParseError(f"Invalid note length '{text}'")
+        return Fraction(int(numerator or 1), 2 ** slashes)
+    return Fraction(int(numerator or 1), int(denominator or 2))
+
+
+def key_signature(key: str) -> Dict[str, int]:
+    """
+    Returns the accidental of each altered letter for a K: field value,
+    e.g. "G" -> {"F": 1}, "Dm" -> {"B": -1}. Unknown keys have no signature.
+    """
+    match = re.match(r"\s*([A-G][#b]?)\s*([A-Za-z]*)", key)
+    if not match or match.group(1) not in KEY_FIFTHS:
+        return {}
+    mode = match.group(2).lower()
+    mode_shift = MODE_FIFTHS.get(mode if mode == "m" else mode[:3], 0)
+    fifths = KEY_FIFTHS[match.group(1)] + mode_shift
+
+    signature: Dict[str, int] = {}
+    order, step = (SHARP_ORDER, 1) if fifths > 0 else (FLAT_ORDER, -1)
+    for i in range(abs(fifths)):
+        letter = order[i % 7]
+        signature[letter] = signature.get(letter, 0) + step
+    return signature
+
+
+class _Group:
+    """The notes of one note/chord/rest event, kept until ties are resolved."""
+
+    __slots__ = ("notes", "start", "duration")
+
+    def __init__(
+        self,
+        notes: List[pretty_midi.Note],
+        start: Fraction,
+        duration: Fraction
+    ) -> None:
+        self.notes = notes
+        self.start = start
+        self.duration = duration
+
+
+class AbcParser:
+    """
+    Incremental ABC parser. Feed text chunks as they arrive (e.g. from a token
+    stream) and collect the notes that are final; call `close` at the end.
+    """
+
+    def __init__(
+        self,
+        velocity: int = 100,
+        unit_length: Fraction = Fraction(1, 8),
+        meter: Fraction = Fraction(4, 4),
+        key: str = "C"
+    ) -> None:
+        self.velocity = velocity
+        self.unit_length = unit_length
+        self.meter = meter
+        self.key_accidentals = key_signature(key)
+        self._bar_accidentals: Dict[Tuple[str, int], int] = {}
+        self._time = Fraction(0)
+        self._buffer = ""
+        self._pending: Optional[_Group] = None
+        self._tie = False
+        self._next_factor: Optional[Fraction] = None
+        self._tuplet_left = 0
+        self._tuplet_factor = Fraction(1)
+
+    def feed(self, text: str) -> List[pretty_midi.Note]:
+        """Parses all complete lines in the buffered text."""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        notes: List[pretty_midi.Note] = []
+        for line in lines:
+            notes.extend(self._parse_line(line))
+        return notes
+
+    def close(self) -> List[pretty_midi.Note]:
+        """Parses the remaining text and flushes the last pending notes."""
+        notes = self._parse_line(self._buffer)
+        self._buffer = ""
+        if self._pending is not None:
+            notes.extend(self._pending.notes)
+            self._pending = None
+        return notes
+
+    def _parse_line(self, line: str) -> List[pretty_midi.Note]:
+        header = _HEADER_RE.match(line.strip())
+        if header and not line.lstrip().startswith("|"):
+            self._apply_field(header.group(1), header.group(2))
+            return []
+
+        notes: List[pretty_midi.Note] = []
+        position = 0
+        while position < len(line):
+            match = _TOKEN_RE.match(line, position)
+            if not match or match.end() == position:
+                raise AbcParseError(
+                    f"Unexpected {line[position]!r} in ABC line: {line!r}"
+                )
+            position = match.end()
+            notes.extend(self._handle_token(match))
+        return notes
+
+    def _handle_token(self, match: re.Match) -> List[pretty_midi.Note]:
+        kind = match.lastgroup
+        if match.group("letter"):
+            pitch = self._pitch(*match.group("accidental", "letter", "octave"))
+            return self._add_group([pitch], parse_length(match.group("length")))
+        if match.group("chord") is not None:
+            return self._add_chord(match.group("chord"), match.group("chord_length"))
+        if match.group("rest"):
+            return self._add_group([], parse_length(match.group("rest_length")))
+        if match.group("bar_rest") is not None:
+            bars = int(match.group("bar_rest") or 1)
+            return self._add_group([], bars * self.meter / self.unit_length)
+        if match.group("bar") is not None:
+            self._bar_accidentals.clear()
+        elif match.group("field"):
+            self._apply_field(match.group("field")[1], match.group("field")[3:-1])
+        elif kind == "tie":
+            self._tie = True
+        elif kind == "broken":
+            self._apply_broken_rhythm(match.group("broken"))
+        elif match.group("tuplet"):
+            p = int(match.group("tuplet"))
+            self._tuplet_left = p
+            self._tuplet_factor = Fraction(TUPLET_TIME[p], p)
+        # Annotations/chord symbols in quotes, decorations, slurs, grace notes
+        # and spacers carry no timing information.
+        return []
+
+    def _add_chord(self, body: str, length_text: str) -> List[pretty_midi.Note]:
+        pitches = []
+        lengths = []
+        position = 0
+        body = body.strip()
+        while position < len(body):
+            if body[position].isspace():
+                position += 1
+                continue
+            match = _CHORD_NOTE_RE.match(body, position)
+            if not match:
+                raise AbcParseError(
+                    f"Unexpected {body[position]!r} in ABC chord [{body}]"
+                )
+            position = match.end()
+            pitches.append(
+                self._pitch(*match.group("accidental", "letter", "octave"))
+            )
+            lengths.append(parse_length(match.group("length")))
+        if not pitches:
+            return []
+        return self._add_group(pitches, lengths[0] * parse_length(length_text))
+
+    def _add_group(
+        self,
+        pitches: List[int],
+        length: Fraction
+    ) -> List[pretty_midi.Note]:
+        duration = length * self.unit_length * 4
+        if self._tuplet_left:
+            duration *= self._tuplet_factor
+            self._tuplet_left -= 1
+        if self._next_factor is not None:
+            duration *= self._next_factor
+            self._next_factor = None
+
+        pending = self._pending
+        if (
+            self._tie
+            and pending is not None
+            and pitches
+            and sorted(pitches) == sorted(note.pitch for note in pending.notes)
+        ):
+            self._tie = False
+            pending.duration += duration
+            self._time += duration
+            for note in pending.notes:
+                note.end = float(self._time)
+            return []
+        self._tie = False
+
+        emitted = pending.notes if pending is not None else []
+        end = self._time + duration
+        self._pending = _Group(
+            [
+                pretty_midi.Note(
+                    velocity=self.velocity,
+                    pitch=pitch,
+                    start=float(self._time),
+                    end=float(end)
+                )
+                for pitch in pitches
+            ],
+            self._time,
+            duration
+        )
+        self._time = end
+        return emitted
+
+    def _apply_broken_rhythm(self, marker: str) -> None:
+        if self._pending is None:
+            raise AbcParseError(f"Broken rhythm '{marker}' without a preceding note")
+        previous_factor, next_factor = BROKEN_RHYTHM[marker]
+        pending = self._pending
+        new_duration = pending.duration * previous_factor
+        self._time += new_duration - pending.duration
+        pending.duration = new_duration
+        for note in pending.notes:
+            note.end = float(self._time)
+        self._next_factor = next_factor
+
+    def _apply_field(self, field: str, value: str) -> None:
+        value = value.strip()
+        if field == "L":
+            try:
+                self.unit_length = Fraction(value)
+            except (ValueError, ZeroDivisionError):
+                raise AbcParseError(f"Invalid unit length 'L:{value}'")
+        elif field == "M":
+            if value in ("C", "C|"):
+                self.meter = Fraction(4, 4) if value == "C" else Fraction(2, 2)
+            elif value and value.lower() != "none":
+                try:
+                    self.meter = Fraction(value)
+                except (ValueError, ZeroDivisionError):
+                    raise AbcParseError(f"Invalid meter 'M:{value}'")
+        elif field == "K":
+            self.key_accidentals = key_signature(value)
+            self._bar_accidentals.clear()
+        # Other fields (title, tempo, lyrics, ...) don't affect the notes.
+
+    def _pitch(self, accidental: Optional[str], letter: str, octave_marks: str) -> int:
+        octave = octave_marks.count("'") - octave_marks.count(",")
+        if letter.islower():
+            octave += 1
+        natural = letter.upper()
+        bar_key = (natural, octave)
+        if accidental:
+            self._bar_accidentals[bar_key] = ACCIDENTALS[accidental]
+        alter = self._bar_accidentals.get(
+            bar_key, self.key_accidentals.get(natural, 0)
+        )
+        pitch = MIDDLE_C + 12 * octave + NOTE_OFFSETS[natural] + alter
+        if not 0 <= pitch <= 127:
+            raise AbcParseError(f"Pitch out of MIDI range: {letter}{octave_marks}")
+        return pitch
+
+
+def iter_abc_notes(
+    chunks: Iterable[str] | str,
+    velocity: int = 100
+) -> Iterator[pretty_midi.Note]:
+    """
+    Yields `pretty_midi.Note`s from ABC text, which may be a string or an
+    iterable of chunks (e.g. a token stream). Notes are yielded once they are
+    final, i.e. when the following event shows they are not tied over.
+    """
+    parser = AbcParser(velocity=velocity)
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def parse_abc(abc: str, velocity: int = 100) -> List[pretty_midi.Note]:
+    """Parses a full ABC string. Raises AbcParseError if it contains no notes."""
+    notes = list(iter_abc_notes(abc, velocity=velocity))
+    if not notes:
+        raise AbcParseError("ABC input contains no notes")
+    return notes
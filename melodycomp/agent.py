@@ -1,75 +1,196 @@
 import ast
+import asyncio
+import hashlib
 import json
 import os
 import re
-from typing import Dict, List, Optional, Tuple
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import cached_property
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 import chromadb
 import yaml
-
-# from google import generativeai as genai
-from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableLambda, RunnablePassthrough
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.runnables import Runnable, RunnableLambda
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from mlx_lm import generate, load
-from mlx_lm.sample_utils import make_sampler
 
+from .cache import ResponseCache
+from .chord_index import ChordIndex
+from .embeddings import DEFAULT_EMBEDDING_MODEL, LocalEmbeddingFunction
+from .gen_chord_lib import (
+    ChordLibrary,
+    build_chord_library,
+    load_chord_library,
+    write_chord_library,
+)
+from .intent import IntentParser, PromptIntent, emotion_tags
 from .local_llm import MLX
+from .model_client import ChatGemini, get_gemini_client
+from .progression_model import (
+    DEFAULT_CONFIDENCE_THRESHOLD,
+    DEFAULT_MODEL_PATH,
+    Progression,
+    ProgressionModel,
+    enharmonic_spellings,
+)
+from .retrieval import (
+    RetrievalResult,
+    Retriever,
+    example_metadata,
+    key_pitch_class,
+)
+from .router import Backend, ModelRouter
+from .session import ConversationSession
+from .tracing import tracer, usage_attributes
+
+# Bump when the layout of indexed documents/metadata changes, so that every
+# persisted entry is considered stale and gets re-embedded.
+INDEX_VERSION = 2
+DEFAULT_INDEX_PATH = "knowledge_base/.chroma"
+
+
+def _content_hash(*parts: str) -> str:
+    """Stable hash of the given strings (plus the index version)."""
+    digest = hashlib.sha256(f"v{INDEX_VERSION}".encode("utf-8"))
+    for part in parts:
+        digest.update(b"\x00")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
 
 
 class MelodyCompAgent:
+    # Subsystems that are loaded lazily (or warmed up in the background) and
+    # reported by `readiness()`.
+    COMPONENTS = (
+        "chord_library",
+        "scales",
+        "chord_index",
+        "finetuning_examples",
+        "intent_parser",
+        "progression_model",
+        "model",
+        "client",
+        "genre_collection",
+        "examples_collection",
+        "retriever",
+    )
+
     def __init__(
         self,
-        local: bool = False,
+        local: bool | str = False,
+        persist_directory: Optional[str] = DEFAULT_INDEX_PATH,
+        warmup: bool = True,
+        response_cache: ResponseCache | bool | str = True,
+        model: Optional[Any] = None,
+        embedding_function: Optional[Any] = None,
+        embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+        max_history_tokens: int = 1000,
+        fast_path_confidence: Optional[float] = DEFAULT_CONFIDENCE_THRESHOLD,
+        model_deadline: float = 60.0,
         **kwargs
     ) -> None:
+        """
+        Args:
+            local: Use the local MLX model instead of Gemini. "auto" routes each
+                call to whichever of the two is likelier to answer within
+                `model_deadline`, failing over to the other on errors.
+            persist_directory: Where the Chroma index is stored (None = in-memory).
+            warmup: Start loading all subsystems in parallel background threads.
+                If False, each subsystem is loaded on first use.
+            response_cache: Cache for first-turn chord results. True uses a default
+                exact-match `ResponseCache`, "semantic" also serves near-duplicate
+                prompts using the agent's embedding function, False disables caching.
+                A `ResponseCache` instance is used as is.
+            model: A ready LangChain chat model/LLM to use instead of building
+                Gemini or MLX (e.g. a deterministic stand-in for benchmarks, or
+                a `ModelRouter` over other backends).
+            embedding_function: Chroma embedding function for both collections
+                (default: a `LocalEmbeddingFunction` for `embedding_model`).
+            embedding_model: sentence-transformers model of the default embedding
+                function. Document vectors are cached on disk next to the index.
+            max_history_tokens: History budget of each conversation session; older
+                exchanges are dropped once a session's history exceeds it.
+            fast_path_confidence: Simple first-turn requests that name a key and
+                a length ("8-bar house in F minor") are answered by the
+                statistical progression model, without any LLM call, when its
+                confidence is at least this. None always uses the LLM.
+            model_deadline: Seconds a routed model call (local="auto") may
+                take, failovers included.
+        """
         print("..Building agent with knowledge base..")
-
-        if not os.path.exists("knowledge_base/chords.json"):
-            os.system("python gen_chord_lib.py")
-        with open("knowledge_base/chords.json", "r") as f:
-            self.chord_library = json.load(f)
-        self._load_scales_config()
-        print("✅ Chord library loaded.")
-
-        try:
-            with open("knowledge_base/finetuning_data.json", "r") as f:
-                self.finetuning_examples = json.load(f)
-            print(f"✅ Loaded {len(self.finetuning_examples)} few-shot examples.")
-        except FileNotFoundError:
-            print("⚠️ finetuning_data.json not found. The agent will run without dynamic examples.")  # noqa: E501
-            self.finetuning_examples = []
-
         self.local = local
-        if self.local:
-            self.model = MLX.from_model_path("mlx-community/Qwen3-8B-4bit", temp=0.7)
-        else:
-            with open("./configs/config.yaml", "r") as f:
-                config = yaml.safe_load(f)
-                api_key = config.get("gemini_api_key")
-            if not api_key:
-                raise ValueError("Gemini API key not found in ./configs/config.yaml")
-            # genai.configure(api_key=api_key)
-            # self.model = genai.GenerativeModel("gemini-2.5-flash")
-            self.model = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                google_api_key=api_key,
-                temperature=0.7
+        self.model_deadline = model_deadline
+        self.persist_directory = persist_directory
+        if embedding_function is None:
+            if persist_directory:
+                os.makedirs(persist_directory, exist_ok=True)
+            embedding_function = LocalEmbeddingFunction(
+                embedding_model,
+                cache_path=(
+                    os.path.join(persist_directory, "embeddings.sqlite")
+                    if persist_directory else None
+                ),
             )
+        self.embedding_function = embedding_function
+        self._model_override = model
+        self.fast_path_confidence = fast_path_confidence
+        # Explicit checks: an empty ResponseCache is falsy (it has __len__).
+        self.response_cache: Optional[ResponseCache]
+        if isinstance(response_cache, ResponseCache):
+            self.response_cache = response_cache
+        elif response_cache is True:
+            self.response_cache = ResponseCache()
+        elif response_cache == "semantic":
+            self.response_cache = ResponseCache(
+                embedding_function=getattr(
+                    self.embedding_function, "embed_query", self.embedding_function
+                )
+            )
+        elif response_cache is False:
+            self.response_cache = None
+        else:
+            raise ValueError(f"Unknown response_cache: {response_cache!r}")
 
-        # Setup ChromaDB client and collections
-        self.client = chromadb.Client()
-        self.genre_collection = self._setup_genre_collection()
-        self.examples_collection = self._setup_examples_collection()
-
-        self.memory = ConversationBufferMemory(
-            return_messages=True,
-            memory_key="memory",
-            input_key="input"
+        self._components: Dict[str, Future] = {}
+        self._components_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.COMPONENTS),
+            thread_name_prefix="melodycomp-warmup"
         )
+        self._loaders: Dict[str, Callable[[], Any]] = {
+            "chord_library": self._load_chord_library,
+            "scales": self._load_scales_config,
+            "chord_index": self._build_chord_index,
+            "finetuning_examples": self._load_finetuning_examples,
+            "intent_parser": self._build_intent_parser,
+            "progression_model": self._load_progression_model,
+            "model": self._load_model,
+            "client": self._load_client,
+            "genre_collection": self._setup_genre_collection,
+            "examples_collection": self._setup_examples_collection,
+            "retriever": self._build_retriever,
+        }
 
+        # The agent core (model, indexes, chord library) is shared between
+        # sessions; conversation history lives in per-session objects.
+        self.max_history_tokens = max_history_tokens
+        self.default_session = self.new_session()
+
+        # Ordered from most to least shared (instructions, per-key palette,
+        # per-query genre context and examples, history) so the local model's
+        # prompt cache can reuse the longest possible prefix.
         self.prompt = ChatPromptTemplate.from_messages([
             ("system", """
             You are an expert music theorist and composer.
@@ -83,55 +204,360 @@ class MelodyCompAgent:
 
             ## CONTEXT ON GENRE
             {genre_context}
+
+            {few_shot_examples}
             """ # noqa E501
             ),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{input}"),
         ])
-        self.conversation_chain = (
+
+        if warmup:
+            self.warm_up()
+            print("✅ Agent created, subsystems are warming up in the background.")
+        else:
+            print("✅ Agent created, subsystems will load on first use.")
+
+    def new_session(
+        self,
+        session_id: Optional[str] = None,
+        **kwargs
+    ) -> ConversationSession:
+        """Creates conversation state for one user, e.g. one browser session."""
+        kwargs.setdefault("max_history_tokens", self.max_history_tokens)
+        return ConversationSession(session_id, **kwargs)
+
+    # --- Lazy components ---
+
+    def warm_up(
+        self,
+        components: Optional[Iterable[str]] = None
+    ) -> Dict[str, Future]:
+        """
+        Starts loading the given subsystems (default: all) in parallel background
+        threads and returns their futures. Already loaded/loading ones are reused.
+        """
+        names = list(components) if components is not None else list(self.COMPONENTS)
+        futures = {}
+        for name in names:
+            if name not in self._loaders:
+                raise ValueError(
+                    f"Unknown component '{name}'. "
+                    f"Available: {', '.join(self.COMPONENTS)}"
+                )
+            future, owner = self._claim_component(name)
+            if owner:
+                self._executor.submit(self._load_component, name, future)
+            futures[name] = future
+        return futures
+
+    def _component(self, name: str) -> Any:
+        """
+        Returns a loaded subsystem, loading it in the calling thread if nobody
+        has started it yet, or waiting for the thread that is loading it.
+        """
+        future, owner = self._claim_component(name)
+        if owner:
+            self._load_component(name, future)
+        return future.result()
+
+    def _claim_component(self, name: str) -> Tuple[Future, bool]:
+        """Returns the future for a subsystem and whether the caller must load it."""
+        with self._components_lock:
+            future = self._components.get(name)
+            if future is not None:
+                return future, False
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._components[name] = future
+            return future, True
+
+    def _load_component(self, name: str, future: Future) -> None:
+        started = time.perf_counter()
+        try:
+            future.set_result(self._loaders[name]())
+            print(f"✅ '{name}' ready in {time.perf_counter() - started:.2f}s.")
+        except BaseException as e:
+            print(f"🔴 Failed to load '{name}': {e}")
+            future.set_exception(e)
+
+    def readiness(self) -> Dict[str, str]:
+        """
+        Reports the state of every subsystem: "cold" (not requested yet),
+        "loading", "ready" or "failed".
+        """
+        status = {}
+        for name in self.COMPONENTS:
+            future = self._components.get(name)
+            if future is None:
+                status[name] = "cold"
+            elif not future.done():
+                status[name] = "loading"
+            elif future.exception() is not None:
+                status[name] = "failed"
+            else:
+                status[name] = "ready"
+        return status
+
+    def is_ready(self, *components: str) -> bool:
+        """True if all given subsystems (default: all) are loaded."""
+        status = self.readiness()
+        return all(status[name] == "ready" for name in components or self.COMPONENTS)
+
+    def wait_until_ready(
+        self,
+        *components: str,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Blocks until the given subsystems (default: all) are loaded, starting them
+        if needed. Returns False if the timeout expired first.
+        """
+        futures = self.warm_up(components or None)
+        done, not_done = wait(list(futures.values()), timeout=timeout)
+        return not not_done
+
+    @property
+    def chord_library(self) -> ChordLibrary:
+        return self._component("chord_library")
+
+    @property
+    def chord_index(self) -> ChordIndex:
+        return self._component("chord_index")
+
+    @property
+    def finetuning_examples(self) -> List[Dict]:
+        return self._component("finetuning_examples")
+
+    @property
+    def intent_parser(self) -> IntentParser:
+        return self._component("intent_parser")
+
+    @property
+    def progression_model(self) -> ProgressionModel:
+        return self._component("progression_model")
+
+    @property
+    def model(self) -> Any:
+        return self._component("model")
+
+    @property
+    def client(self) -> Any:
+        return self._component("client")
+
+    @property
+    def genre_collection(self) -> chromadb.Collection:
+        return self._component("genre_collection")
+
+    @property
+    def examples_collection(self) -> chromadb.Collection:
+        return self._component("examples_collection")
+
+    @property
+    def NOTES(self) -> List[str]:
+        return self._component("scales")["notes"]
+
+    @property
+    def SCALE_INTERVALS(self) -> Dict[str, List[int]]:
+        return self._component("scales")["scale_intervals"]
+
+    @property
+    def CHORD_TYPES_PER_DEGREE(self) -> Dict[str, List[List[str]]]:
+        return self._component("scales")["chord_types_per_degree"]
+
+    @cached_property
+    def conversation_chain(self):
+        return RunnableLambda(self._chord_chain)
+
+    def _chord_chain(self, inputs: Dict) -> Runnable:
+        """
+        Chain for one chord request. The local MLX model is constrained to emit
+        nothing but a list of chords from the requested key's palette (or the
+        whole chord library), so its output always parses.
+        """
+        model = self.model
+        if isinstance(model, MLX) or (
+            isinstance(model, ModelRouter) and model.accepts("allowed_chords")
+        ):
+            model = model.bind(allowed_chords=self._allowed_chords(inputs["input"]))
+        return (
             {
                 "input": lambda x: x["input"],
                 "genre_context": lambda x: x["genre_context"],
+                "few_shot_examples": lambda x: x.get("few_shot_examples", ""),
                 "chord_palette": lambda x: x["chord_palette"],
-                "history": RunnableLambda(self.memory.load_memory_variables) | (lambda x: x.get("history", [])) # noqa E501,
+                "history": lambda x: x.get("history", []),
             }
             | self.prompt
-            | self.model
+            | model
         )
 
-        print("✅ Agent ready!")
+    def _load_chord_library(
+        self,
+        path: str = "knowledge_base/chords.bin",
+        json_path: str = "knowledge_base/chords.json"
+    ) -> ChordLibrary:
+        """
+        Memory-maps the binary chord library. It is (re)built from chords.json,
+        or generated from scratch, when missing or older than the JSON file.
+        """
+        json_is_newer = os.path.exists(json_path) and (
+            not os.path.exists(path)
+            or os.path.getmtime(json_path) > os.path.getmtime(path)
+        )
+        if json_is_newer:
+            with open(json_path, "r") as f:
+                write_chord_library(path, json.load(f))
+        elif not os.path.exists(path):
+            build_chord_library(path)
+        chord_library = load_chord_library(path)
+        print(f"✅ Chord library loaded ({len(chord_library)} chords).")
+        return chord_library
+
+    def _build_chord_index(self) -> ChordIndex:
+        return ChordIndex(
+            self.chord_library,
+            self.NOTES,
+            self.SCALE_INTERVALS,
+            self.CHORD_TYPES_PER_DEGREE,
+        )
+
+    def _load_finetuning_examples(self) -> List[Dict]:
+        try:
+            with open("knowledge_base/finetuning_data.json", "r") as f:
+                finetuning_examples = json.load(f)
+            print(f"✅ Loaded {len(finetuning_examples)} few-shot examples.")
+        except FileNotFoundError:
+            print("⚠️ finetuning_data.json not found. "
+                  "The agent will run without dynamic examples.")
+            finetuning_examples = []
+        return finetuning_examples
+
+    def _build_intent_parser(self) -> IntentParser:
+        return IntentParser(
+            self.SCALE_INTERVALS,
+            genres=self.genre_ids,
+            moods=emotion_tags(self.finetuning_examples),
+        )
+
+    def _load_progression_model(
+        self,
+        path: str = DEFAULT_MODEL_PATH,
+        examples_path: str = "knowledge_base/finetuning_data.json"
+    ) -> ProgressionModel:
+        """
+        Loads the model trained with `python -m melodycomp.progression_model
+        train`, or trains one from the few-shot examples (a few milliseconds)
+        if there is none.
+        """
+        if os.path.exists(path):
+            model = ProgressionModel.load(path)
+            if (
+                os.path.exists(examples_path)
+                and os.path.getmtime(examples_path) > os.path.getmtime(path)
+            ):
+                print("⚠️ progression_model.json is older than finetuning_data.json. "
+                      "Retrain it with "
+                      "`python -m melodycomp.progression_model train`.")
+        else:
+            model = ProgressionModel.train(self.finetuning_examples)
+        print(f"✅ Progression model ready ({model.progressions} progressions).")
+        return model
+
+    def _load_model(self) -> Any:
+        if self._model_override is not None:
+            return self._model_override
+        if self.local == "auto":
+            return self._build_router()
+        if self.local:
+            return MLX.from_model_path("mlx-community/Qwen3-8B-4bit", temp=0.7)
+
+        # The shared client (connection pool, rate limit, retries) is read from
+        # ./configs/config.yaml and also serves the ABC conversion fallback.
+        return ChatGemini(client=get_gemini_client(), temperature=0.7)
+
+    def _build_router(self) -> ModelRouter:
+        # Local first: with the same latency prior it wins the tie (and is
+        # free) until its own samples say otherwise; Gemini takes over when
+        # the single local slot is busy or observed to be slow.
+        backends = []
+        try:
+            backends.append(Backend(
+                "mlx",
+                MLX.from_model_path("mlx-community/Qwen3-8B-4bit", temp=0.7),
+                accepts=frozenset({"allowed_chords"}),
+                max_concurrency=1,
+                expected_latency=5.0,
+            ))
+        except ImportError as e:
+            print(f"⚠️ Local model unavailable ({e}), routing to Gemini only")
+        client = get_gemini_client()
+        backends.append(Backend(
+            "gemini",
+            ChatGemini(client=client, temperature=0.7),
+            max_concurrency=max(1, int(client.rate_limiter.capacity)),
+            expected_latency=5.0,
+        ))
+        return ModelRouter(backends, deadline=self.model_deadline)
+
+    def _collection_name(self, name: str) -> str:
+        # Vectors of different embedding models can't share a collection.
+        slug = getattr(self.embedding_function, "slug", None)
+        return f"{name}-{slug}" if slug else name
+
+    def _load_client(self) -> Any:
+        # The index is persisted on disk and only re-embeds documents whose
+        # content hash changed.
+        if self.persist_directory:
+            return chromadb.PersistentClient(path=self.persist_directory)
+        return chromadb.Client()
 
     def _load_scales_config(
         self,
         config_path: str = "knowledge_base/scales.yaml"
-    ) -> None:
+    ) -> Dict[str, Any]:
         """
         Loads music theory configuration from YAML file.
         Falls back to hardcoded values if file doesn't exist.
         """
         if not os.path.exists(config_path):
             print(f"⚠️ {config_path} not found. Using fallback scale configuration.")
-            self._load_fallback_scales()
-            return
+            return self._load_fallback_scales()
 
         with open(config_path, "r") as f:
             config = yaml.safe_load(f)
 
-        self.NOTES: List[str] = config.get('notes', [])
-        self.SCALE_INTERVALS: Dict[str, List[int]] = config.get("scale_intervals", {})
-        self.CHORD_TYPES_PER_DEGREE: Dict[str, List[List[str]]] = config.get(
-            "chord_types_per_degree", {}
-        )
+        scales = {
+            "notes": config.get("notes", []),
+            "scale_intervals": config.get("scale_intervals", {}),
+            "chord_types_per_degree": config.get("chord_types_per_degree", {}),
+        }
 
         # Validate configuration
-        if not self.NOTES or not self.SCALE_INTERVALS or not self.CHORD_TYPES_PER_DEGREE:  # noqa: E501
+        if not all(scales.values()):
             print("⚠️ Incomplete scales configuration. Using fallback.")
-            self._load_fallback_scales()
-            return
+            return self._load_fallback_scales()
 
-        available_modes = list(self.SCALE_INTERVALS.keys())
+        available_modes = list(scales["scale_intervals"].keys())
         print(f"✅ Scales config loaded: {len(available_modes)} modes available")
         print(f"   Available modes: {', '.join(available_modes)}")
+        return scales
+
+    def _load_fallback_scales(self) -> Dict[str, Any]:
+        """Minimal major/minor configuration used when scales.yaml is unusable."""
+        return {
+            "notes": ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"],
+            "scale_intervals": {
+                "major": [0, 2, 4, 5, 7, 9, 11],
+                "minor": [0, 2, 3, 5, 7, 8, 10],
+            },
+            "chord_types_per_degree": {
+                "major": [["", "maj7"], ["m", "m7"], ["m", "m7"], ["", "maj7"],
+                          ["", "7"], ["m", "m7"], ["dim", "m7b5"]],
+                "minor": [["m", "m7"], ["dim", "m7b5"], ["", "maj7"], ["m", "m7"],
+                          ["m", "m7"], ["", "maj7"], ["", "7"]],
+            },
+        }
 
     def _setup_genre_collection(
         self,
@@ -139,14 +565,25 @@ class MelodyCompAgent:
         knowledge_base_path: str = "knowledge_base/genres",
     ) -> chromadb.Collection:
         """
-        Reads all .md files from the knowledge base, embeds them, and stores them
-        in a ChromaDB collection. Creates the collection if it doesn't exist.
+        Syncs all .md files from the knowledge base into a ChromaDB collection.
+        Only new or changed files (by content hash) are split and embedded, and
+        chunks belonging to deleted files are evicted from the index.
         """
-        collection = self.client.get_or_create_collection(name=name)
+        collection = self.client.get_or_create_collection(
+            name=self._collection_name(name),
+            embedding_function=self.embedding_function,
+        )
+
+        indexed_hashes: Dict[str, str] = {}
+        for metadata in collection.get(include=["metadatas"])["metadatas"] or []:
+            if metadata and "source" in metadata:
+                indexed_hashes[metadata["source"]] = metadata.get("content_hash", "")
 
         all_chunks = []
         all_ids = []
         all_metadatas = []
+        seen_sources = set()
+        changed_sources = []
 
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
@@ -154,24 +591,42 @@ class MelodyCompAgent:
             length_function=len
         )
         if os.path.exists(knowledge_base_path):
-            for filename in os.listdir(knowledge_base_path):
-                if filename.endswith(".md"):
-                    genre_id = filename.split(".")[0]
-                    with open(os.path.join(knowledge_base_path, filename), "r") as f:
-                        for i, chunk in enumerate(text_splitter.split_text(f.read())):
-                            chunk_id = f"{genre_id}-{i}"
-                            all_chunks.append(chunk)
-                            all_ids.append(chunk_id)
-                            all_metadatas.append({"genre": genre_id})
-
-            if all_ids:
-                collection.add(
-                    ids=all_ids,
-                    documents=all_chunks,
-                    metadatas=all_metadatas
-                )
+            for filename in sorted(os.listdir(knowledge_base_path)):
+                if not filename.endswith(".md"):
+                    continue
+                genre_id = filename.split(".")[0]
+                seen_sources.add(filename)
+                with open(os.path.join(knowledge_base_path, filename), "r") as f:
+                    text = f.read()
+
+                content_hash = _content_hash(filename, text)
+                if indexed_hashes.get(filename) == content_hash:
+                    continue
+                if filename in indexed_hashes:
+                    changed_sources.append(filename)
+
+                for i, chunk in enumerate(text_splitter.split_text(text)):
+                    all_chunks.append(chunk)
+                    all_ids.append(f"{genre_id}-{i}")
+                    all_metadatas.append({
+                        "genre": genre_id,
+                        "source": filename,
+                        "content_hash": content_hash,
+                    })
+
+        stale_sources = changed_sources + sorted(set(indexed_hashes) - seen_sources)
+        if stale_sources:
+            collection.delete(where={"source": {"$in": stale_sources}})
+        if all_ids:
+            collection.add(
+                ids=all_ids,
+                documents=all_chunks,
+                metadatas=all_metadatas
+            )
 
-        print(f"✅ Collection '{collection.name}' is set up with {collection.count()} documents.")  # noqa: E501
+        print(f"✅ Collection '{collection.name}' is set up with "
+              f"{collection.count()} documents ({len(all_ids)} chunks embedded, "
+              f"{len(stale_sources)} files evicted/replaced).")
         return collection
 
     def _setup_examples_collection(
@@ -179,126 +634,66 @@ class MelodyCompAgent:
         name: str = "few-shot-examples"
     ) -> chromadb.Collection:
         """
-        Creates a ChromaDB collection for few-shot examples and indexes them.
-        Uses semantic embeddings instead of keyword matching.
+        Syncs the few-shot examples into a ChromaDB collection.
+        Examples are keyed by content hash, so only new or edited examples are
+        embedded and removed examples are evicted.
         """
-        collection = self.client.get_or_create_collection(name=name)
+        collection = self.client.get_or_create_collection(
+            name=self._collection_name(name),
+            embedding_function=self.embedding_function,
+        )
 
-        # Only add examples if collection is empty and we have examples to add
-        if collection.count() == 0 and self.finetuning_examples:
-            documents = []
-            ids = []
-            metadatas = []
+        wanted: Dict[str, Dict] = {}
+        for example in self.finetuning_examples:
+            content_hash = _content_hash(json.dumps(example, sort_keys=True))
+            wanted[f"example_{content_hash[:24]}"] = example
 
-            for i, example in enumerate(self.finetuning_examples):
-                documents.append(example["instruction"])
-                ids.append(f"example_{i}")
-                metadatas.append({
-                    "output": example["output"],
-                    "instruction": example["instruction"]
-                })
+        indexed_ids = set(collection.get(include=[])["ids"])
+        stale_ids = sorted(indexed_ids - set(wanted))
+        if stale_ids:
+            collection.delete(ids=stale_ids)
 
+        new_ids = [example_id for example_id in wanted if example_id not in indexed_ids]
+        if new_ids:
             collection.add(
-                documents=documents,
-                ids=ids,
-                metadatas=metadatas
+                documents=[wanted[i]["instruction"] for i in new_ids],
+                ids=new_ids,
+                metadatas=[example_metadata(wanted[i]) for i in new_ids]
             )
-            print(f"✅ Indexed {len(documents)} few-shot examples in vector DB.")
-        else:
-            print(f"✅ Few-shot examples collection has {collection.count()} examples.")
+        print(f"✅ Few-shot examples collection has {collection.count()} examples "
+              f"({len(new_ids)} embedded, {len(stale_ids)} evicted).")
 
         return collection
 
-    def _get_few_shot_examples(
-        self,
-        query: str,
-        n_examples: int = 2
-    ) -> str:
-        """
-        Finds the most relevant examples using semantic similarity via ChromaDB.
-        Replaces the old keyword-based matching method.
-        """
-        if self.examples_collection.count() == 0:
-            return ""
-
-        results = self.examples_collection.query(
-            query_texts=[query],
-            n_results=min(n_examples, self.examples_collection.count())
+    def _build_retriever(self) -> Retriever:
+        # Queries are embedded once with the collections' embedding function
+        # and the embedding is shared by both searches.
+        return Retriever(
+            self.genre_collection,
+            self.examples_collection,
+            self.embedding_function,
+            self.parse_intent,
         )
 
-        if not results["documents"][0]:
-            return ""
-
-        formatted_examples = "### HIGH-QUALITY EXAMPLES\n"
-        for i, (instruction, metadata, distance) in enumerate(zip(
-            results["documents"][0],
-            results["metadatas"][0],
-            results["distances"][0]
-        )):
-            # Convert distance to similarity score (lower distance = higher similarity)
-            similarity_score = 1 - distance
-            formatted_examples += f"Example {i+1} (Similarity: {similarity_score:.3f}):\n"  # noqa: E501
-            formatted_examples += f"- Request: \"{instruction}\"\n"
-            formatted_examples += f"- Response: {metadata['output']}\n\n"
-
-        return formatted_examples
-
-    def _query_knowledge_base(
+    def parse_intent(
         self,
-        collection: chromadb.Collection,
-        query: str,
-        n_results: int = 5
-    ) -> str:
-        """
-        Queries the collection and formats the results into a single context string.
-        """
-        if collection.count() == 0:
-            return "No genre context available."
-
-        results = collection.query(
-            query_texts=[query],
-            n_results=min(n_results, collection.count())
-        )
-        retrieved_docs = results["documents"][0]
-        context = "\n\n---\n\n".join(retrieved_docs)
-        return context
+        user_input: str
+    ) -> PromptIntent:
+        """Key, genre, length, tempo and moods of a prompt, parsed locally."""
+        return self.intent_parser.parse(user_input)
 
-    def _parse_key_from_query(
-        self,
-        query: str
-    ) -> Optional[Tuple[str, str]]:
+    def scale_pitch_classes(self, user_input: str) -> Optional[List[int]]:
         """
-        Parses a query like "...in A# minor..." and returns the root and mode.
-        Now supports all modes defined in scales.yaml.
+        Pitch classes of the key named in the prompt, from the scales.yaml
+        intervals that also build the diatonic palette, or None if no key is named.
         """
-        available_modes = list(self.SCALE_INTERVALS.keys())
-        mode_aliases = {
-            "ionian": "major",
-            "aeolian": "minor"
-        }
-
-        all_modes = available_modes + list(mode_aliases.keys())
-        modes_pattern = "|".join(all_modes)
-
-        pattern = rf"in\s+([A-G][#b]?)\s+({modes_pattern})"
-        match = re.search(pattern, query, re.IGNORECASE)
-
-        if match:
-            root = match.group(1)
-            mode = match.group(2).lower()
-
-            # Convert aliases
-            if mode in mode_aliases:
-                mode = mode_aliases[mode]
-
-            # Validate mode exists in configuration
-            if mode not in self.SCALE_INTERVALS:
-                print(f"⚠️ Mode '{mode}' not found in configuration. Available: {', '.join(available_modes)}")
-                return None
-
-            return root, mode
-
-        return None
+        intent = self.parse_intent(user_input)
+        if intent.key_pc is None or intent.mode is None:
+            return None
+        return [
+            (intent.key_pc + interval) % 12
+            for interval in self.SCALE_INTERVALS[intent.mode]
+        ]
 
     def _get_diatonic_palette(
         self,
@@ -306,8 +701,8 @@ class MelodyCompAgent:
         mode: str
     ) -> List[str]:
         """
-        Generates diatonic triads, 7ths, and their valid extensions for a given key.
-        loads from scales.yaml config.
+        Returns the diatonic triads, 7ths, and their valid extensions for a given key,
+        precomputed from the scales.yaml config by the chord index.
 
         Args:
             root: Root note (e.g., "C", "F#", "Bb")
@@ -322,150 +717,513 @@ class MelodyCompAgent:
             print(f"⚠️ Invalid mode '{mode}'. Available: {available_modes}")
             return []
 
-        # Validate root note
+        # Validate root note (flat spellings map to the sharps of NOTES)
+        root_pc = key_pitch_class(root)
+        if root not in self.NOTES and root_pc is not None and len(self.NOTES) == 12:
+            root = self.NOTES[root_pc]
         if root not in self.NOTES:
             print(f"⚠️ Invalid root note '{root}'. Must be one of: {self.NOTES}")
             return []
 
-        root_index = self.NOTES.index(root)
-        intervals = self.SCALE_INTERVALS[mode]
-        chord_qualities_for_mode = self.CHORD_TYPES_PER_DEGREE[mode]
-
-        # Verify chord qualities list matches scale length
-        if len(chord_qualities_for_mode) != len(intervals):
-            print(f"⚠️ Configuration error: Chord qualities length ({len(chord_qualities_for_mode)}) "  # noqa: E501
-                  f"doesn't match scale intervals ({len(intervals)}) for mode '{mode}'")
-            return []
-
-        full_palette = []
-
-        for degree_index in range(len(intervals)):
-            note_index = (root_index + intervals[degree_index]) % 12
-            note_name = self.NOTES[note_index]
-
-            for quality in chord_qualities_for_mode[degree_index]:
-                chord_name = f"{note_name}{quality}"
+        return self.chord_index.palette(root, mode)
 
-                if chord_name in self.chord_library:
-                    full_palette.append(chord_name)
-
-        return list(dict.fromkeys(full_palette))
+    def _allowed_chords(
+        self,
+        user_input: str
+    ) -> List[str]:
+        """Chords the local model may emit: the key's palette, else the library."""
+        key_info = self.parse_intent(user_input).key
+        palette = self._get_diatonic_palette(*key_info) if key_info else []
+        return palette or self.chord_index.names
 
     def _chords_to_notes_json(
         self,
         chords: list,
         duration_per_chord: float = 2.0
     ) -> List:
-        notes = []
-        current_time = 0.0
-        note_map = {"C": 60, "C#": 61, "Db": 61, "D": 62, "D#": 63, "Eb": 63, "E": 64,
-                    "F": 65, "F#": 66, "Gb": 66, "G": 67, "G#": 68, "Ab": 68, "A": 69,
-                    "A#": 70, "Bb": 70, "B": 71}
-        for chord_name in chords:
-            chord_name = chord_name.strip()
-            root_match = re.match(r"([A-G][#b]?)", chord_name)
-            if not root_match:
-                continue
-            root_note = root_match.group(1)
-            quality = chord_name[len(root_note):]
-            base_chord_name = "C" + quality
-            base_chord_notes = self.chord_library.get(base_chord_name)
-            if not base_chord_notes:
-                continue
-            transposition = note_map.get(root_note, 60) - 60
-            for base_pitch in base_chord_notes:
-                transposed_pitch = base_pitch + transposition
-                notes.append({
-                    "pitch": transposed_pitch,
-                    "velocity": 100,
-                    "start_time": current_time,
-                    "end_time": current_time + duration_per_chord
-                })
-            current_time += duration_per_chord
-        return notes
+        with tracer.span("note_rendering", chords=len(chords)):
+            return self.chord_index.render([chords], duration_per_chord)[0]
 
-    def run_conversation(
+    def _build_chord_palette(
         self,
         user_input: str
-    ) -> Dict | None:
-        genre_context = self._query_knowledge_base(
-            collection=self.genre_collection,
-            query=user_input,
+    ) -> str:
+        """Builds the palette section of the system prompt from the requested key."""
+        with tracer.span("prompt_build"):
+            key_info = self.parse_intent(user_input).key
+            if key_info:
+                root, mode = key_info
+                palette = self._get_diatonic_palette(root, mode)
+                return ("You MUST primarily use chords from this list: \n"
+                        f"- {', '.join(palette)}\n")
+            return "No specific key was requested. You are free to choose."
+
+    def _retrieve_context(
+        self,
+        user_input: str
+    ) -> RetrievalResult:
+        """Genre context and few-shot examples, prefiltered by genre and key."""
+        return self._component("retriever").retrieve(user_input)
+
+    @staticmethod
+    def _message_text(response: Any) -> str:
+        """Chat models return messages, plain LLMs (MLX) return strings."""
+        if hasattr(response, "content"):
+            return response.content
+        return response
+
+    @staticmethod
+    def _parse_chord_list(model_output_str: str) -> list:
+        """Extracts the Python list of chords from the model output."""
+        with tracer.span("list_parsing"):
+            match = re.search(r"\[.*\]", model_output_str, re.DOTALL)
+            if not match:
+                raise ValueError("No valid list found in model output.")
+            return ast.literal_eval(match.group(0))
+
+    @cached_property
+    def genre_ids(self) -> List[str]:
+        """Genre ids of the knowledge base (the markdown file names)."""
+        knowledge_base_path = "knowledge_base/genres"
+        if not os.path.exists(knowledge_base_path):
+            return []
+        return sorted(
+            filename.split(".")[0]
+            for filename in os.listdir(knowledge_base_path)
+            if filename.endswith(".md")
         )
-        key_info = self._parse_key_from_query(user_input)
-        if key_info:
-            root, mode = key_info #
-            palette = self._get_diatonic_palette(root, mode) #
-            chord_palette_str = f"You MUST primarily use chords from this list: \n- {', '.join(palette)}\n" # noqa: E501
-        else:
-            chord_palette_str = "No specific key was requested. You are free to choose."
+
+    def _get_cached_response(
+        self,
+        user_input: str,
+        session: ConversationSession
+    ) -> Optional[Dict]:
+        """
+        Looks up a cached result for the prompt. Only first turns are served from
+        the cache, since follow-ups depend on the conversation history.
+        """
+        if self.response_cache is None or not session.is_empty:
+            return None
+        with tracer.span("cache_lookup") as span:
+            result = self.response_cache.get(self.parse_intent(user_input).cache_key)
+            span["hit"] = result is not None
+        if result is not None:
+            print("✅ Serving chord progression from the response cache.")
+            session.add_exchange(user_input, str(result["chords"]))
+        return result
+
+    def _cache_response(
+        self,
+        user_input: str,
+        result: Dict
+    ) -> None:
+        if self.response_cache is None:
+            return
+        self.response_cache.put(self.parse_intent(user_input).cache_key, result)
+
+    def _fast_path_response(
+        self,
+        user_input: str,
+        session: ConversationSession
+    ) -> Optional[Dict]:
+        """
+        Answers a simple first-turn request (key, length and at most a genre
+        and tempo) with the statistical progression model, or returns None to
+        use the LLM. Moods and anything else the intent parser doesn't cover
+        go to the LLM.
+        """
+        if self.fast_path_confidence is None or not session.is_empty:
+            return None
+        intent = self.parse_intent(user_input)
+        key_info = intent.key
+        if not key_info or not intent.bars or intent.moods:
+            return None
+
+        model = self.progression_model
+        with tracer.span("progression_model") as span:
+            progression = None
+            # Modes the model only knows through their major/minor family
+            # (e.g. locrian) would come out with the family's chords.
+            known = model.has_mode(key_info[1])
+            if known and not model.unknown_words(intent.remainder):
+                palette = self._get_diatonic_palette(*key_info)
+                progression = model.generate(
+                    *key_info,
+                    intent.bars,
+                    genres=model.resolve_genres(user_input),
+                    vocabulary=enharmonic_spellings(palette),
+                )
+            confidence = progression.confidence if progression else 0.0
+            used = confidence >= self.fast_path_confidence
+            span.update(confidence=round(confidence, 3), used=used)
+        if not used:
+            return None
+
+        chords_list = list(progression.chords)
+        session.add_exchange(user_input, str(chords_list))
+        result = {
+            "chords": chords_list,
+            "notes": self._chords_to_notes_json(chords=chords_list),
+            "tips": self._fast_path_tips(progression, key_info),
+        }
+        self._cache_response(user_input, result)
+        return result
+
+    @staticmethod
+    def _fast_path_tips(
+        progression: Progression,
+        key_info: Tuple[str, str]
+    ) -> str:
+        root, mode = key_info
+        return (
+            f"**In {root} {mode.replace('_', ' ')}:** "
+            f"{' - '.join(progression.numerals)}\n\n"
+            "This progression was built from the curated example progressions "
+            "without an LLM call. Ask a follow-up for variations and music "
+            "theory tips."
+        )
+
+    @tracer.traced("run_conversation")
+    def run_conversation(
+        self,
+        user_input: str,
+        session: Optional[ConversationSession] = None
+    ) -> Dict | None:
+        session = session or self.default_session
+        cached = self._get_cached_response(user_input, session)
+        if cached is not None:
+            return cached
+        fast = self._fast_path_response(user_input, session)
+        if fast is not None:
+            return fast
+
+        context = self._retrieve_context(user_input)
+        chord_palette_str = self._build_chord_palette(user_input)
 
         inputs = {
             "input": user_input,
-            "genre_context": genre_context,
+            "genre_context": context.genre_context,
+            "few_shot_examples": context.few_shot_examples,
             "chord_palette": chord_palette_str,
+            "history": session.history(),
         }
 
-        response = self.conversation_chain.invoke(inputs)
-        if hasattr(response, "content"):
-            model_output_str = response.content
-        else:
-            model_output_str = response
+        with tracer.span("llm_call") as span:
+            response = self.conversation_chain.invoke(inputs)
+            span.update(usage_attributes(response))
+        model_output_str = self._message_text(response)
 
-        self.memory.save_context(inputs, {"output": model_output_str})
+        session.add_exchange(user_input, model_output_str)
 
         try:
-            match = re.search(r"\[.*\]", model_output_str, re.DOTALL) #
-            if match:
-                chords_list = ast.literal_eval(match.group(0)) #
-            else:
-                raise ValueError("No valid list found in model output.") #
+            chords_list = self._parse_chord_list(model_output_str)
 
             final_notes_json = self._chords_to_notes_json(chords=chords_list)
             tips_and_tricks = self._generate_music_theory_tips(user_input, chords_list)
 
-            return {
+            result = {
                 "chords": chords_list,
                 "notes": final_notes_json,
                 "tips": tips_and_tricks
             }
+            self._cache_response(user_input, result)
+            return result
 
         except (ValueError, SyntaxError):
             print(f"--- ERROR: Could not parse chord list from model ---\nRaw output: {model_output_str}") # noqa: E501
             return None
 
-    def _generate_music_theory_tips(
+    @tracer.traced("arun_conversation")
+    async def arun_conversation(
         self,
+        user_input: str,
+        session: Optional[ConversationSession] = None
+    ) -> Dict | None:
+        """
+        Coroutine version of `run_conversation` for serving many sessions on one
+        event loop. Retrieval, palette building and model warm-up run concurrently
+        in worker threads, the LLM calls are awaited natively, and tip generation
+        overlaps with chord-to-note rendering.
+        """
+        session = session or self.default_session
+        cached = await asyncio.to_thread(
+            self._get_cached_response, user_input, session
+        )
+        if cached is not None:
+            return cached
+        fast = await asyncio.to_thread(self._fast_path_response, user_input, session)
+        if fast is not None:
+            return fast
+
+        context, chord_palette_str, chain = await asyncio.gather(
+            asyncio.to_thread(self._retrieve_context, user_input),
+            asyncio.to_thread(self._build_chord_palette, user_input),
+            asyncio.to_thread(lambda: self.conversation_chain),
+        )
+
+        inputs = {
+            "input": user_input,
+            "genre_context": context.genre_context,
+            "few_shot_examples": context.few_shot_examples,
+            "chord_palette": chord_palette_str,
+            "history": session.history(),
+        }
+
+        with tracer.span("llm_call") as span:
+            response = await chain.ainvoke(inputs)
+            span.update(usage_attributes(response))
+        model_output_str = self._message_text(response)
+
+        session.add_exchange(user_input, model_output_str)
+
+        try:
+            chords_list = self._parse_chord_list(model_output_str)
+        except (ValueError, SyntaxError):
+            print("--- ERROR: Could not parse chord list from model ---\n"
+                  f"Raw output: {model_output_str}")
+            return None
+
+        tips_task = asyncio.create_task(
+            self._agenerate_music_theory_tips(user_input, chords_list)
+        )
+        final_notes_json = await asyncio.to_thread(
+            self._chords_to_notes_json, chords_list
+        )
+
+        result = {
+            "chords": chords_list,
+            "notes": final_notes_json,
+            "tips": await tips_task
+        }
+        self._cache_response(user_input, result)
+        return result
+
+    @staticmethod
+    def _parse_partial_chord_list(buffer: str) -> Optional[list]:
+        """
+        Returns the chord list as soon as it has been closed in a partial model
+        stream, or None if it is not complete (or not parseable) yet.
+        """
+        start = buffer.find("[")
+        if start == -1:
+            return None
+        end = buffer.find("]", start)
+        if end == -1:
+            return None
+        try:
+            chords = ast.literal_eval(buffer[start:end + 1])
+        except (ValueError, SyntaxError):
+            return None
+        return chords if isinstance(chords, list) else None
+
+    @tracer.traced("stream_conversation")
+    def stream_conversation(
+        self,
+        user_input: str,
+        session: Optional[ConversationSession] = None
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming version of `run_conversation`. Yields `(stage, payload)` events:
+
+        - ("chords", list): as soon as the list closes in the model stream
+          (the rest of the chord completion is not consumed),
+        - ("notes", list): the rendered notes,
+        - ("tips_token", str): tip text chunks as they arrive,
+        - ("done", dict): the same result `run_conversation` returns,
+        - ("error", str): the raw model output if no chord list was found.
+        """
+        session = session or self.default_session
+        cached = self._get_cached_response(user_input, session)
+        if cached is None:
+            cached = self._fast_path_response(user_input, session)
+        if cached is not None:
+            yield from self._replay_cached_response(cached)
+            return
+
+        context = self._retrieve_context(user_input)
+        inputs = {
+            "input": user_input,
+            "genre_context": context.genre_context,
+            "few_shot_examples": context.few_shot_examples,
+            "chord_palette": self._build_chord_palette(user_input),
+            "history": session.history(),
+        }
+
+        model_output_str = ""
+        chords_list = None
+        with tracer.span("llm_call", streaming=True):
+            for chunk in self.conversation_chain.stream(inputs):
+                model_output_str += self._message_text(chunk)
+                chords_list = self._parse_partial_chord_list(model_output_str)
+                if chords_list is not None:
+                    break
+
+        session.add_exchange(user_input, model_output_str)
+
+        if chords_list is None:
+            print("--- ERROR: Could not parse chord list from model ---\n"
+                  f"Raw output: {model_output_str}")
+            yield "error", model_output_str
+            return
+        yield "chords", chords_list
+
+        final_notes_json = self._chords_to_notes_json(chords=chords_list)
+        yield "notes", final_notes_json
+
+        tips_and_tricks = ""
+        with tracer.span("tips_call", streaming=True):
+            for chunk in self.model.stream(self._tips_prompt(user_input, chords_list)):
+                token = self._message_text(chunk)
+                tips_and_tricks += token
+                yield "tips_token", token
+
+        result = {
+            "chords": chords_list,
+            "notes": final_notes_json,
+            "tips": tips_and_tricks
+        }
+        self._cache_response(user_input, result)
+        yield "done", result
+
+    @staticmethod
+    def _replay_cached_response(result: Dict) -> Iterator[Tuple[str, Any]]:
+        yield "chords", result["chords"]
+        yield "notes", result["notes"]
+        if result.get("tips"):
+            yield "tips_token", result["tips"]
+        yield "done", result
+
+    @tracer.traced("astream_conversation")
+    async def astream_conversation(
+        self,
+        user_input: str,
+        session: Optional[ConversationSession] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Async iterator version of `stream_conversation` (same events)."""
+        session = session or self.default_session
+        cached = await asyncio.to_thread(
+            self._get_cached_response, user_input, session
+        )
+        if cached is None:
+            cached = await asyncio.to_thread(
+                self._fast_path_response, user_input, session
+            )
+        if cached is not None:
+            for event in self._replay_cached_response(cached):
+                yield event
+            return
+
+        context, chord_palette_str, chain = await asyncio.gather(
+            asyncio.to_thread(self._retrieve_context, user_input),
+            asyncio.to_thread(self._build_chord_palette, user_input),
+            asyncio.to_thread(lambda: self.conversation_chain),
+        )
+        inputs = {
+            "input": user_input,
+            "genre_context": context.genre_context,
+            "few_shot_examples": context.few_shot_examples,
+            "chord_palette": chord_palette_str,
+            "history": session.history(),
+        }
+
+        model_output_str = ""
+        chords_list = None
+        with tracer.span("llm_call", streaming=True):
+            async for chunk in chain.astream(inputs):
+                model_output_str += self._message_text(chunk)
+                chords_list = self._parse_partial_chord_list(model_output_str)
+                if chords_list is not None:
+                    break
+
+        session.add_exchange(user_input, model_output_str)
+
+        if chords_list is None:
+            print("--- ERROR: Could not parse chord list from model ---\n"
+                  f"Raw output: {model_output_str}")
+            yield "error", model_output_str
+            return
+        yield "chords", chords_list
+
+        final_notes_json = self._chords_to_notes_json(chords=chords_list)
+        yield "notes", final_notes_json
+
+        tips_and_tricks = ""
+        with tracer.span("tips_call", streaming=True):
+            tips_prompt = self._tips_prompt(user_input, chords_list)
+            async for chunk in self.model.astream(tips_prompt):
+                token = self._message_text(chunk)
+                tips_and_tricks += token
+                yield "tips_token", token
+
+        result = {
+            "chords": chords_list,
+            "notes": final_notes_json,
+            "tips": tips_and_tricks
+        }
+        self._cache_response(user_input, result)
+        yield "done", result
+
+    @staticmethod
+    def _tips_prompt(
         original_prompt: str,
         chords: list
     ) -> str:
-        """Generates musical tips based on the user's request and the generated chords.
-        TODO: Add functionality here, probably some RAG for getting better tips and tricks?""" # noqa: E501
+        # The fixed instructions come first so local models can reuse their
+        # KV cache across requests; only the tail differs.
         chords_str = " -> ".join(chords)
-        tips_prompt = f"""
-            A user requested the following: "{original_prompt}".
-            The chord progression generated was: {chords_str}.
-
-            Based on this, provide 2-3 brief, helpful music theory or production tips.
+        return f"""
+            Provide 2-3 brief, helpful music theory or production tips for the request and chord progression below.
             Also, suggest one or two alternative musical scales that would be excellent for improvising a melody over these chords.
             Format your response as markdown.
+
+            A user requested the following: "{original_prompt}".
+            The chord progression generated was: {chords_str}.
         """ # noqa: E501
-        response = self.model.invoke(tips_prompt)
-        return response.content
+
+    def _generate_music_theory_tips(
+        self,
+        original_prompt: str,
+        chords: list
+    ) -> str:
+        """Generates musical tips based on the user's request and the generated chords.
+        TODO: Add functionality here, probably some RAG for getting better tips and tricks?""" # noqa: E501
+        with tracer.span("tips_call") as span:
+            response = self.model.invoke(self._tips_prompt(original_prompt, chords))
+            span.update(usage_attributes(response))
+        return self._message_text(response)
+
+    async def _agenerate_music_theory_tips(
+        self,
+        original_prompt: str,
+        chords: list
+    ) -> str:
+        """Async version of `_generate_music_theory_tips`."""
+        model = await asyncio.to_thread(lambda: self.model)
+        with tracer.span("tips_call") as span:
+            response = await model.ainvoke(self._tips_prompt(original_prompt, chords))
+            span.update(usage_attributes(response))
+        return self._message_text(response)
 
 
 def main():
-    """Main function to run the agent for testing."""
+    """
+    Main function to run the agent for testing (see `melodycomp.batch` for bulk
+    runs).
+    """
     try:
         agent = MelodyCompAgent(local=False)
+        session = agent.new_session()
         query = "I want a 16-bar atmospheric trip-hop progression in A minor that builds tension towards the end" # noqa: E501
 
-        result1 = agent.run_conversation(query=query, n_results=5, temp=0.2)
+        result1 = agent.run_conversation(query, session=session)
         if result1:
             print("\n--- Progression 1 ---")
             print(result1["chords"])
 
-            result2 = agent.run(query=query, previous_progression=result1["chords"], n_results=5, temp=0.5) # noqa: E501
+            result2 = agent.run_conversation(
+                "Give me a variation of that progression with a darker ending.",
+                session=session
+            )
             if result2:
                 print("\n--- Progression 2 (Variation) ---")
                 print(result2["chords"])
@@ -0,0 +1,171 @@
+"""
+Algorithmic melody drafts.
+
+A CPU-only tier below the melody LLM: builds a melody from the chord list and
+the key's scale in about a millisecond, so the app can show a draft right away
+and the LLM melody becomes an on-demand upgrade.
+
+The melody walks a ladder of scale (and chord) tones in a register. Each bar
+(one chord) gets a rhythm template; each note's scale-step move is sampled
+from a first-order Markov chain over contour moves (mostly steps, leaps
+followed by a step back), and notes on strong beats snap to the nearest chord
+tone, so weak beats become passing and neighbour tones. The last note
+resolves to the final chord's root when it's in range.
+"""
+import random
+import re
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import pretty_midi
+
+from .gen_chord_lib import NOTE_MAP
+from .melody_generator import MelodyCandidate, chord_pitch_classes, score_melody
+
+# Note lengths in beats per 4/4 bar; negative lengths are rests.
+RHYTHM_TEMPLATES: List[Tuple[float, ...]] = [
+    (1, 1, 1, 1),
+    (1.5, 0.5, 1, 1),
+    (2, 1, 1),
+    (1, 1, 2),
+    (0.5, 0.5, 1, 2),
+    (1, 0.5, 0.5, 2),
+    (0.5, 0.5, 0.5, 0.5, 1, 1),
+    (1.5, 0.5, 2),
+    (3, 1),
+    (1, 1, 1, -1),
+]
+
+# Contour moves in ladder steps, and P(next move | previous move).
+MOVES = (-4, -3, -2, -1, 0, 1, 2, 3, 4)
+_STEP_WEIGHTS = (0.02, 0.04, 0.12, 0.28, 0.08, 0.28, 0.12, 0.04, 0.02)
+CONTOUR_TRANSITIONS: Dict[int, Tuple[float, ...]] = {
+    move: _STEP_WEIGHTS for move in MOVES
+}
+# After a leap, step back the other way (gap fill).
+for _leap in (-4, -3, 3, 4):
+    CONTOUR_TRANSITIONS[_leap] = (
+        (0.0, 0.0, 0.15, 0.7, 0.1, 0.05, 0.0, 0.0, 0.0) if _leap > 0
+        else (0.0, 0.0, 0.0, 0.05, 0.1, 0.7, 0.15, 0.0, 0.0)
+    )
+# Keep a direction going for a while after a step.
+CONTOUR_TRANSITIONS[1] = (0.01, 0.02, 0.06, 0.18, 0.08, 0.4, 0.17, 0.05, 0.03)
+CONTOUR_TRANSITIONS[-1] = tuple(reversed(CONTOUR_TRANSITIONS[1]))
+
+MOTIF_REPEAT_PROBABILITY = 0.5
+STRONG_BEATS = (0.0, 2.0)
+
+
+def _ladder(pitch_classes: Set[int], low: int, high: int) -> List[int]:
+    return [pitch for pitch in range(low, high + 1) if pitch % 12 in pitch_classes]
+
+
+def _nearest(ladder: List[int], pitch: int, allowed: Set[int], direction: int) -> int:
+    """Closest ladder pitch with a pitch class in `allowed` (ties: `direction`)."""
+    candidates = [p for p in ladder if p % 12 in allowed] or ladder
+    return min(candidates, key=lambda p: (abs(p - pitch), -direction * (p - pitch)))
+
+
+def generate_algorithmic_melody(
+    chords: Sequence[str],
+    scale: Optional[Iterable[int]] = None,
+    seed: int = 0,
+    chord_duration: float = 2.0,
+    register: Tuple[int, int] = (62, 84),
+    program: int = 40,
+) -> pretty_midi.Instrument:
+    """
+    Generates a melody over `chords` (one chord per bar of `chord_duration`
+    seconds, matching the agent's chord rendering).
+
+    Args:
+        scale: Pitch classes of the key (see `MelodyCompAgent.scale_pitch_classes`).
+            Defaults to all chord tones of the progression.
+        seed: Same seed and inputs give the same melody.
+        register: Lowest and highest MIDI pitch of the melody.
+        program: General MIDI program (default: Violin, like the LLM melody).
+    """
+    rng = random.Random(seed)
+    instrument = pretty_midi.Instrument(program=program)
+    chord_tones = [chord_pitch_classes(chord) for chord in chords]
+    known = [tones for tones in chord_tones if tones]
+    scale_set = set(scale) if scale else set().union(*known)
+    if not chords or not scale_set:
+        return instrument
+
+    # Chromatic chord tones (borrowed chords) join the ladder too.
+    ladder = _ladder(scale_set.union(*known), *register)
+    beat = chord_duration / 4
+    middle = (register[0] + register[1]) // 2
+    pitch = _nearest(ladder, middle, chord_tones[0] or scale_set, 1)
+    move = 0
+    template = rng.choice(RHYTHM_TEMPLATES)
+
+    for bar, tones in enumerate(chord_tones):
+        tones = tones or scale_set
+        if bar and rng.random() >= MOTIF_REPEAT_PROBABILITY:
+            template = rng.choice(RHYTHM_TEMPLATES)
+        position = 0.0
+        for length in template:
+            onset = position
+            position += abs(length)
+            if length < 0:
+                continue
+
+            move = rng.choices(MOVES, weights=CONTOUR_TRANSITIONS[move])[0]
+            index = bisect_left(ladder, pitch) + move
+            if index < 0 or index >= len(ladder):
+                # Bounce off the edges of the register.
+                move = -move
+                index = bisect_left(ladder, pitch) + move
+            target = ladder[max(0, min(index, len(ladder) - 1))]
+            strong = onset in STRONG_BEATS or length >= 2
+            if strong:
+                target = _nearest(ladder, target, tones, move)
+            pitch = target
+
+            start = bar * chord_duration + onset * beat
+            instrument.notes.append(pretty_midi.Note(
+                velocity=min(127, (96 if strong else 80) + rng.randint(-6, 6)),
+                pitch=pitch,
+                start=start,
+                end=start + abs(length) * beat * 0.95,
+            ))
+
+    # End on the root of the last chord, held to the end of the bar.
+    root = chord_root(chords[-1])
+    if instrument.notes and root is not None:
+        last = instrument.notes[-1]
+        last.pitch = _nearest(ladder, last.pitch, {root}, 0)
+        last.end = len(chords) * chord_duration
+    return instrument
+
+
+def chord_root(chord_name: str) -> Optional[int]:
+    """Pitch class of a chord name's root ("F#m7" -> 6), or None."""
+    match = re.match(r"([A-G][#b]?)", chord_name.strip())
+    return NOTE_MAP[match.group(1)] % 12 if match else None
+
+
+def draft_melody_candidates(
+    chords: Sequence[str],
+    scale: Optional[Iterable[int]] = None,
+    n: int = 4,
+    seed: int = 0,
+    chord_duration: float = 2.0,
+) -> List[MelodyCandidate]:
+    """
+    `n` algorithmic melodies ranked by `score_melody`, best first, in the same
+    form as `generate_melody_candidates` returns (with an empty `abc`).
+    """
+    candidates = []
+    for i in range(n):
+        instrument = generate_algorithmic_melody(
+            chords, scale, seed=seed + i, chord_duration=chord_duration
+        )
+        if instrument.notes:
+            score = score_melody(
+                instrument.notes, list(chords), bar_length=chord_duration
+            )
+            candidates.append(MelodyCandidate(instrument, "", score, source="draft"))
+    return sorted(candidates, key=lambda candidate: candidate.score, reverse=True)
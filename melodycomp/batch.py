@@ -0,0 +1,323 @@
+"""
+Batch generation of chord progressions (and optionally melodies) as MIDI.
+
+Reads prompts from a JSONL file, one object per line:
+
+    {"id": "triphop-001", "prompt": "An 8-bar trip hop progression in A minor"}
+
+and processes them with bounded concurrency on one shared agent. Every finished
+prompt is appended to `<output-dir>/results.jsonl` and written as
+`<output-dir>/midi/<id>.mid` right away, and its id is recorded in
+`<output-dir>/checkpoint.txt`, so an interrupted run can simply be restarted:
+completed ids are skipped. Prompts that failed are listed (once, with their
+latest error) in `<output-dir>/failures.jsonl` and retried by the next run.
+
+    python -m melodycomp.batch prompts.jsonl --output-dir sample_pack --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import pretty_midi
+
+from .agent import MelodyCompAgent
+from .melody_worker import configure_melody_pool, get_melody_pool
+from .midi import Track, encode_midi
+
+CHECKPOINT_FILE = "checkpoint.txt"
+RESULTS_FILE = "results.jsonl"
+FAILURES_FILE = "failures.jsonl"
+
+
+class GenerationError(RuntimeError):
+    """The model answered, but no chord list could be parsed from it."""
+
+
+def read_prompts(path: str) -> List[Tuple[str, str]]:
+    """Returns `(id, prompt)` pairs. Lines without an "id" are numbered."""
+    prompts = []
+    seen: Set[str] = set()
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({e})") from e
+            if "prompt" not in record:
+                raise ValueError(f"{path}:{line_number}: missing 'prompt'")
+            prompt_id = str(record.get("id", line_number))
+            if prompt_id in seen:
+                raise ValueError(f"{path}:{line_number}: duplicate id '{prompt_id}'")
+            seen.add(prompt_id)
+            prompts.append((prompt_id, record["prompt"]))
+    return prompts
+
+
+def load_checkpoint(output_dir: str) -> Set[str]:
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def prune_failures(output_dir: str, done: Set[str]) -> None:
+    """Keeps only the latest failure of each id that hasn't completed since."""
+    path = os.path.join(output_dir, FAILURES_FILE)
+    if not os.path.exists(path):
+        return
+    latest: Dict[str, str] = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                prompt_id = json.loads(line)["id"]
+                latest.pop(prompt_id, None)
+                latest[prompt_id] = line.rstrip("\n")
+    with open(path + ".tmp", "w") as f:
+        f.writelines(
+            line + "\n" for prompt_id, line in latest.items() if prompt_id not in done
+        )
+    os.replace(path + ".tmp", path)
+
+
+def midi_filename(prompt_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", prompt_id) + ".mid"
+
+
+def write_midi(
+    path: str,
+    notes: List[Dict],
+    melody: Optional[pretty_midi.Instrument] = None
+) -> None:
+    tracks = [Track.from_notes_json(notes)]
+    if melody is not None:
+        tracks.append(Track.from_instrument(melody))
+    # Bypasses the shared MIDI cache: every batch file is written exactly once.
+    data = encode_midi(tracks)
+    # Write to a temporary name first so a crash never leaves a truncated file.
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+class BatchRunner:
+    """
+    Runs prompts through one shared `MelodyCompAgent` with at most `concurrency`
+    prompts in flight. Failed attempts (model errors or unparseable output) are
+    retried with exponential backoff and full jitter.
+    """
+
+    def __init__(
+        self,
+        agent: MelodyCompAgent,
+        output_dir: str,
+        concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        melody: bool = False,
+    ) -> None:
+        self.agent = agent
+        self.output_dir = output_dir
+        self.midi_dir = os.path.join(output_dir, "midi")
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.melody = melody
+        # Never queue more melodies than the worker pool accepts, so prompts wait
+        # here instead of failing with `MelodyQueueFull`.
+        self._melody_slots = asyncio.Semaphore(
+            get_melody_pool().max_pending if melody else 1
+        )
+
+    async def _generate(self, prompt: str) -> Dict:
+        # A fresh session per prompt: batch prompts are independent first turns.
+        result = await self.agent.arun_conversation(
+            prompt, session=self.agent.new_session()
+        )
+        if result is None:
+            raise GenerationError("Could not parse a chord list from the model output")
+        return result
+
+    async def _generate_with_retry(self, prompt: str) -> Dict:
+        attempt = 0
+        while True:
+            try:
+                return await self._generate(prompt)
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2 ** attempt)
+                )
+                print(f"⚠️ Attempt {attempt + 1} failed ({type(e).__name__}: {e}), "
+                      f"retrying in {delay:.1f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _melody_for(
+        self,
+        chords: List[str]
+    ) -> Optional[pretty_midi.Instrument]:
+        from .melody_generator import generate_melody_for_chords
+
+        async with self._melody_slots:
+            return await asyncio.to_thread(generate_melody_for_chords, chords)
+
+    async def _process(self, prompt_id: str, prompt: str) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"id": prompt_id, "prompt": prompt}
+        try:
+            result = await self._generate_with_retry(prompt)
+            melody = await self._melody_for(result["chords"]) if self.melody else None
+            midi_path = os.path.join(self.midi_dir, midi_filename(prompt_id))
+            await asyncio.to_thread(
+                write_midi, midi_path, result["notes"], melody or None
+            )
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            return record
+        record.update(
+            chords=result["chords"],
+            notes=result["notes"],
+            tips=result.get("tips"),
+            midi=os.path.relpath(midi_path, self.output_dir),
+            melody=bool(melody),
+        )
+        return record
+
+    async def run(
+        self,
+        prompts: List[Tuple[str, str]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yields one record per pending prompt, in completion order."""
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in prompts:
+            queue.put_nowait(item)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker() -> None:
+            while True:
+                try:
+                    prompt_id, prompt = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await results.put(await self._process(prompt_id, prompt))
+
+        workers = [
+            asyncio.create_task(worker())
+            for _ in range(min(self.concurrency, len(prompts)))
+        ]
+        try:
+            for _ in range(len(prompts)):
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def run_to_files(self, prompts: List[Tuple[str, str]]) -> Tuple[int, int]:
+        """
+        Processes all prompts not yet in the checkpoint, streaming results to
+        disk (failures to their own file). Returns `(completed, failed)`
+        counts for this run.
+        """
+        os.makedirs(self.midi_dir, exist_ok=True)
+        done = load_checkpoint(self.output_dir)
+        pending = [
+            (prompt_id, prompt)
+            for prompt_id, prompt in prompts
+            if prompt_id not in done
+        ]
+        if len(pending) < len(prompts):
+            skipped = len(prompts) - len(pending)
+            print(f"⏭️ Skipping {skipped} prompts already completed.")
+
+        completed = failed = 0
+        results_path = os.path.join(self.output_dir, RESULTS_FILE)
+        failures_path = os.path.join(self.output_dir, FAILURES_FILE)
+        checkpoint_path = os.path.join(self.output_dir, CHECKPOINT_FILE)
+        try:
+            with open(results_path, "a") as results_file, \
+                    open(failures_path, "a") as failures_file, \
+                    open(checkpoint_path, "a") as checkpoint_file:
+                async for record in self.run(pending):
+                    if "error" in record:
+                        failures_file.write(json.dumps(record) + "\n")
+                        failures_file.flush()
+                        failed += 1
+                        print(f"❌ {record['id']}: {record['error']}")
+                        continue
+                    results_file.write(json.dumps(record) + "\n")
+                    results_file.flush()
+                    # Only checkpoint once the result line and MIDI file are on disk.
+                    checkpoint_file.write(record["id"] + "\n")
+                    checkpoint_file.flush()
+                    done.add(record["id"])
+                    completed += 1
+                    print(f"✅ {record['id']}: {' -> '.join(record['chords'])}")
+        finally:
+            # Retried ids leave their old failure behind; keep only the latest.
+            prune_failures(self.output_dir, done)
+        return completed, failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate chord progressions and MIDI files for a JSONL file "
+                    "of prompts."
+    )
+    parser.add_argument("input", help="JSONL file with one {\"id\", \"prompt\"} "
+                                      "object per line.")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Maximum number of prompts processed at once.")
+    parser.add_argument("--retries", type=int, default=3,
+                        help="Retries per prompt after a model error or "
+                             "unparseable output.")
+    parser.add_argument("--backoff", type=float, default=1.0,
+                        help="Base delay in seconds for exponential backoff.")
+    parser.add_argument("--max-backoff", type=float, default=30.0)
+    parser.add_argument("--melody", action="store_true",
+                        help="Also generate a melody and add it to each MIDI file.")
+    parser.add_argument("--melody-workers", type=int, default=1,
+                        help="Melody worker processes (each loads its own model).")
+    parser.add_argument("--local", action="store_true", help="Use the local MLX model.")
+    parser.add_argument("--route", action="store_true",
+                        help="Route each call to the local model or Gemini by "
+                             "latency and load.")
+    parser.add_argument("--deadline", type=float, default=60.0,
+                        help="Seconds a routed model call may take, "
+                             "failovers included.")
+    args = parser.parse_args(argv)
+
+    prompts = read_prompts(args.input)
+    if args.melody:
+        configure_melody_pool(processes=args.melody_workers).warm_up()
+    agent = MelodyCompAgent(
+        local="auto" if args.route else args.local, model_deadline=args.deadline
+    )
+    runner = BatchRunner(
+        agent,
+        args.output_dir,
+        concurrency=args.concurrency,
+        retries=args.retries,
+        backoff=args.backoff,
+        max_backoff=args.max_backoff,
+        melody=args.melody,
+    )
+    completed, failed = asyncio.run(runner.run_to_files(prompts))
+    print(f"\nDone: {completed} completed, {failed} failed. "
+          f"Output in {args.output_dir}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
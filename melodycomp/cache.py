@@ -0,0 +1,171 @@
+import copy
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CacheKey = Tuple[str, Hashable, Hashable]
+# (value, created_at, size_bytes, embedding)
+CacheEntry = Tuple[Any, float, int, Optional[np.ndarray]]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercases, drops punctuation (keeping '#' for sharps) and collapses spaces."""
+    prompt = prompt.lower().replace("-", " ")
+    prompt = re.sub(r"[^\w#\s]", " ", prompt)
+    return " ".join(prompt.split())
+
+
+def make_cache_key(
+    prompt: str,
+    key_info: Optional[Tuple[str, str]] = None,
+    genre: Optional[str] = None
+) -> CacheKey:
+    """Cache key from the normalized prompt, the parsed (root, mode) and the genre."""
+    return normalize_prompt(prompt), key_info, genre
+
+
+class ResponseCache:
+    """
+    Thread-safe cache of chord-progression results.
+
+    Eviction is configurable and the bounds can be combined:
+    - LRU: at most `max_entries` entries, least recently used evicted first.
+    - TTL: entries older than `ttl_seconds` are dropped.
+    - Size: the JSON size of all cached values stays below `max_bytes`.
+
+    If an `embedding_function` (any Chroma-style callable mapping a list of texts
+    to a list of vectors) is given, a miss falls back to a similarity tier that
+    serves the most similar cached prompt with the same key/mode, genre and
+    numbers (bar counts, BPM) if its cosine similarity is above
+    `similarity_threshold`.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = 512,
+        ttl_seconds: Optional[float] = 3600.0,
+        max_bytes: Optional[int] = None,
+        embedding_function: Optional[Callable[[List[str]], Sequence]] = None,
+        similarity_threshold: float = 0.95,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.embedding_function = embedding_function
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        """Returns a copy of the cached value for `key` (or a near duplicate)."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return copy.deepcopy(entry[0])
+
+        if self.embedding_function is not None:
+            match = self._get_similar(key)
+            if match is not None:
+                return match
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, key: CacheKey, value: Any) -> None:
+        size = len(json.dumps(value, default=str))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        embedding = self._embed(key[0]) if self.embedding_function is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (
+                copy.deepcopy(value), time.monotonic(), size, embedding
+            )
+            self._bytes += size
+            self._expire()
+            while (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size, for sizing the cache."""
+        with self._lock:
+            hits = self._counters["hits"] + self._counters["semantic_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_similar(self, key: CacheKey) -> Optional[Any]:
+        query = self._embed(key[0])
+        scope = self._scope(key)
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for candidate_key, (_, _, _, embedding) in self._entries.items():
+                if embedding is None or self._scope(candidate_key) != scope:
+                    continue
+                score = float(np.dot(query, embedding))
+                if score >= best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self._counters["semantic_hits"] += 1
+            return copy.deepcopy(self._entries[best_key][0])
+
+    @staticmethod
+    def _scope(key: CacheKey) -> Tuple:
+        # Near duplicates must agree on key/mode, genre and any numbers
+        # ("8-bar" vs "16-bar" embed very closely but are different requests).
+        return key[1], key[2], tuple(re.findall(r"\d+", key[0]))
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embedding_function([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self) -> None:
+        if self.ttl_seconds is None:
+            return
+        deadline = time.monotonic() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry[1] < deadline]
+        for key in expired:
+            self._remove(key)
+            self._counters["expirations"] += 1
+
+    def _remove(self, key: CacheKey) -> None:
+        self._bytes -= self._entries.pop(key)[2]
@@ -0,0 +1,170 @@
+"""
+Constrained decoding of chord lists.
+
+`ChordListGrammar` is a character-level automaton accepting exactly a Python
+list of quoted chord names from a fixed vocabulary, e.g. `['Am7', 'Dm7', 'G7']`.
+`ChordListLogitsProcessor` applies it during sampling: at every step only tokens
+that keep the output a valid prefix of such a list may be sampled, and once the
+list is closed only end-of-sequence is, so generation stops right there.
+"""
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Automaton phases.
+_START = 0         # before "["
+_OPEN = 1          # after "[", expecting the first quote
+_CHORD = 2         # inside a quoted chord name
+_AFTER_CHORD = 3   # after a closing quote, expecting "," or "]"
+_AFTER_COMMA = 4   # after ",", expecting the next quote
+_DONE = 5          # after "]"
+
+_TERMINAL = ""     # trie key marking the end of a chord name
+_QUOTES = ("'", '"')
+
+# (phase, trie node or None, quote char inside a chord / " " after whitespace)
+State = Tuple[int, Optional[Dict], Optional[str]]
+
+
+class ChordListGrammar:
+    """
+    Accepts `[` 'chord' (`,` 'chord')* `]`, with single whitespace characters
+    between items.
+    """
+
+    def __init__(self, chords: Iterable[str]) -> None:
+        self.trie: Dict = {}
+        for chord in chords:
+            chord = chord.strip()
+            if not chord:
+                continue
+            node = self.trie
+            for char in chord:
+                node = node.setdefault(char, {})
+            node[_TERMINAL] = {}
+        if not self.trie:
+            raise ValueError("A chord list grammar needs at least one chord")
+        self.start: State = (_START, None, None)
+
+    def advance(self, state: Optional[State], text: str) -> Optional[State]:
+        """State after consuming `text`, or None if it can't continue a valid list."""
+        for char in text:
+            if state is None:
+                return None
+            state = self._step(state, char)
+        return state
+
+    def _step(self, state: State, char: str) -> Optional[State]:
+        phase, node, quote = state
+        if phase == _CHORD:
+            if char == quote:
+                return (_AFTER_CHORD, None, None) if _TERMINAL in node else None
+            child = node.get(char)
+            return (_CHORD, child, quote) if child is not None else None
+        if phase == _DONE:
+            return None
+        if char.isspace():
+            # At most one whitespace character between items, so a constrained
+            # model can't stall on endless whitespace.
+            return None if quote else (phase, None, " ")
+        if phase == _START:
+            return (_OPEN, None, None) if char == "[" else None
+        if phase in (_OPEN, _AFTER_COMMA):
+            return (_CHORD, self.trie, char) if char in _QUOTES else None
+        if phase == _AFTER_CHORD:
+            if char == ",":
+                return (_AFTER_COMMA, None, None)
+            if char == "]":
+                return (_DONE, None, None)
+        return None
+
+    @staticmethod
+    def is_done(state: Optional[State]) -> bool:
+        return state is not None and state[0] == _DONE
+
+
+@lru_cache(maxsize=64)
+def _cached_grammar(chords: Tuple[str, ...]) -> ChordListGrammar:
+    return ChordListGrammar(chords)
+
+
+def chord_list_grammar(chords: Sequence[str]) -> ChordListGrammar:
+    """Shared grammar for a chord vocabulary (palettes repeat across requests)."""
+    return _cached_grammar(tuple(chords))
+
+
+class ChordListLogitsProcessor:
+    """
+    Logits processor (`(tokens, logits) -> logits`, the mlx-lm convention) that
+    only lets the model emit a chord list accepted by `grammar`.
+
+    Checking every vocabulary entry at each step would be too slow, so only the
+    `top_k` most likely tokens are checked; if none of them fits, the rest of
+    the vocabulary is searched in order of likelihood for the best one that does.
+    The processor is stateful: use one instance per generation.
+    """
+
+    def __init__(
+        self,
+        grammar: ChordListGrammar,
+        decode: Callable[[List[int]], str],
+        eos_token_ids: Iterable[int],
+        top_k: int = 64,
+    ) -> None:
+        self.grammar = grammar
+        self.decode = decode
+        self.eos_token_ids = sorted(set(eos_token_ids))
+        self.top_k = top_k
+        self.state: Optional[State] = grammar.start
+        self._seen_tokens: Optional[int] = None
+        self._token_texts: Dict[int, str] = {}
+
+    @property
+    def done(self) -> bool:
+        return self.grammar.is_done(self.state)
+
+    def _token_text(self, token: int) -> str:
+        text = self._token_texts.get(token)
+        if text is None:
+            text = self._token_texts[token] = self.decode([token])
+        return text
+
+    def _accepts(self, token: int) -> bool:
+        text = self._token_text(token)
+        return bool(text) and self.grammar.advance(self.state, text) is not None
+
+    def bias(self, tokens: Sequence[int], logits: np.ndarray) -> np.ndarray:
+        """
+        Additive bias for `logits` (1-D scores over the vocabulary): 0 for tokens
+        allowed in the current state, -inf for all others.
+        """
+        # `tokens` holds the prompt plus everything sampled so far; the last one
+        # is the token sampled after our previous call.
+        if self._seen_tokens is None:
+            self._seen_tokens = len(tokens)
+        elif len(tokens) > self._seen_tokens:
+            last_token = int(np.asarray(tokens[-1]))
+            self.state = self.grammar.advance(self.state, self._token_text(last_token))
+            self._seen_tokens = len(tokens)
+
+        bias = np.full(logits.shape[-1], -np.inf, dtype=np.float32)
+        if self.state is None or self.done:
+            bias[self.eos_token_ids] = 0.0
+            return bias
+
+        k = min(self.top_k, logits.shape[-1])
+        candidates = np.argpartition(-logits, k - 1)[:k]
+        allowed = [int(token) for token in candidates if self._accepts(int(token))]
+        if not allowed:
+            for token in np.argsort(-logits)[k:]:
+                if self._accepts(int(token)):
+                    allowed.append(int(token))
+                    break
+        bias[allowed] = 0.0
+        return bias
+
+    def __call__(self, tokens: Sequence[int], logits: Any) -> Any:
+        """Numpy version of the processor: returns the constrained logits."""
+        logits = np.asarray(logits, dtype=np.float32)
+        return logits + self.bias(tokens, logits.reshape(-1)).reshape(logits.shape)
@@ -0,0 +1,153 @@
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+
+class ChordIndex:
+    """
+    Precomputed lookup tables over the chord library and scales configuration.
+
+    Built once at load time, it holds:
+    - `palettes`: the diatonic palette for every (root, mode) pair,
+    - `pitches`: an (n_chords, max_notes) int16 table of MIDI pitches, padded
+      with -1, where row i belongs to the chord with id i (`chord_ids`),
+    so that rendering and palette checks are array operations that work on many
+    progressions at once.
+    """
+
+    def __init__(
+        self,
+        chord_library: Mapping[str, Sequence[int]],
+        notes: List[str],
+        scale_intervals: Dict[str, List[int]],
+        chord_types_per_degree: Dict[str, List[List[str]]],
+    ) -> None:
+        self.names: List[str] = list(chord_library)
+        self.chord_ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.pitches = self._build_pitch_table(chord_library, self.names)
+
+        self.palettes: Dict[Tuple[str, str], List[str]] = {}
+        for mode, intervals in scale_intervals.items():
+            qualities_per_degree = chord_types_per_degree.get(mode, [])
+            if len(qualities_per_degree) != len(intervals):
+                print("⚠️ Configuration error: Chord qualities length "
+                      f"({len(qualities_per_degree)}) "
+                      f"doesn't match scale intervals ({len(intervals)}) "
+                      f"for mode '{mode}'")
+                continue
+            for root_index, root in enumerate(notes):
+                palette = []
+                for interval, qualities in zip(intervals, qualities_per_degree):
+                    note_name = notes[(root_index + interval) % 12]
+                    for quality in qualities:
+                        chord_name = f"{note_name}{quality}"
+                        if chord_name in self.chord_ids:
+                            palette.append(chord_name)
+                self.palettes[(root, mode)] = list(dict.fromkeys(palette))
+
+        self._palette_masks: Dict[Tuple[str, str], np.ndarray] = {}
+
+    @staticmethod
+    def _build_pitch_table(
+        chord_library: Mapping[str, Sequence[int]],
+        names: List[str]
+    ) -> np.ndarray:
+        table = getattr(chord_library, "pitch_table", None)
+        if table is not None:
+            return table
+        width = max((len(chord_library[name]) for name in names), default=0)
+        pitches = np.full((len(names), width), -1, dtype=np.int16)
+        for i, name in enumerate(names):
+            chord = chord_library[name]
+            pitches[i, :len(chord)] = chord
+        return pitches
+
+    def palette(self, root: str, mode: str) -> List[str]:
+        """Diatonic chords of the key, or [] for an unknown (root, mode)."""
+        return list(self.palettes.get((root, mode), []))
+
+    def encode(self, progressions: Iterable[Sequence[str]]) -> np.ndarray:
+        """
+        Maps progressions to a (n_progressions, max_length) int32 array of chord
+        ids, padded (and with unknown chords marked) with -1.
+        """
+        progressions = [list(progression) for progression in progressions]
+        length = max((len(progression) for progression in progressions), default=0)
+        ids = np.full((len(progressions), length), -1, dtype=np.int32)
+        for row, progression in enumerate(progressions):
+            ids[row, :len(progression)] = [
+                self.chord_ids.get(chord.strip(), -1) for chord in progression
+            ]
+        return ids
+
+    def render_arrays(
+        self,
+        ids: np.ndarray,
+        duration_per_chord: float = 2.0
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Renders encoded progressions as flat note arrays
+        `(progression_index, pitch, start_time, end_time)`. Unknown chords are
+        skipped without leaving a gap, like the original per-chord renderer.
+        """
+        valid = ids >= 0
+        slots = np.cumsum(valid, axis=1) - 1
+        chord_pitches = self.pitches[np.where(valid, ids, 0)]
+        note_mask = valid[..., None] & (chord_pitches >= 0)
+
+        progression_index, chord_index, voice_index = np.nonzero(note_mask)
+        pitch = chord_pitches[progression_index, chord_index, voice_index]
+        start_time = slots[progression_index, chord_index] * duration_per_chord
+        return progression_index, pitch, start_time, start_time + duration_per_chord
+
+    def render(
+        self,
+        progressions: Iterable[Sequence[str]],
+        duration_per_chord: float = 2.0,
+        velocity: int = 100
+    ) -> List[List[Dict]]:
+        """Renders many progressions at once into note JSON lists."""
+        ids = self.encode(progressions)
+        progression_index, pitch, start_time, end_time = self.render_arrays(
+            ids, duration_per_chord
+        )
+        bounds = np.searchsorted(progression_index, np.arange(len(ids) + 1))
+        pitch, start_time, end_time = (
+            pitch.tolist(), start_time.tolist(), end_time.tolist()
+        )
+
+        rendered = []
+        for row in range(len(ids)):
+            rendered.append([
+                {
+                    "pitch": pitch[i],
+                    "velocity": velocity,
+                    "start_time": start_time[i],
+                    "end_time": end_time[i]
+                }
+                for i in range(bounds[row], bounds[row + 1])
+            ])
+        return rendered
+
+    def in_palette(
+        self,
+        progressions: Iterable[Sequence[str]] | np.ndarray,
+        root: str,
+        mode: str
+    ) -> np.ndarray:
+        """
+        Boolean (n_progressions, max_length) array telling which chords belong to
+        the diatonic palette of the key. Padding and unknown chords are False.
+        """
+        ids = (
+            progressions if isinstance(progressions, np.ndarray)
+            else self.encode(progressions)
+        )
+        key = (root, mode)
+        mask = self._palette_masks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self.names) + 1, dtype=bool)
+            mask[[self.chord_ids[name] for name in self.palettes.get(key, [])]] = True
+            self._palette_masks[key] = mask
+        # Index -1 (padding/unknown) hits the extra False slot at the end.
+        return mask[ids]
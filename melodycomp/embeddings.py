@@ -0,0 +1,237 @@
+"""
+Local sentence-transformers embeddings for the Chroma collections.
+
+`LocalEmbeddingFunction` is a Chroma embedding function that:
+
+- encodes documents in batches of `batch_size`,
+- caches document vectors on disk (SQLite) keyed by model name and a hash of
+  the text, so re-indexing the knowledge base after small edits only encodes
+  the chunks and examples that actually changed,
+- keeps recent query embeddings in an in-memory LRU (`embed_query`), so
+  repeated prompts skip encoding and never touch the disk cache.
+
+The model is loaded on first use.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import register_embedding_function
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# SQLite's default limit on bound parameters is 999 on older builds.
+_SQL_BATCH = 500
+
+
+def model_slug(model_name: str) -> str:
+    """
+    Collection-name-safe slug of a model name:
+    "sentence-transformers/all-MiniLM-L6-v2" -> "all-minilm-l6-v2".
+    """
+    return re.sub(r"[^a-z0-9]+", "-", model_name.split("/")[-1].lower()).strip("-")
+
+
+class EmbeddingCache:
+    """Thread-safe on-disk store of embeddings, keyed by (model, content hash)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, hash))"
+            )
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                rows = self._conn.execute(
+                    "SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN "
+                    f"({', '.join('?' * len(batch))})",
+                    (model, *batch),
+                )
+                for content_hash, blob in rows:
+                    found[content_hash] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) "
+                "VALUES (?, ?, ?)",
+                [
+                    (
+                        model,
+                        content_hash,
+                        np.asarray(vector, dtype=np.float32).tobytes(),
+                    )
+                    for content_hash, vector in vectors.items()
+                ],
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+@register_embedding_function
+class LocalEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Chroma embedding function backed by a local sentence-transformers model.
+
+    Args:
+        model_name: Any sentence-transformers model name or path.
+        cache_path: SQLite file for document embeddings (None = no disk cache).
+        batch_size: Texts encoded per forward pass.
+        device: Torch device ("cpu", "mps", "cuda"); None lets the library pick.
+        query_cache_size: Query embeddings kept in memory.
+        normalize: L2-normalize vectors (cosine and inner product then agree).
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        cache_path: Optional[str] = None,
+        batch_size: int = 64,
+        device: Optional[str] = None,
+        query_cache_size: int = 256,
+        normalize: bool = True,
+    ) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self.query_cache_size = query_cache_size
+        self.normalize = normalize
+        self.cache_path = cache_path
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+
+        self._model: Optional[Any] = None
+        self._model_lock = threading.Lock()
+        self._queries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "encoded": 0,
+            "disk_hits": 0,
+            "query_hits": 0,
+            "query_misses": 0,
+        }
+
+    # Chroma stores the function's name and config with each collection and
+    # checks them when the collection is opened again.
+    @staticmethod
+    def name() -> str:
+        return "melodycomp_local"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.model_name,
+            "cache_path": self.cache_path,
+            "batch_size": self.batch_size,
+            "device": self.device,
+            "query_cache_size": self.query_cache_size,
+            "normalize": self.normalize,
+        }
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "LocalEmbeddingFunction":
+        return LocalEmbeddingFunction(**config)
+
+    @property
+    def slug(self) -> str:
+        """Suffix for collection names, so vectors of different models never mix."""
+        return model_slug(self.model_name)
+
+    @property
+    def model(self) -> Any:
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                print(f"--- LOADING EMBEDDING MODEL ({self.model_name}) ---")
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+            return self._model
+
+    def _hash(self, text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        with self._lock:
+            self._counters["encoded"] += len(texts)
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        """Embeds documents, encoding only the texts missing from the disk cache."""
+        if not input:
+            return []
+        hashes = [self._hash(text) for text in input]
+        cached: Dict[str, np.ndarray] = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(self.model_name, hashes)
+        with self._lock:
+            self._counters["disk_hits"] += sum(1 for h in hashes if h in cached)
+
+        missing: Dict[str, str] = {}
+        for text, content_hash in zip(input, hashes):
+            if content_hash not in cached:
+                missing.setdefault(content_hash, text)
+        if missing:
+            vectors = dict(zip(missing, self._encode(list(missing.values()))))
+            if self.cache is not None:
+                self.cache.put_many(self.model_name, vectors)
+            cached.update(vectors)
+        return [cached[content_hash] for content_hash in hashes]
+
+    def embed_query(self, input: Documents) -> Embeddings:
+        """Embeds queries through the in-memory LRU (they aren't written to disk)."""
+        results: List[Optional[np.ndarray]] = []
+        missing: List[int] = []
+        with self._lock:
+            for i, text in enumerate(input):
+                vector = self._queries.get(text)
+                if vector is None:
+                    missing.append(i)
+                else:
+                    self._queries.move_to_end(text)
+                results.append(vector)
+            self._counters["query_hits"] += len(input) - len(missing)
+            self._counters["query_misses"] += len(missing)
+        if missing:
+            vectors = self._encode([input[i] for i in missing])
+            with self._lock:
+                for i, vector in zip(missing, vectors):
+                    results[i] = vector
+                    self._queries[input[i]] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters, queries_cached=len(self._queries))
+        if self.cache is not None:
+            stats["disk_entries"] = len(self.cache)
+        return stats
@@ -1,5 +1,11 @@
+import argparse
 import json
+import mmap
 import os
+import struct
+from typing import Dict, Iterator, List, Mapping, Optional
+
+import numpy as np
 
 NOTE_MAP = {
     "C": 60, "C#": 61, "Db": 61, "D": 62, "D#": 63, "Eb": 63,
@@ -56,13 +62,157 @@ def generate_full_chord_map(note_map, formula_map):
             full_map[chord_name] = [root_midi + i for i in intervals]
     return full_map
 
-if __name__ == "__main__":
-    expanded_chord_map = generate_full_chord_map(NOTE_MAP, CHORD_FORMULAS)
-    # Ensure the directory exists
-    os.makedirs("knowledge_base", exist_ok=True)
-    filename = "knowledge_base/chords.json"
+SHARP_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+FLAT_NAMES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+
+
+def generate_slash_chord_map(note_map, formula_map):
+    """
+    Generates slash chords ("C/E", "Am7/G", ...) for every chord and bass note.
+    If the bass is a chord tone the chord is voiced as an inversion (that tone
+    is moved to the bass), otherwise the bass is added below the chord.
+    """
+    full_map = {}
+    for root_name, root_midi in note_map.items():
+        bass_names = FLAT_NAMES if "b" in root_name else SHARP_NAMES
+        for chord_suffix, intervals in formula_map.items():
+            chord = [root_midi + i for i in intervals]
+            for bass_class, bass_name in enumerate(bass_names):
+                if bass_class == root_midi % 12:
+                    continue
+                upper = [pitch for pitch in chord if pitch % 12 != bass_class]
+                name = f"{root_name}{chord_suffix}/{bass_name}"
+                full_map[name] = [48 + bass_class] + upper
+    return full_map
+
+
+# --- Compact binary format ---
+#
+# header:   magic "MCCL", version, width, n_chords, size of the name block
+# bases:    uint8[n_chords]          lowest MIDI pitch of each chord
+# offsets:  int8[n_chords, width]    pitches relative to the base, padded with -128
+# names:    utf-8, newline separated, in chord id order
+#
+# The tables are fixed width, so the file can be memory-mapped and used without
+# parsing (see `load_chord_library`).
+MAGIC = b"MCCL"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+PAD = -128
+
+
+def write_chord_library(path: str, chord_map: Mapping[str, List[int]]) -> None:
+    """Writes a chord map in the compact binary chord library format."""
+    names = list(chord_map)
+    width = max((len(chord_map[name]) for name in names), default=0)
+    bases = np.zeros(len(names), dtype=np.uint8)
+    offsets = np.full((len(names), width), PAD, dtype=np.int8)
+    for i, name in enumerate(names):
+        pitches = list(chord_map[name])
+        base = min(pitches)
+        bases[i] = base
+        offsets[i, :len(pitches)] = [pitch - base for pitch in pitches]
+    name_block = "\n".join(names).encode("utf-8")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Other processes may have the old file memory-mapped: write a new file and
+    # swap it in, so they keep reading the old one instead of a truncated one.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, len(names), len(name_block)))
+        f.write(bases.tobytes())
+        f.write(offsets.tobytes())
+        f.write(name_block)
+    os.replace(tmp_path, path)
+
+
+class ChordLibrary(Mapping[str, List[int]]):
+    """
+    Read-only chord name -> MIDI pitches mapping backed by a memory-mapped
+    binary chord library. Lookups decode a single row; `pitch_table` exposes
+    all chords as one array for `ChordIndex`.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, width, n_chords, names_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} chord library")
+
+        offset = HEADER.size
+        self.bases = np.frombuffer(
+            self._mmap, dtype=np.uint8, count=n_chords, offset=offset
+        )
+        offset += n_chords
+        self.offsets = np.frombuffer(
+            self._mmap, dtype=np.int8, count=n_chords * width, offset=offset
+        ).reshape(n_chords, width)
+        offset += n_chords * width
+        names = self._mmap[offset:offset + names_size].decode("utf-8")
+        self._names = names.split("\n") if names else []
+        self._ids = {name: i for i, name in enumerate(self._names)}
+        self._pitch_table: Optional[np.ndarray] = None
+
+    def __getitem__(self, name: str) -> List[int]:
+        row = self._ids[name]
+        offsets = self.offsets[row]
+        base = int(self.bases[row])
+        return [base + int(o) for o in offsets[offsets != PAD]]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def pitch_table(self) -> np.ndarray:
+        """(n_chords, width) int16 MIDI pitches in chord id order, padded with -1."""
+        if self._pitch_table is None:
+            table = self.offsets.astype(np.int16) + self.bases[:, None]
+            table[self.offsets == PAD] = -1
+            self._pitch_table = table
+        return self._pitch_table
 
-    with open(filename, 'w') as f:
-        json.dump(expanded_chord_map, f, indent=2)
 
-    print(f"✅ Chord map with {len(expanded_chord_map)} chords successfully saved to {filename}")  # noqa: E501
+def load_chord_library(path: str) -> ChordLibrary:
+    """Memory-maps a binary chord library written by `write_chord_library`."""
+    return ChordLibrary(path)
+
+
+def build_chord_library(
+    path: str = "knowledge_base/chords.bin",
+    extended: bool = False,
+    json_path: Optional[str] = None
+) -> Dict[str, List[int]]:
+    """
+    Generates the chord map (optionally with slash chords/inversions), writes it
+    in the binary format to `path` and, if given, as JSON to `json_path`.
+    """
+    chord_map = generate_full_chord_map(NOTE_MAP, CHORD_FORMULAS)
+    if extended:
+        chord_map.update(generate_slash_chord_map(NOTE_MAP, CHORD_FORMULAS))
+    # JSON first: the agent rebuilds the binary file when the JSON is newer.
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(chord_map, f, indent=2)
+    write_chord_library(path, chord_map)
+    return chord_map
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the chord library.")
+    parser.add_argument("--extended", action="store_true",
+                        help="Also generate slash chords and inversions.")
+    parser.add_argument("--output", default="knowledge_base/chords.bin")
+    parser.add_argument("--json", default="knowledge_base/chords.json",
+                        help="Also write the JSON chord map here ('' to skip).")
+    args = parser.parse_args()
+
+    expanded_chord_map = build_chord_library(args.output, args.extended, args.json)
+    print(f"✅ Chord map with {len(expanded_chord_map)} chords "
+          f"successfully saved to {args.output}")
@@ -0,0 +1,269 @@
+"""
+Local intent extraction for chord prompts.
+
+`IntentParser` turns a prompt into a `PromptIntent` (key, mode, genre, bars,
+tempo, moods) with regular expressions that are compiled once from the
+scales.yaml modes, the knowledge-base genres and the emotion tags of the
+few-shot examples. Parsing takes microseconds and results are kept in an LRU,
+so retrieval filters, cache keys and routing decisions can all key on the
+same intent without a model call.
+
+Recognized spellings include "in A minor", "in the key of A-flat major",
+"F#m", "Bb dorian", "E harmonic minor", "8-bar", "16 bars", "eight bar",
+"124 BPM" and "70-85 bpm".
+"""
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from .cache import CacheKey, make_cache_key, normalize_prompt
+from .retrieval import key_pitch_class
+
+MODE_ALIASES = {
+    "ionian": "major",
+    "aeolian": "minor",
+    "natural_minor": "minor",
+    "maj": "major",
+    "min": "minor",
+    "m": "minor",
+}
+# Names the genre file names don't spell out ("trip hop" and "trip-hop" are
+# matched from "trip_hop" already).
+GENRE_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "idm": ("intelligent dance music", "braindance"),
+    "shoegaze": ("shoegazing", "shoe gaze"),
+    "detroit_techno": ("detroit",),
+    "chicago_house": ("chicago",),
+}
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "six": 6, "eight": 8,
+    "twelve": 12, "sixteen": 16, "twenty four": 24, "thirty two": 32,
+}
+# Words that don't change what a request asks for.
+FILLER_WORDS = {
+    "a", "an", "the", "i", "d", "me", "us", "you", "we", "my",
+    "want", "would", "like", "need", "give", "make", "write", "generate",
+    "create", "compose", "please", "can", "could", "some", "and",
+    "in", "of", "for", "with", "on", "to", "at", "key", "style", "typical",
+    "simple", "basic", "classic", "standard", "progression", "progressions",
+    "chord", "chords", "track", "song", "loop",
+}
+
+_ACCIDENTAL = r"(?P<accidental>[#♯b♭]|[\s-]?(?i:sharp|flat))?"
+
+
+def _words_pattern(phrase: str) -> str:
+    """Regex for a phrase whose words may be joined by ' ', '-', '_' or nothing."""
+    return r"[\s_-]*".join(re.escape(word) for word in re.split(r"[\s_-]+", phrase))
+
+
+def _alternation(phrases: Iterable[str]) -> str:
+    # Longest first, so "harmonic minor" wins over "minor".
+    longest_first = sorted(set(phrases), key=len, reverse=True)
+    return "|".join(_words_pattern(phrase) for phrase in longest_first)
+
+
+def emotion_tags(examples: Iterable[Dict]) -> List[str]:
+    """All emotion tags of the few-shot examples."""
+    return sorted({
+        tag.lower()
+        for example in examples
+        for tag in example.get("metadata", {}).get("emotion_tags", [])
+    })
+
+
+@dataclass(frozen=True)
+class PromptIntent:
+    prompt: str
+    root: Optional[str] = None
+    mode: Optional[str] = None
+    genre: Optional[str] = None
+    bars: Optional[int] = None
+    bpm: Optional[int] = None
+    moods: Tuple[str, ...] = ()
+    # Words not covered by any of the fields above (or filler).
+    remainder: Tuple[str, ...] = ()
+
+    @property
+    def key(self) -> Optional[Tuple[str, str]]:
+        """(root, mode), e.g. ("Ab", "major"), if the prompt names a key."""
+        return (self.root, self.mode) if self.root and self.mode else None
+
+    @property
+    def key_pc(self) -> Optional[int]:
+        return key_pitch_class(self.root) if self.root else None
+
+    @property
+    def cache_key(self) -> CacheKey:
+        return make_cache_key(self.prompt, self.key, self.genre)
+
+
+class IntentParser:
+    """
+    Extracts a `PromptIntent` from prompts.
+
+    Args:
+        modes: Mode names of scales.yaml ("major", "harmonic_minor", ...).
+        genres: Knowledge-base genre ids (the genre file names).
+        moods: Mood words to recognize, e.g. `emotion_tags(examples)`.
+        genre_aliases: Extra names per genre id (default: `GENRE_ALIASES`).
+        cache_size: Parsed prompts kept in memory.
+    """
+
+    def __init__(
+        self,
+        modes: Iterable[str],
+        genres: Iterable[str] = (),
+        moods: Iterable[str] = (),
+        genre_aliases: Optional[Dict[str, Iterable[str]]] = None,
+        cache_size: int = 1024,
+    ) -> None:
+        self.modes = list(modes)
+        self.genres = list(genres)
+        self.moods = sorted({mood.lower() for mood in moods})
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, PromptIntent]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        aliases = {
+            alias: mode for alias, mode in MODE_ALIASES.items() if mode in self.modes
+        }
+        mode_names = {**{mode: mode for mode in self.modes}, **aliases}
+        # Keyed without separators, like the pattern matches them
+        # ("harmonic minor", "harmonic-minor", "harmonicminor").
+        self._mode_names = {
+            self._compact(name): mode for name, mode in mode_names.items()
+        }
+        modes_pattern = _alternation(mode_names)
+        word_modes_pattern = _alternation(name for name in mode_names if len(name) > 1)
+        # After "in" or "key of" the root may be lowercase ("in f# minor");
+        # anywhere else it must be a capital letter so "a major hit" or
+        # "I am" aren't read as keys, and a one-letter minor suffix must be
+        # written like a chord symbol ("F#m", "Bbm"), not like the verb in
+        # "Am I ..." or "CM".
+        self._key_patterns: List[Pattern] = [
+            re.compile(
+                r"\b(?:in|key\s+of)\s+(?:the\s+key\s+of\s+)?"
+                rf"(?P<root>[a-g]){_ACCIDENTAL}"
+                rf"\s*-?\s*(?P<mode>{modes_pattern})\b",
+                re.IGNORECASE,
+            ),
+            re.compile(
+                rf"(?<![\w#])(?P<root>[A-G]){_ACCIDENTAL}"
+                rf"(?:\s*-?\s*(?P<mode>(?i:{word_modes_pattern}))\b"
+                r"|(?P<minor>m)(?![\w#])(?!\s+(?i:i|we|you|they)\b))"
+            ),
+        ]
+
+        genre_aliases = GENRE_ALIASES if genre_aliases is None else genre_aliases
+        genre_names = {
+            name: genre
+            for genre in self.genres
+            for name in (genre, *genre_aliases.get(genre, ()))
+        }
+        self._genre_names = {
+            self._compact(name): genre for name, genre in genre_names.items()
+        }
+        self._genre_pattern = re.compile(
+            rf"\b(?:{_alternation(genre_names)})\b", re.IGNORECASE
+        ) if genre_names else None
+
+        self._numbers = {
+            self._compact(word): value for word, value in NUMBER_WORDS.items()
+        }
+        number = rf"\d+|{_alternation(NUMBER_WORDS)}"
+        self._bars_pattern = re.compile(
+            rf"\b(?P<bars>{number})[\s-]*(?:bars?|measures?)\b", re.IGNORECASE
+        )
+        self._bpm_pattern = re.compile(
+            r"\b(?P<low>\d{2,3})(?:\s*(?:-|to)\s*(?P<high>\d{2,3}))?"
+            r"\s*(?:bpm|beats per minute)\b",
+            re.IGNORECASE,
+        )
+        self._mood_names = {self._compact(mood): mood for mood in self.moods}
+        self._mood_pattern = re.compile(
+            rf"\b(?:{_alternation(self.moods)})\b", re.IGNORECASE
+        ) if self.moods else None
+
+    def parse(self, prompt: str) -> PromptIntent:
+        with self._lock:
+            intent = self._cache.get(prompt)
+            if intent is not None:
+                self._cache.move_to_end(prompt)
+                return intent
+        intent = self._parse(prompt)
+        with self._lock:
+            self._cache[prompt] = intent
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return intent
+
+    __call__ = parse
+
+    def _parse(self, prompt: str) -> PromptIntent:
+        spans: List[Tuple[int, int]] = []
+        fields: Dict = {}
+
+        for pattern in self._key_patterns:
+            match = pattern.search(prompt)
+            if match:
+                fields["root"] = self._root(*match.group("root", "accidental"))
+                mode = match.group("mode") or match.groupdict().get("minor")
+                fields["mode"] = self._mode_names[self._compact(mode)]
+                spans.append(match.span())
+                break
+
+        if self._genre_pattern:
+            match = self._genre_pattern.search(prompt)
+            if match:
+                fields["genre"] = self._genre_names[self._compact(match.group(0))]
+                spans.append(match.span())
+
+        match = self._bars_pattern.search(prompt)
+        if match:
+            bars = match.group("bars")
+            fields["bars"] = (
+                int(bars) if bars.isdigit() else self._numbers[self._compact(bars)]
+            )
+            spans.append(match.span())
+
+        match = self._bpm_pattern.search(prompt)
+        if match:
+            low, high = int(match.group("low")), match.group("high")
+            fields["bpm"] = (low + int(high)) // 2 if high else low
+            spans.append(match.span())
+
+        if self._mood_pattern:
+            moods: Dict[str, None] = {}
+            for match in self._mood_pattern.finditer(prompt):
+                moods[self._mood_names[self._compact(match.group(0))]] = None
+                spans.append(match.span())
+            fields["moods"] = tuple(moods)
+
+        rest = prompt
+        for start, end in sorted(spans, reverse=True):
+            rest = rest[:start] + " " + rest[end:]
+        fields["remainder"] = tuple(
+            word for word in normalize_prompt(rest).split() if word not in FILLER_WORDS
+        )
+        return PromptIntent(prompt, **fields)
+
+    @staticmethod
+    def _compact(text: str) -> str:
+        """Lowercase without separators: "Trip-Hop" -> "triphop"."""
+        return re.sub(r"[\s_-]+", "", text.lower())
+
+    @staticmethod
+    def _root(letter: str, accidental: Optional[str]) -> str:
+        accidental = (accidental or "").strip(" -").lower()
+        if accidental in ("#", "♯", "sharp"):
+            return letter.upper() + "#"
+        if accidental in ("b", "♭", "flat"):
+            return letter.upper() + "b"
+        return letter.upper()
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
@@ -1,27 +1,383 @@
-from typing import Any, List, Mapping, Optional
+import asyncio
+import copy
+import threading
+from collections import OrderedDict
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+)
 
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+import numpy as np
+from langchain_core.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
 from langchain_core.language_models.llms import LLM
-from mlx_lm import generate, load
-from mlx_lm.sample_utils import make_sampler
+from langchain_core.outputs import GenerationChunk
+
+from .chord_grammar import ChordListLogitsProcessor, chord_list_grammar
+
+
+class GenerationBackend(Protocol):
+    """Token source behind the `MLX` wrapper."""
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int,
+        allowed_chords: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        """
+        Yields text segments as they are generated. Closing the iterator stops
+        generation. With `allowed_chords`, output is constrained to a Python list
+        of those chord names and ends when the list closes.
+        """
+        ...
+
+
+class PromptCache:
+    """
+    LRU store of KV caches keyed by the prompt tokens they hold, bounded by their
+    total size in bytes.
+
+    `fetch` returns a private copy of the entry sharing the longest common
+    prefix with a new prompt, trimmed to that prefix, so only the remaining
+    tokens need a prefill. Prompts that share the system instructions (and the
+    same palette or genre context) then pay for that prefix once.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        copy_cache: Callable[[Any], Any],
+        trim_cache: Callable[[Any, int], Any],
+        cache_bytes: Callable[[Any], int],
+        min_prefix: int = 16,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.copy_cache = copy_cache
+        self.trim_cache = trim_cache
+        self.cache_bytes = cache_bytes
+        self.min_prefix = min_prefix
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def _common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+        n = min(len(a), len(b))
+        if n == 0:
+            return 0
+        mismatches = np.flatnonzero(np.asarray(a[:n]) != np.asarray(b[:n]))
+        return int(mismatches[0]) if len(mismatches) else n
+
+    def fetch(self, tokens: Sequence[int]) -> Tuple[Optional[Any], int]:
+        """
+        Returns `(cache, n)`: a copy of the best cache holding the first `n`
+        prompt tokens (n < len(tokens), so at least one token is left to
+        prefill), or `(None, 0)` if no entry shares `min_prefix` tokens.
+        """
+        with self._lock:
+            best_key, best_length = None, 0
+            for key in self._entries:
+                length = self._common_prefix(key, tokens)
+                if length > best_length:
+                    best_key, best_length = key, length
+            best_length = min(best_length, len(tokens) - 1)
+            if best_key is None or best_length < self.min_prefix:
+                self.misses += 1
+                return None, 0
+            self._entries.move_to_end(best_key)
+            cache, _ = self._entries[best_key]
+            self.hits += 1
+            self.reused_tokens += best_length
+        cache = self.copy_cache(cache)
+        self.trim_cache(cache, len(best_key) - best_length)
+        return cache, best_length
+
+    def insert(self, tokens: Sequence[int], cache: Any) -> None:
+        """Stores a cache holding exactly `tokens`, evicting the least recently used."""
+        key = tuple(tokens)
+        size = self.cache_bytes(cache)
+        if len(key) < self.min_prefix or size > self.max_bytes:
+            return
+        with self._lock:
+            # Entries that are a prefix of the new one are covered by it.
+            for other in [k for k in self._entries if key[:len(k)] == k]:
+                self._bytes -= self._entries.pop(other)[1]
+            self._entries[key] = (cache, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reused_tokens": self.reused_tokens,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class MLXBackend:
+    """
+    Generation on Apple silicon through mlx-lm's `stream_generate`, reusing KV
+    caches of shared prompt prefixes (see `PromptCache`).
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        tokenizer: Any,
+        sampler: Any,
+        prompt_cache_bytes: int = 1 << 30,
+    ) -> None:
+        self.model = model
+        self.tokenizer = tokenizer
+        self.sampler = sampler
+        self.prompt_cache: Optional[PromptCache] = None
+        if prompt_cache_bytes:
+            self.prompt_cache = PromptCache(
+                prompt_cache_bytes,
+                copy_cache=copy.deepcopy,
+                trim_cache=self._trim_cache,
+                cache_bytes=self._cache_bytes,
+            )
+
+    @staticmethod
+    def _trim_cache(cache: List[Any], num_tokens: int) -> None:
+        from mlx_lm.models.cache import trim_prompt_cache
+
+        if num_tokens > 0:
+            trim_prompt_cache(cache, num_tokens)
+
+    @staticmethod
+    def _cache_bytes(cache: List[Any]) -> int:
+        return sum(
+            array.nbytes
+            for layer in cache
+            for array in layer.state
+            if array is not None
+        )
+
+    def _encode(self, prompt: str) -> List[int]:
+        # Same tokenization as `stream_generate` applies to string prompts.
+        bos_token = self.tokenizer.bos_token
+        add_special_tokens = bos_token is None or not prompt.startswith(bos_token)
+        return self.tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int,
+        allowed_chords: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        import mlx.core as mx
+        from mlx_lm import stream_generate
+        from mlx_lm.models.cache import can_trim_prompt_cache, make_prompt_cache
+
+        logits_processors = None
+        if allowed_chords:
+            logits_processors = [self._chord_list_processor(allowed_chords)]
+
+        tokens = self._encode(prompt)
+        cache, reused = None, 0
+        if self.prompt_cache is not None:
+            cache, reused = self.prompt_cache.fetch(tokens)
+        if cache is None:
+            cache = make_prompt_cache(self.model)
+
+        try:
+            for response in stream_generate(
+                self.model,
+                self.tokenizer,
+                mx.array(tokens[reused:]),
+                max_tokens=max_tokens,
+                sampler=self.sampler,
+                logits_processors=logits_processors,
+                prompt_cache=cache,
+            ):
+                if response.text:
+                    yield response.text
+        finally:
+            # Keep the cache of the prompt itself; generated tokens differ
+            # between requests and are trimmed off.
+            if (
+                self.prompt_cache is not None
+                and can_trim_prompt_cache(cache)
+                and cache[0].offset >= len(tokens)  # prefill finished
+            ):
+                self._trim_cache(cache, cache[0].offset - len(tokens))
+                self.prompt_cache.insert(tokens, cache)
+
+    def _chord_list_processor(
+        self,
+        allowed_chords: Sequence[str]
+    ) -> Callable[[Any, Any], Any]:
+        """mlx-lm logits processor restricting sampling to a chord list grammar."""
+        import mlx.core as mx
+
+        eos_token_ids = getattr(self.tokenizer, "eos_token_ids", None) or [
+            self.tokenizer.eos_token_id
+        ]
+        processor = ChordListLogitsProcessor(
+            chord_list_grammar(allowed_chords),
+            self.tokenizer.decode,
+            eos_token_ids,
+        )
+
+        def apply(tokens: mx.array, logits: mx.array) -> mx.array:
+            scores = np.array(logits.astype(mx.float32)).reshape(-1)
+            bias = processor.bias(tokens, scores)
+            return logits + mx.array(bias).reshape(logits.shape)
+
+        return apply
+
+
+class ScriptedBackend:
+    """
+    CPU stand-in for tests and benchmarks: "generates" the given responses in
+    turn, one character per token, from a character-level vocabulary. Logits
+    favour the next scripted character and go through the same chord list
+    constraint as the MLX backend, so stop handling, streaming and constrained
+    decoding can be exercised without a GPU or model download.
+    """
+
+    EOS = 0
+
+    def __init__(self, responses: Sequence[str]) -> None:
+        self.responses = list(responses)
+        self._calls = 0
+        self._lock = threading.Lock()
+        chars = {chr(i) for i in range(32, 127)} | {"\n"} | set("".join(responses))
+        self.vocabulary = ["</s>", *sorted(chars)]
+        self._ids = {char: i for i, char in enumerate(self.vocabulary)}
+        self._closing_bias = np.zeros(len(self.vocabulary), dtype=np.float32)
+        self._closing_bias[[self._ids["]"], self._ids["'"]]] = [2.0, 1.0]
+
+    def decode(self, tokens: Sequence[int]) -> str:
+        return "".join(self.vocabulary[t] for t in tokens if t != self.EOS)
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int,
+        allowed_chords: Optional[Sequence[str]] = None
+    ) -> Iterator[str]:
+        with self._lock:
+            script = self.responses[self._calls % len(self.responses)]
+            self._calls += 1
+
+        processor = None
+        if allowed_chords:
+            processor = ChordListLogitsProcessor(
+                chord_list_grammar(allowed_chords), self.decode, [self.EOS]
+            )
+        tokens: List[int] = [self._ids.get(char, 1) for char in prompt[-64:]]
+        position = 0
+        for _ in range(max_tokens):
+            # Slight preference for closing a list when the scripted character
+            # is rejected by the constraint or the script has run out.
+            logits = self._closing_bias.copy()
+            target = script[position] if position < len(script) else None
+            logits[self._ids[target] if target is not None else self.EOS] = 10.0
+            if processor is not None:
+                logits = processor(tokens, logits)
+            token = int(np.argmax(logits))
+            if token == self.EOS:
+                return
+            # Move on through the script even when the constraint rejected
+            # its character, like a model continuing after a forced token.
+            tokens.append(token)
+            position += 1
+            yield self.vocabulary[token]
+
+
+class StopSequenceFilter:
+    """
+    Applies stop sequences to streamed text. Text that could be the start of a
+    stop sequence is held back until it can be told apart, so a stop sequence
+    is never emitted even when it is split across tokens.
+    """
+
+    def __init__(self, stop: Optional[Sequence[str]]) -> None:
+        self.stop = [s for s in (stop or []) if s]
+        self.buffer = ""
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        """Returns the text that is safe to emit. Sets `stopped` on a match."""
+        if not self.stop:
+            return text
+        self.buffer += text
+        matches = [i for i in (self.buffer.find(s) for s in self.stop) if i != -1]
+        if matches:
+            self.stopped = True
+            emit, self.buffer = self.buffer[:min(matches)], ""
+            return emit
+        hold = self._partial_match_length()
+        emit = self.buffer[:len(self.buffer) - hold]
+        self.buffer = self.buffer[len(self.buffer) - hold:]
+        return emit
+
+    def flush(self) -> str:
+        emit, self.buffer = self.buffer, ""
+        return emit
+
+    def _partial_match_length(self) -> int:
+        """Length of the longest buffer suffix that starts a stop sequence."""
+        for length in range(min(len(self.buffer), max(map(len, self.stop)) - 1), 0, -1):
+            suffix = self.buffer[-length:]
+            if any(s.startswith(suffix) for s in self.stop):
+                return length
+        return 0
 
 
 class MLX(LLM):
     """MLX wrapper for Langchain LLM compatibility"""
-    model: Any
-    tokenizer: Any
-    sampler: Any
-    model_path: str
+    backend: Any
+    model_path: str = ""
+    max_tokens: int = 512
 
     @classmethod
-    def from_model_path(cls, model_path: str, temp: float = 0.5, top_p: float = 0.9):
-        """Load the model and tokenizer from a given path."""
+    def from_model_path(
+        cls,
+        model_path: str,
+        temp: float = 0.5,
+        top_p: float = 0.9,
+        prompt_cache_bytes: int = 1 << 30
+    ):
+        """
+        Load the model and tokenizer from a given path. Up to `prompt_cache_bytes`
+        of KV caches for shared prompt prefixes are kept (0 disables reuse).
+        """
+        from mlx_lm import load
+        from mlx_lm.sample_utils import make_sampler
+
         model, tokenizer = load(model_path)
         sampler = make_sampler(temp=temp, top_p=top_p)
         return cls(
-            model=model,
-            tokenizer=tokenizer,
-            sampler=sampler,
+            backend=MLXBackend(model, tokenizer, sampler, prompt_cache_bytes),
             model_path=model_path
         )
 
@@ -29,6 +385,37 @@ class MLX(LLM):
     def _llm_type(self) -> str:
         return "mlx"
 
+    def _stream_text(
+        self,
+        prompt: str,
+        stop: Optional[List[str]],
+        **kwargs: Any
+    ) -> Iterator[str]:
+        """
+        Streams text from the backend, stopping generation at the first stop
+        sequence instead of running to `max_tokens`.
+        """
+        stop_filter = StopSequenceFilter(stop)
+        tokens = self.backend.stream(
+            prompt,
+            max_tokens=kwargs.get("max_tokens", self.max_tokens),
+            allowed_chords=kwargs.get("allowed_chords"),
+        )
+        try:
+            for text in tokens:
+                emit = stop_filter.feed(text)
+                if emit:
+                    yield emit
+                if stop_filter.stopped:
+                    return
+            rest = stop_filter.flush()
+            if rest:
+                yield rest
+        finally:
+            close = getattr(tokens, "close", None)
+            if close is not None:
+                close()
+
     def _call(
         self,
         prompt: str,
@@ -36,21 +423,73 @@ class MLX(LLM):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> str:
+        """
+        Pass `allowed_chords` to constrain the output to a Python list of those
+        chord names; generation then ends as soon as the list is closed.
+        """
+        return "".join(self._stream_text(prompt, stop, **kwargs))
 
-        response = generate(
-            model=self.model,
-            tokenizer=self.tokenizer,
-            prompt=prompt,
-            sampler=self.sampler,
-            max_tokens=kwargs.get("max_tokens", 512),
-        )
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        for text in self._stream_text(prompt, stop, **kwargs):
+            chunk = GenerationChunk(text=text)
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """
+        Runs generation in one dedicated thread (MLX state should not hop between
+        threads per token, as LangChain's default `_astream` would do) and hands
+        chunks to the event loop as they arrive.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Tuple[str, Any]] = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(item: Tuple[str, Any]) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # the event loop is already closed
+                cancelled.set()
 
-        if stop:
-            for stop_word in stop:
-                if stop_word in response:
-                    response = response.split(stop_word)[0]
+        def produce() -> None:
+            try:
+                for text in self._stream_text(prompt, stop, **kwargs):
+                    if cancelled.is_set():
+                        break
+                    put(("text", text))
+                put(("done", None))
+            except Exception as e:
+                put(("error", e))
 
-        return response
+        producer = threading.Thread(target=produce, name="mlx-astream", daemon=True)
+        producer.start()
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise payload
+                chunk = GenerationChunk(text=payload)
+                if run_manager:
+                    await run_manager.on_llm_new_token(payload, chunk=chunk)
+                yield chunk
+        finally:
+            # Stops the producer after its current token if the consumer quits early.
+            cancelled.set()
 
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
@@ -1,39 +1,41 @@
 import json
 import re
-from typing import Dict, List
+from concurrent.futures import Future, wait
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
 
-import google.generativeai as genai
 import pretty_midi
-import streamlit as st
-import yaml
-from llama_cpp import Llama
-
-
-@st.cache_resource
-def load_melody_model():
-    """Load the Llama model once and cache it."""
-    print("--- LOADING MELODY MODEL (llama-cpp-python) ---")
-    return Llama(
-        model_path="./models/chatmusician.Q4_K_M.gguf",
-        n_gpu_layers=-1,
-        n_ctx=2048,
-        verbose=False
-    )
 
-llm = load_melody_model()
+from .abc_parser import AbcParseError, parse_abc
+from .gen_chord_lib import CHORD_FORMULAS, NOTE_MAP
+from .melody_worker import get_melody_pool
+from .model_client import get_gemini_client
+from .tracing import tracer
+
+# Seconds to wait for the melody workers before giving up on a request.
+MELODY_TIMEOUT = 120.0
+MELODY_PARAMS = {"max_tokens": 1024, "stop": ["Human:", "</s>"]}
+
+
+def warm_up_melody_model() -> Future:
+    """
+    Starts the melody worker processes (once) and loads their models in the
+    background. Returns a future that resolves when all workers are ready.
+    """
+    return get_melody_pool().warm_up()
+
+
+def melody_model_status() -> str:
+    """Melody worker state, same values as `MelodyCompAgent.readiness`."""
+    return get_melody_pool().status()
 
 
 def convert_abc_to_notes_json(raw_abc: str) -> List[Dict]:
     """
     Uses Gemini to convert a raw (potentially malformed) ABC string
-    into a structured JSON list of notes.
+    into a structured JSON list of notes. Only used as a fallback for input
+    the local `abc_parser` can't handle.
     """
-    with open("./configs/config.yaml", "r")  as f:
-        cfg = yaml.safe_load(f)
-        api_key = cfg.get("gemini_api_key")
-
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.5-flash")
     prompt = f"""
     You are an expert music notation converter. Your task is to interpret the following raw ABC notation and convert it into a clean JSON array of note objects.
 
@@ -61,12 +63,7 @@ def convert_abc_to_notes_json(raw_abc: str) -> List[Dict]:
     """ # noqa: E501
 
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config={"temperature": 0.1}
-        )
-
-        json_text = response.text.strip()
+        json_text = get_gemini_client().generate_text(prompt, temperature=0.1).strip()
         if json_text.startswith("```json"):
             json_text = json_text[7:]
         if json_text.startswith("```"):
@@ -84,24 +81,202 @@ def convert_abc_to_notes_json(raw_abc: str) -> List[Dict]:
         return []
 
 
-def generate_melody_for_chords(chords: List[str]) -> pretty_midi.Instrument:
+@dataclass
+class MelodyCandidate:
+    """A generated melody with its local quality score (higher is better)."""
+    instrument: pretty_midi.Instrument
+    abc: str
+    score: float
+    # "llm" for the melody model, "draft" for `algorithmic_melody`.
+    source: str = "llm"
+
+
+def _build_melody_prompt(chords: List[str]) -> str:
     chord_str = ", ".join([f"'{c}'" for c in chords])
 
     instruction = f"Develop a simple, single-line musical piece using the given chord progression. {chord_str} in the key of {chord_str[0].split()[0]}" # noqa: E501
-    prompt = f"Human: {instruction} </s> Assistant: M:4/4\nL:1/8\nK:C\n"
+    return f"Human: {instruction} </s> Assistant: M:4/4\nL:1/8\nK:C\n"
 
-    output = llm(prompt, max_tokens=1024, temperature=0.8, stop=["Human:", "</s>"])
-    raw_response_text = output["choices"][0]["text"].strip()
 
-    notes_list = convert_abc_to_notes_json(raw_response_text)
+def _abc_to_instrument(
+    raw_response_text: str,
+    allow_fallback: bool = True
+) -> Optional[pretty_midi.Instrument]:
+    """Parses the model's ABC output, falling back to Gemini if allowed."""
+    melody_instrument = pretty_midi.Instrument(
+        program=pretty_midi.instrument_name_to_program("Violin")
+    )
+    try:
+        with tracer.span("abc_conversion", backend="local"):
+            melody_instrument.notes.extend(parse_abc(raw_response_text))
+        return melody_instrument
+    except AbcParseError as e:
+        if not allow_fallback:
+            print(f"⚠️ Local ABC parsing failed ({e}).")
+            return None
+        print(f"⚠️ Local ABC parsing failed ({e}). "
+              "Falling back to Gemini conversion.")
+
+    with tracer.span("abc_conversion", backend="gemini"):
+        notes_list = convert_abc_to_notes_json(raw_response_text)
 
     if not notes_list:
         print("⚠️ Melody generation failed after JSON conversion.")
         return None
 
-    melody_instrument = pretty_midi.Instrument(
-        program=pretty_midi.instrument_name_to_program("Violin")
-    )
+    melody_instrument.notes.extend(notes_json_to_midi_notes(notes_list))
+    return melody_instrument
+
+
+@tracer.traced("generate_melody")
+def generate_melody_for_chords(
+    chords: List[str],
+    llm: Optional[Any] = None,
+    timeout: Optional[float] = MELODY_TIMEOUT
+) -> pretty_midi.Instrument:
+    """
+    Generates a melody on the melody worker pool (see `melody_worker`), or with
+    `llm` in-process if given (e.g. a stand-in model for benchmarks).
+    """
+    prompt = _build_melody_prompt(chords)
+
+    with tracer.span("melody_llm_call") as span:
+        if llm is not None:
+            output = llm(prompt, temperature=0.8, **MELODY_PARAMS)
+        else:
+            output = get_melody_pool().generate(
+                prompt, timeout=timeout, temperature=0.8, **MELODY_PARAMS
+            )
+        span.update(output.get("usage", {}))
+    raw_response_text = output["choices"][0]["text"].strip()
+
+    return _abc_to_instrument(raw_response_text)
+
+
+@tracer.traced("generate_melody_candidates")
+def generate_melody_candidates(
+    chords: List[str],
+    n: int = 4,
+    temperature: float = 0.9,
+    seed: int = 0,
+    llm: Optional[Any] = None,
+    timeout: Optional[float] = MELODY_TIMEOUT
+) -> List[MelodyCandidate]:
+    """
+    Generates `n` candidate melodies for a chord progression and returns them
+    ranked by `score_melody`, best first.
+
+    On the worker pool the candidates are queued together and spread over the
+    worker processes. Within one worker, llama.cpp keeps the KV cache of the
+    previous evaluation and only re-evaluates tokens after the longest common
+    prefix, so the shared prompt is prefilled once per worker and each further
+    candidate only pays for its own sampled tokens.
+    """
+    prompt = _build_melody_prompt(chords)
+
+    raw_texts = []
+    if llm is not None:
+        for i in range(n):
+            with tracer.span("melody_llm_call", candidate=i) as span:
+                output = llm(
+                    prompt, temperature=temperature, seed=seed + i, **MELODY_PARAMS
+                )
+                span.update(output.get("usage", {}))
+            raw_texts.append(output["choices"][0]["text"].strip())
+    else:
+        pool = get_melody_pool()
+        with tracer.span("melody_llm_call", candidates=n, processes=pool.processes):
+            futures = [
+                pool.submit(
+                    prompt, temperature=temperature, seed=seed + i, **MELODY_PARAMS
+                )
+                for i in range(n)
+            ]
+            _, not_done = wait(futures, timeout=timeout)
+            if not_done:
+                raise TimeoutError(f"Melody workers did not answer within {timeout}s")
+        raw_texts = [
+            future.result()["choices"][0]["text"].strip() for future in futures
+        ]
+
+    candidates = []
+    for raw_text in raw_texts:
+        instrument = _abc_to_instrument(raw_text, allow_fallback=False)
+        if instrument is not None and instrument.notes:
+            score = score_melody(instrument.notes, chords)
+            candidates.append(MelodyCandidate(instrument, raw_text, score))
+
+    if not candidates and raw_texts:
+        # Nothing parsed locally: pay for one Gemini conversion rather than n.
+        instrument = _abc_to_instrument(raw_texts[0])
+        if instrument is not None and instrument.notes:
+            score = score_melody(instrument.notes, chords)
+            candidates.append(MelodyCandidate(instrument, raw_texts[0], score))
+
+    return sorted(candidates, key=lambda candidate: candidate.score, reverse=True)
+
+
+def chord_pitch_classes(chord_name: str) -> Optional[set]:
+    """Pitch classes of a chord name like "F#m7", or None if it is unknown."""
+    match = re.match(r"([A-G][#b]?)(.*)$", chord_name.strip())
+    if not match:
+        return None
+    root_name, quality = match.groups()
+    if root_name not in NOTE_MAP or quality not in CHORD_FORMULAS:
+        return None
+    root = NOTE_MAP[root_name]
+    return {(root + interval) % 12 for interval in CHORD_FORMULAS[quality]}
+
+
+def score_melody(
+    notes: List[pretty_midi.Note],
+    chords: List[str],
+    bar_length: float = 4.0
+) -> float:
+    """
+    Cheap local quality score in [0, 1] for ranking melody candidates:
+    duration-weighted chord-tone coverage (one chord per 4/4 bar), how many
+    bars of the progression the melody covers, and a comfortable range
+    (between a fourth and an octave plus a fifth).
+    """
+    if not notes or not chords:
+        return 0.0
+
+    chord_tones = [chord_pitch_classes(chord) for chord in chords]
+    on_chord = 0.0
+    judged = 0.0
+    bars_with_notes = set()
+    for note in notes:
+        bar = int(note.start // bar_length)
+        if bar >= len(chords):
+            continue
+        bars_with_notes.add(bar)
+        tones = chord_tones[bar]
+        if tones is None:
+            continue
+        duration = note.end - note.start
+        judged += duration
+        if note.pitch % 12 in tones:
+            on_chord += duration
+
+    chord_tone_score = on_chord / judged if judged else 0.0
+    bar_coverage = len(bars_with_notes) / len(chords)
+
+    pitches = [note.pitch for note in notes]
+    span = max(pitches) - min(pitches)
+    if span < 5:
+        range_score = span / 5
+    elif span > 19:
+        range_score = max(0.0, 1 - (span - 19) / 12)
+    else:
+        range_score = 1.0
+
+    return 0.6 * chord_tone_score + 0.25 * bar_coverage + 0.15 * range_score
+
+
+def notes_json_to_midi_notes(notes_list: List[Dict]) -> List[pretty_midi.Note]:
+    """Converts the note JSON from `convert_abc_to_notes_json` to MIDI notes."""
+    midi_notes = []
     note_map = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
 
     for note_info in notes_list:
@@ -134,10 +309,10 @@ def generate_melody_for_chords(chords: List[str]) -> pretty_midi.Instrument:
                 start=start_time,
                 end=start_time + duration
             )
-            melody_instrument.notes.append(note)
+            midi_notes.append(note)
 
         except (KeyError, ValueError, TypeError) as e:
             print(f"⚠️ Skipping malformed note object from JSON: {note_info}. Error: {e}") # noqa: E501
             continue
 
-    return melody_instrument
+    return midi_notes
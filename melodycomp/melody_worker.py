@@ -0,0 +1,268 @@
+"""
+Melody inference in worker processes.
+
+Each worker process loads its own `Llama` instance (llama.cpp contexts are not
+thread-safe), so melody generation never runs in the Streamlit script thread and
+concurrent requests don't contend on one model. `MelodyWorkerPool` sits in
+front of the processes and provides:
+
+- coalescing: identical requests that are already queued or running share one
+  result instead of being generated twice,
+- backpressure: at most `max_pending` distinct requests are queued or running;
+  `submit` waits up to `queue_timeout` seconds for a slot and then raises
+  `MelodyQueueFull`,
+- timeouts: `generate(..., timeout=...)` stops waiting after `timeout` seconds.
+"""
+import asyncio
+import json
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+DEFAULT_MODEL_PATH = "./models/chatmusician.Q4_K_M.gguf"
+
+# The model owned by the current worker process (set by `_init_worker`).
+_worker_llm = None
+
+
+class MelodyQueueFull(RuntimeError):
+    """Raised when the melody queue is full and no slot frees up in time."""
+
+
+def load_melody_model(model_path: str = DEFAULT_MODEL_PATH, n_ctx: int = 2048) -> Any:
+    """Load the Llama model. Called once in every worker process."""
+    from llama_cpp import Llama
+
+    print("--- LOADING MELODY MODEL (llama-cpp-python) ---")
+    return Llama(
+        model_path=model_path,
+        n_gpu_layers=-1,
+        n_ctx=n_ctx,
+        verbose=False
+    )
+
+
+def _init_worker(model_path: str, n_ctx: int) -> None:
+    global _worker_llm
+    _worker_llm = load_melody_model(model_path, n_ctx)
+
+
+def _worker_ready() -> bool:
+    return _worker_llm is not None
+
+
+def _worker_complete(prompt: str, params: Dict[str, Any]) -> Dict:
+    output = _worker_llm(prompt, **params)
+    # Only ship what the client needs back across the process boundary.
+    return {
+        "choices": [{"text": output["choices"][0]["text"]}],
+        "usage": output.get("usage", {}),
+    }
+
+
+class MelodyWorkerPool:
+    """
+    Client-side queue in front of `processes` melody worker processes.
+
+    Completions are returned in llama-cpp's format (`{"choices": [{"text": ...}],
+    "usage": {...}}`), so the pool is a drop-in for calling a `Llama` directly.
+    """
+
+    def __init__(
+        self,
+        processes: int = 1,
+        max_pending: int = 8,
+        queue_timeout: float = 5.0,
+        model_path: str = DEFAULT_MODEL_PATH,
+        n_ctx: int = 2048,
+    ) -> None:
+        self.processes = processes
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._warmup: Optional[Future] = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # "spawn": forking a process that has touched Metal/CUDA or
+                # holds threads (Streamlit, warm-up executors) is not safe.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.n_ctx),
+                )
+            return self._executor
+
+    def _reset_executor(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Drops a pool whose worker died (e.g. out of memory) so the next request
+        starts a new one.
+        """
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self) -> Future:
+        """
+        Starts all worker processes and loads their models in the background.
+        The returned future resolves once every worker is ready; a failed
+        warm-up is retried on the next call.
+        """
+        with self._lock:
+            warmup = self._warmup
+        failed = warmup is not None and warmup.done() and warmup.exception() is not None
+        if warmup is not None and not failed:
+            return warmup
+
+        executor = self._get_executor()
+        pings = [executor.submit(_worker_ready) for _ in range(self.processes)]
+        warmup = Future()
+        remaining = [len(pings)]
+
+        def on_ping_done(ping: Future) -> None:
+            error = ping.exception()
+            if isinstance(error, BrokenProcessPool):
+                # A worker failed to load its model; start over on the next call.
+                self._reset_executor(executor)
+            if warmup.done():
+                return
+            if error is not None:
+                warmup.set_exception(error)
+                return
+            with self._lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                warmup.set_result(True)
+
+        for ping in pings:
+            ping.add_done_callback(on_ping_done)
+        with self._lock:
+            self._warmup = warmup
+        return warmup
+
+    def status(self) -> str:
+        """Worker state, same values as `MelodyCompAgent.readiness`."""
+        warmup = self._warmup
+        if warmup is None:
+            return "cold"
+        if not warmup.done():
+            return "loading"
+        return "failed" if warmup.exception() is not None else "ready"
+
+    @staticmethod
+    def _request_key(prompt: str, params: Dict[str, Any]) -> Tuple[str, str]:
+        return prompt, json.dumps(params, sort_keys=True, default=str)
+
+    def submit(self, prompt: str, **params: Any) -> Future:
+        """
+        Queues a completion and returns its future. An identical request that is
+        still queued or running is shared instead of queued again.
+        """
+        key = self._request_key(prompt, params)
+        with self._lock:
+            existing = self._inflight.get(key)
+        if existing is not None:
+            return existing
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise MelodyQueueFull(
+                f"{self.max_pending} melody requests are already pending"
+            )
+
+        executor = self._get_executor()
+        with self._lock:
+            # Another thread may have queued the same request while we waited.
+            existing = self._inflight.get(key)
+            if existing is None:
+                try:
+                    future = executor.submit(_worker_complete, prompt, params)
+                except BrokenProcessPool:
+                    future = None
+                else:
+                    self._inflight[key] = future
+        if existing is not None:
+            self._slots.release()
+            return existing
+        if future is None:
+            self._slots.release()
+            self._reset_executor(executor)
+            raise BrokenProcessPool("A melody worker died; the pool will be restarted")
+
+        def on_done(done: Future) -> None:
+            with self._lock:
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+            self._slots.release()
+            if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+                self._reset_executor(executor)
+
+        future.add_done_callback(on_done)
+        return future
+
+    def generate(
+        self,
+        prompt: str,
+        timeout: Optional[float] = None,
+        **params: Any
+    ) -> Dict:
+        """
+        Blocking completion. Raises `TimeoutError` after `timeout` seconds; the
+        request keeps its queue slot until the worker finishes it.
+        """
+        return self.submit(prompt, **params).result(timeout=timeout)
+
+    async def agenerate(
+        self,
+        prompt: str,
+        timeout: Optional[float] = None,
+        **params: Any
+    ) -> Dict:
+        """Async version of `generate`, for use on an event loop."""
+        future = await asyncio.to_thread(self.submit, prompt, **params)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def pending(self) -> int:
+        """Number of distinct requests queued or running."""
+        with self._lock:
+            return len(self._inflight)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor, self._warmup = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_pool: Optional[MelodyWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def configure_melody_pool(**kwargs: Any) -> MelodyWorkerPool:
+    """Replaces the shared pool with one built from `MelodyWorkerPool` kwargs."""
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, MelodyWorkerPool(**kwargs)
+    if old is not None:
+        old.shutdown(wait=False)
+    return _pool
+
+
+def get_melody_pool() -> MelodyWorkerPool:
+    """Returns the shared pool, creating a default one on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MelodyWorkerPool()
+        return _pool
@@ -0,0 +1,283 @@
+"""
+Direct Standard MIDI File (SMF) rendering.
+
+A `Track` holds the notes of one instrument as flat numpy arrays plus a content
+digest, and is built once per result (from note JSON or a `pretty_midi`
+instrument). `encode_midi` turns tracks into SMF bytes with array operations
+instead of building `pretty_midi`/`mido` objects event by event, and
+`render_midi` adds a content-addressed LRU in front of it, so re-rendering the
+same tracks (e.g. on every Streamlit rerun) returns the cached bytes.
+
+Timing matches `pretty_midi`'s defaults: 220 ticks per quarter note at a
+constant 120 BPM in 4/4, times given in seconds.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .tracing import tracer
+
+RESOLUTION = 220
+TEMPO_BPM = 120.0
+TICKS_PER_SECOND = RESOLUTION * TEMPO_BPM / 60.0
+
+PIANO = 0    # General MIDI "Acoustic Grand Piano"
+VIOLIN = 40  # General MIDI "Violin"
+
+DRUM_CHANNEL = 9
+# Melodic channels in assignment order, as pretty_midi does: never channel 10.
+_CHANNELS = [channel for channel in range(16) if channel != DRUM_CHANNEL]
+
+_END_OF_TRACK = b"\x01\xff\x2f\x00"
+
+
+class Track:
+    """
+    Immutable notes of one instrument. `digest` identifies the content, so equal
+    tracks built from different objects share cache entries.
+    """
+
+    __slots__ = (
+        "start", "end", "pitch", "velocity", "program", "is_drum", "name", "digest"
+    )
+
+    def __init__(
+        self,
+        start: Sequence[float],
+        end: Sequence[float],
+        pitch: Sequence[int],
+        velocity: Sequence[int],
+        program: int = PIANO,
+        is_drum: bool = False,
+        name: str = "",
+    ) -> None:
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.pitch = np.clip(np.asarray(pitch, dtype=np.int64), 0, 127).astype(np.uint8)
+        self.velocity = np.clip(
+            np.asarray(velocity, dtype=np.int64), 1, 127
+        ).astype(np.uint8)
+        arrays = (self.start, self.end, self.pitch, self.velocity)
+        if len({len(array) for array in arrays}) != 1:
+            raise ValueError("Note arrays must have the same length")
+        for array in arrays:
+            array.flags.writeable = False
+        self.program = int(program)
+        self.is_drum = bool(is_drum)
+        self.name = name
+
+        digest = hashlib.sha256(f"{self.program}:{self.is_drum}:{name}".encode("utf-8"))
+        for array in (self.start, self.end, self.pitch, self.velocity):
+            digest.update(array.tobytes())
+        self.digest = digest.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.pitch)
+
+    @classmethod
+    def from_notes_json(
+        cls,
+        notes: Iterable[Dict],
+        program: int = PIANO,
+        name: str = ""
+    ) -> "Track":
+        """From the agent's note JSON (pitch, velocity, start_time, end_time)."""
+        notes = list(notes)
+        return cls(
+            [note["start_time"] for note in notes],
+            [note["end_time"] for note in notes],
+            [note["pitch"] for note in notes],
+            [note["velocity"] for note in notes],
+            program=program,
+            name=name,
+        )
+
+    @classmethod
+    def from_instrument(cls, instrument: Any) -> "Track":
+        """From a `pretty_midi.Instrument` (only its notes are kept)."""
+        notes = instrument.notes
+        return cls(
+            [note.start for note in notes],
+            [note.end for note in notes],
+            [note.pitch for note in notes],
+            [note.velocity for note in notes],
+            program=instrument.program,
+            is_drum=instrument.is_drum,
+            name=instrument.name,
+        )
+
+
+def _vlq(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    MIDI variable-length quantities of non-negative ints below 2**28, as a
+    (n, 4) uint8 array left-padded with zeros, plus a mask of the bytes to keep.
+    """
+    values = values.astype(np.int64)
+    groups = np.stack([(values >> shift) & 0x7F for shift in (21, 14, 7, 0)], axis=1)
+    groups[:, :3] |= 0x80
+    length = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    keep = np.arange(4)[None, :] >= (4 - length)[:, None]
+    return groups.astype(np.uint8), keep
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return kind + len(data).to_bytes(4, "big") + data
+
+
+def _meta(kind: int, data: bytes) -> bytes:
+    # Only used at delta 0 and for short payloads (length fits in one byte).
+    return bytes([0x00, 0xFF, kind, len(data)]) + data
+
+
+def _conductor_track() -> bytes:
+    tempo = int(round(60_000_000 / TEMPO_BPM)).to_bytes(3, "big")
+    return _chunk(b"MTrk", (
+        _meta(0x51, tempo)
+        + _meta(0x58, bytes([4, 2, 24, 8]))  # 4/4
+        + _END_OF_TRACK
+    ))
+
+
+def _note_track(track: Track, channel: int) -> bytes:
+    header = b""
+    if track.name:
+        header += _meta(0x03, track.name.encode("utf-8")[:127])
+    header += bytes([0x00, 0xC0 | channel, track.program & 0x7F])
+    if not len(track):
+        return _chunk(b"MTrk", header + _END_OF_TRACK)
+
+    on_tick = np.rint(track.start * TICKS_PER_SECOND).astype(np.int64)
+    # A note must last at least one tick, or its note-off would sort first.
+    off_tick = np.maximum(
+        np.rint(track.end * TICKS_PER_SECOND).astype(np.int64), on_tick + 1
+    )
+    n = len(track)
+
+    tick = np.concatenate([off_tick, on_tick])
+    is_on = np.concatenate([np.zeros(n, dtype=np.uint8), np.ones(n, dtype=np.uint8)])
+    pitch = np.concatenate([track.pitch, track.pitch])
+    velocity = np.concatenate([np.zeros(n, dtype=np.uint8), track.velocity])
+    # By time, then note-offs before note-ons (so repeated notes retrigger).
+    order = np.lexsort((pitch, is_on, tick))
+    tick, pitch, velocity = tick[order], pitch[order], velocity[order]
+
+    delta, keep = _vlq(np.diff(tick, prepend=0))
+    # Note-offs are written as note-ons with velocity 0, like pretty_midi, so
+    # every event has the same status byte and running status omits all but
+    # the first.
+    status = np.zeros((len(tick), 1), dtype=bool)
+    status[0] = True
+    rows = np.concatenate([
+        delta,
+        np.full((len(tick), 1), 0x90 | channel, dtype=np.uint8),
+        pitch[:, None],
+        velocity[:, None],
+    ], axis=1)
+    keep = np.concatenate([keep, status, np.ones((len(tick), 2), dtype=bool)], axis=1)
+    return _chunk(b"MTrk", header + rows[keep].tobytes() + _END_OF_TRACK)
+
+
+def encode_midi(tracks: Sequence[Track]) -> bytes:
+    """Encodes tracks as a format 1 SMF, one MIDI track per `Track`."""
+    data = [_conductor_track()]
+    for i, track in enumerate(tracks):
+        channel = DRUM_CHANNEL if track.is_drum else _CHANNELS[i % len(_CHANNELS)]
+        data.append(_note_track(track, channel))
+    header = _chunk(b"MThd", (
+        (1).to_bytes(2, "big")
+        + len(data).to_bytes(2, "big")
+        + RESOLUTION.to_bytes(2, "big")
+    ))
+    return header + b"".join(data)
+
+
+def midi_digest(tracks: Sequence[Track]) -> str:
+    """Content address of the file `encode_midi(tracks)` would produce."""
+    digest = hashlib.sha256(f"smf1:{RESOLUTION}:{TEMPO_BPM}".encode("utf-8"))
+    for track in tracks:
+        digest.update(track.digest.encode("ascii"))
+    return digest.hexdigest()
+
+
+class MidiCache:
+    """Thread-safe LRU of rendered files by content digest, bounded in bytes."""
+
+    def __init__(self, max_bytes: int = 32 << 20) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._counters["hits"] += 1
+            return data
+
+    def put(self, digest: str, data: bytes) -> None:
+        with self._lock:
+            if digest in self._entries or len(data) > self.max_bytes:
+                return
+            self._entries[digest] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries), bytes=self._bytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+midi_cache = MidiCache()
+
+
+def render_midi(*tracks: Track, cache: Optional[MidiCache] = midi_cache) -> bytes:
+    """SMF bytes for the tracks, served from `cache` when already rendered."""
+    digest = midi_digest(tracks)
+    data = cache.get(digest) if cache is not None else None
+    with tracer.span("midi_write", tracks=len(tracks), cached=data is not None):
+        if data is None:
+            data = encode_midi(tracks)
+            if cache is not None:
+                cache.put(digest, data)
+    return data
+
+
+def render_many(
+    track_lists: Iterable[Sequence[Track]],
+    cache: Optional[MidiCache] = None
+) -> List[bytes]:
+    """
+    Renders many files at once (e.g. a sample pack). Identical inputs are only
+    encoded once; the shared cache is bypassed by default so a large batch
+    doesn't evict interactive results.
+    """
+    rendered: Dict[str, bytes] = {}
+    results = []
+    for tracks in track_lists:
+        digest = midi_digest(tracks)
+        data = rendered.get(digest)
+        if data is None and cache is not None:
+            data = cache.get(digest)
+        if data is None:
+            data = encode_midi(tracks)
+            if cache is not None:
+                cache.put(digest, data)
+        rendered[digest] = data
+        results.append(data)
+    return results
@@ -0,0 +1,772 @@
+"""
+Shared Gemini client.
+
+Every Gemini call in the package (chord generation and tips through
+`ChatGemini`, the ABC conversion fallback) goes through one `GeminiClient`,
+which talks to the REST API over a pooled keep-alive HTTP connection and adds:
+
+- a token-bucket rate limiter shared by all callers, so bursts are smoothed out
+  locally instead of turning into 429 storms,
+- per-call deadlines covering queueing, retries and backoff,
+- retries of transient failures (connection errors, 408/429/5xx) with
+  exponential backoff and full jitter, honouring `Retry-After`,
+- optional hedged requests: if a call hasn't answered after the recent p95
+  latency, a duplicate is sent and the first answer wins.
+
+The endpoint is configurable (`endpoint=`, the `gemini.endpoint` config key or
+the `MELODYCOMP_GEMINI_ENDPOINT` environment variable), so tests can point the
+client at a local fake server.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import yaml
+from langchain_core.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    SystemMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+DEFAULT_ENDPOINT = "https://generativelanguage.googleapis.com"
+DEFAULT_MODEL = "gemini-2.5-flash"
+CONFIG_PATH = "./configs/config.yaml"
+ENDPOINT_ENV = "MELODYCOMP_GEMINI_ENDPOINT"
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+Contents = List[Dict[str, Any]]
+
+
+class ModelClientError(RuntimeError):
+    """The API answered with an error status."""
+
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(f"Gemini API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call's deadline passed before an answer arrived."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most
+    `capacity`. `reserve` takes a token (possibly from the future) and returns
+    how long the caller must wait before using it, so sync and async callers
+    share one bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        refilled = self._tokens + (now - self._updated) * self.rate
+        self._tokens = min(self.capacity, refilled)
+        self._updated = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Takes a token only if one is available right now."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies."""
+
+    def __init__(self, window: int = 200) -> None:
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            return float(np.quantile(np.fromiter(self._samples, dtype=float), q))
+
+
+class GeminiClient:
+    """
+    Pooled, rate-limited client for the Gemini `generateContent` REST API.
+
+    Args:
+        api_key: Gemini API key.
+        model: Model name, e.g. "gemini-2.5-flash".
+        endpoint: API base URL (a local fake server in tests).
+        requests_per_second: Sustained request rate of the token bucket.
+        burst: Requests allowed at once before the rate limit applies.
+        timeout: Default deadline of a call in seconds, retries included.
+        retries: Retries after a transient failure.
+        backoff: Base delay in seconds for exponential backoff.
+        max_backoff: Upper bound of a single backoff delay.
+        hedge: Send a duplicate of calls that take longer than the recent
+            `hedge_quantile` latency (never for streams).
+        hedge_quantile: Latency quantile after which a call is hedged.
+        hedge_min_samples: Calls observed before hedging starts.
+        max_connections: Size of the HTTP connection pool.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = DEFAULT_MODEL,
+        endpoint: str = DEFAULT_ENDPOINT,
+        requests_per_second: float = 5.0,
+        burst: int = 10,
+        timeout: float = 60.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        max_connections: int = 20,
+    ) -> None:
+        self.model = model
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self.latency = LatencyTracker()
+        self._headers = {"x-goog-api-key": api_key}
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self._http = httpx.Client(
+            base_url=self.endpoint, headers=self._headers, limits=self._limits
+        )
+        # httpx.AsyncClient is bound to the event loop it first ran on.
+        self._ahttp: Optional[httpx.AsyncClient] = None
+        self._ahttp_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "deadline_exceeded": 0,
+        }
+
+    @classmethod
+    def from_config(cls, path: str = CONFIG_PATH, **overrides: Any) -> "GeminiClient":
+        """
+        Builds a client from config.yaml: `gemini_api_key` plus optional client
+        settings under `gemini:` (any of this class's arguments).
+        """
+        with open(path, "r") as f:
+            config = yaml.safe_load(f) or {}
+        api_key = config.get("gemini_api_key")
+        if not api_key:
+            raise ValueError(f"Gemini API key not found in {path}")
+        settings = dict(config.get("gemini") or {})
+        if os.environ.get(ENDPOINT_ENV):
+            settings["endpoint"] = os.environ[ENDPOINT_ENV]
+        return cls(api_key, **{**settings, **overrides})
+
+    # --- Request plumbing ---
+
+    def _url(self, method: str) -> str:
+        return f"/v1beta/models/{self.model}:{method}"
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    @staticmethod
+    def _body(
+        contents: Contents,
+        system: Optional[str],
+        generation_config: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        body: Dict[str, Any] = {"contents": contents}
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+        return body
+
+    @staticmethod
+    def _error(response: httpx.Response) -> ModelClientError:
+        try:
+            message = response.json().get("error", {}).get("message", response.text)
+        except ValueError:
+            message = response.text
+        return ModelClientError(response.status_code, message)
+
+    def _backoff_delay(self, attempt: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = getattr(error, "retry_after", None)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    @staticmethod
+    def _is_retryable(error: BaseException) -> bool:
+        if isinstance(error, ModelClientError):
+            return error.status_code in RETRYABLE_STATUS
+        return isinstance(error, httpx.TransportError)
+
+    @staticmethod
+    def _check(response: httpx.Response) -> None:
+        if response.status_code < 400:
+            return
+        error = GeminiClient._error(response)
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.replace(".", "", 1).isdigit():
+            error.retry_after = float(retry_after)
+        raise error
+
+    def _remaining(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("Gemini call exceeded its deadline")
+        return remaining
+
+    def _retry_delay(
+        self,
+        attempt: int,
+        error: BaseException,
+        deadline: float
+    ) -> float:
+        """Backoff before the next attempt, or re-raises if there is none."""
+        if attempt >= self.retries or not self._is_retryable(error):
+            raise error
+        delay = self._backoff_delay(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(
+                f"Gemini call exceeded its deadline ({error})"
+            ) from error
+        self._count("retries")
+        print(f"⚠️ Gemini attempt {attempt + 1} failed ({error}), "
+              f"retrying in {delay:.1f}s")
+        return delay
+
+    def _deadline_result(self, future: Future, deadline: float) -> Dict:
+        try:
+            return future.result(timeout=self._remaining(deadline))
+        except TimeoutError:
+            if future.done():
+                raise
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("Gemini call exceeded its deadline") from None
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        return self.latency.quantile(self.hedge_quantile, self.hedge_min_samples)
+
+    # --- Blocking API ---
+
+    def _post(
+        self,
+        body: Dict[str, Any],
+        deadline: float,
+        throttle: bool = True
+    ) -> Dict:
+        if throttle:
+            wait_for = self.rate_limiter.reserve()
+            if wait_for >= self._remaining(deadline):
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("Rate limit wait exceeds the call's deadline")
+            time.sleep(wait_for)
+        self._count("attempts")
+        started = time.monotonic()
+        response = self._http.post(
+            self._url("generateContent"), json=body, timeout=self._remaining(deadline)
+        )
+        self._check(response)
+        self.latency.record(time.monotonic() - started)
+        return response.json()
+
+    def _hedged_post(self, body: Dict[str, Any], deadline: float) -> Dict:
+        hedge_after = self._hedge_delay()
+        if hedge_after is None:
+            return self._post(body, deadline)
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    thread_name_prefix="gemini-hedge"
+                )
+            executor = self._hedge_executor
+
+        primary = executor.submit(self._post, body, deadline)
+        done, _ = wait([primary], timeout=min(hedge_after, self._remaining(deadline)))
+        # Only hedge with spare rate budget: hedges must not cause throttling.
+        if done or not self.rate_limiter.try_acquire():
+            return self._deadline_result(primary, deadline)
+
+        self._count("hedges")
+        backup = executor.submit(self._post, body, deadline, False)
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=self._remaining(deadline),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def generate(
+        self,
+        contents: Contents,
+        system: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict:
+        """Raw `generateContent` response; `DeadlineExceeded` after `timeout`."""
+        self._count("calls")
+        deadline = time.monotonic() + (timeout or self.timeout)
+        body = self._body(contents, system, generation_config)
+        attempt = 0
+        while True:
+            try:
+                return self._hedged_post(body, deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                time.sleep(self._retry_delay(attempt, e, deadline))
+                attempt += 1
+
+    def generate_text(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **generation_config: Any
+    ) -> str:
+        """Single-turn convenience wrapper returning the answer text."""
+        response = self.generate(
+            [{"role": "user", "parts": [{"text": prompt}]}],
+            system, generation_config or None, timeout,
+        )
+        return response_text(response)
+
+    def stream(
+        self,
+        contents: Contents,
+        system: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[Dict]:
+        """
+        Yields `streamGenerateContent` chunks. Failures are only retried before
+        the first chunk; streams are never hedged.
+        """
+        self._count("calls")
+        deadline = time.monotonic() + (timeout or self.timeout)
+        body = self._body(contents, system, generation_config)
+        attempt = 0
+        while True:
+            started = False
+            try:
+                time.sleep(min(self.rate_limiter.reserve(), self._remaining(deadline)))
+                self._count("attempts")
+                with self._http.stream(
+                    "POST",
+                    self._url("streamGenerateContent"),
+                    params={"alt": "sse"},
+                    json=body,
+                    timeout=self._remaining(deadline),
+                ) as response:
+                    if response.status_code >= 400:
+                        response.read()
+                        self._check(response)
+                    for line in response.iter_lines():
+                        if line.startswith("data:"):
+                            started = True
+                            yield json.loads(line[5:])
+                        self._remaining(deadline)
+                return
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if started:
+                    raise
+                time.sleep(self._retry_delay(attempt, e, deadline))
+                attempt += 1
+
+    # --- Async API ---
+
+    def _async_http(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._ahttp is None or self._ahttp_loop is not loop:
+                self._ahttp = httpx.AsyncClient(
+                    base_url=self.endpoint, headers=self._headers, limits=self._limits
+                )
+                self._ahttp_loop = loop
+            return self._ahttp
+
+    async def _apost(
+        self,
+        body: Dict[str, Any],
+        deadline: float,
+        throttle: bool = True
+    ) -> Dict:
+        if throttle:
+            wait_for = self.rate_limiter.reserve()
+            if wait_for >= self._remaining(deadline):
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("Rate limit wait exceeds the call's deadline")
+            await asyncio.sleep(wait_for)
+        self._count("attempts")
+        started = time.monotonic()
+        response = await self._async_http().post(
+            self._url("generateContent"), json=body, timeout=self._remaining(deadline)
+        )
+        self._check(response)
+        self.latency.record(time.monotonic() - started)
+        return response.json()
+
+    async def _ahedged_post(self, body: Dict[str, Any], deadline: float) -> Dict:
+        hedge_after = self._hedge_delay()
+        if hedge_after is None:
+            return await self._apost(body, deadline)
+
+        primary = asyncio.ensure_future(self._apost(body, deadline))
+        done, _ = await asyncio.wait(
+            {primary}, timeout=min(hedge_after, self._remaining(deadline))
+        )
+        if done or not self.rate_limiter.try_acquire():
+            try:
+                return await asyncio.wait_for(primary, self._remaining(deadline))
+            except TimeoutError:
+                if not primary.cancelled():
+                    raise
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("Gemini call exceeded its deadline") from None
+
+        self._count("hedges")
+        backup = asyncio.ensure_future(self._apost(body, deadline, throttle=False))
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self._remaining(deadline),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def agenerate(
+        self,
+        contents: Contents,
+        system: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict:
+        """Async version of `generate`."""
+        self._count("calls")
+        deadline = time.monotonic() + (timeout or self.timeout)
+        body = self._body(contents, system, generation_config)
+        attempt = 0
+        while True:
+            try:
+                return await self._ahedged_post(body, deadline)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(attempt, e, deadline))
+                attempt += 1
+
+    async def astream(
+        self,
+        contents: Contents,
+        system: Optional[str] = None,
+        generation_config: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Dict]:
+        """Async version of `stream`."""
+        self._count("calls")
+        deadline = time.monotonic() + (timeout or self.timeout)
+        body = self._body(contents, system, generation_config)
+        attempt = 0
+        while True:
+            started = False
+            try:
+                await asyncio.sleep(
+                    min(self.rate_limiter.reserve(), self._remaining(deadline))
+                )
+                self._count("attempts")
+                async with self._async_http().stream(
+                    "POST",
+                    self._url("streamGenerateContent"),
+                    params={"alt": "sse"},
+                    json=body,
+                    timeout=self._remaining(deadline),
+                ) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        self._check(response)
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:"):
+                            started = True
+                            yield json.loads(line[5:])
+                        self._remaining(deadline)
+                return
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if started:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e, deadline))
+                attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+        stats["p95_latency"] = self.latency.quantile(0.95)
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            executor, self._hedge_executor = self._hedge_executor, None
+        self._http.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def response_text(response: Dict) -> str:
+    """Concatenated text parts of the first candidate ("" if there is none)."""
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+def response_usage(response: Dict) -> Dict[str, int]:
+    """LangChain-style token counts from a response's `usageMetadata`."""
+    usage = response.get("usageMetadata") or {}
+    input_tokens = usage.get("promptTokenCount", 0)
+    output_tokens = usage.get("candidatesTokenCount", 0)
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": usage.get("totalTokenCount", input_tokens + output_tokens),
+    }
+
+
+_client: Optional[GeminiClient] = None
+_client_lock = threading.Lock()
+
+
+def configure_gemini_client(**kwargs: Any) -> GeminiClient:
+    """
+    Replaces the shared client. Without `api_key`, settings are read from
+    config.yaml and `kwargs` override them.
+    """
+    global _client
+    if "api_key" in kwargs:
+        client = GeminiClient(**kwargs)
+    else:
+        client = GeminiClient.from_config(**kwargs)
+    with _client_lock:
+        old, _client = _client, client
+    if old is not None:
+        old.close()
+    return client
+
+
+def get_gemini_client() -> GeminiClient:
+    """Returns the shared client, building it from config.yaml on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GeminiClient.from_config()
+        return _client
+
+
+def _message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in message.content
+    )
+
+
+def messages_to_contents(messages: List[BaseMessage]) -> Tuple[Optional[str], Contents]:
+    """Splits LangChain messages into a system instruction and Gemini `contents`."""
+    system = []
+    contents: Contents = []
+    for message in messages:
+        text = _message_text(message)
+        if isinstance(message, SystemMessage):
+            system.append(text)
+            continue
+        role = "model" if isinstance(message, AIMessage) else "user"
+        if contents and contents[-1]["role"] == role:
+            # Gemini expects user and model turns to alternate.
+            contents[-1]["parts"].append({"text": text})
+        else:
+            contents.append({"role": role, "parts": [{"text": text}]})
+    return "\n\n".join(system) or None, contents
+
+
+class ChatGemini(BaseChatModel):
+    """LangChain chat model on the shared `GeminiClient`."""
+    client: Any = None
+    temperature: float = 0.7
+    timeout: Optional[float] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "gemini"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self._client().model, "temperature": self.temperature}
+
+    def _client(self) -> GeminiClient:
+        return self.client or get_gemini_client()
+
+    def _request(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]]
+    ) -> Tuple[Contents, Optional[str], Dict[str, Any]]:
+        system, contents = messages_to_contents(messages)
+        generation_config: Dict[str, Any] = {"temperature": self.temperature}
+        if stop:
+            generation_config["stopSequences"] = stop
+        return contents, system, generation_config
+
+    @staticmethod
+    def _result(response: Dict) -> ChatResult:
+        message = AIMessage(
+            content=response_text(response),
+            usage_metadata=response_usage(response),
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        contents, system, config = self._request(messages, stop)
+        response = self._client().generate(contents, system, config, self.timeout)
+        return self._result(response)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        contents, system, config = self._request(messages, stop)
+        response = await self._client().agenerate(
+            contents, system, config, self.timeout
+        )
+        return self._result(response)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        contents, system, config = self._request(messages, stop)
+        usage = None
+        for response in self._client().stream(contents, system, config, self.timeout):
+            usage = response.get("usageMetadata") and response_usage(response) or usage
+            text = response_text(response)
+            if text:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if run_manager:
+                    run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+        if usage:
+            # Usage is cumulative across chunks; report it once at the end.
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content="", usage_metadata=usage)
+            )
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        contents, system, config = self._request(messages, stop)
+        usage = None
+        responses = self._client().astream(contents, system, config, self.timeout)
+        async for response in responses:
+            usage = response.get("usageMetadata") and response_usage(response) or usage
+            text = response_text(response)
+            if text:
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+                if run_manager:
+                    await run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+        if usage:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content="", usage_metadata=usage)
+            )
@@ -0,0 +1,493 @@
+r"""
+Statistical chord progression model.
+
+A compact n-gram model over Roman numerals, trained offline from the curated
+progressions in knowledge_base/finetuning_data.json and any extra corpora:
+
+    python -m melodycomp.progression_model train \
+        knowledge_base/finetuning_data.json more.jsonl
+    python -m melodycomp.progression_model sample --key "F minor" --bars 8 --genre house
+
+Chords are stored relative to the tonic ("Am7" in C major is "VIm7"), so a
+progression in one key teaches every key. Counts are kept per genre and mode,
+per mode, and per mode family (major/minor). Generation is a beam search that
+backs off from the most specific context and the longest history to broader
+ones, multiplying the score by `BACKOFF` at every step down ("stupid
+backoff"). The geometric mean of the step scores is the model's confidence,
+which `MelodyCompAgent` compares against a threshold to answer simple requests
+like "8-bar house in F minor" without an LLM call.
+"""
+import argparse
+import ast
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Container, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .cache import normalize_prompt
+from .intent import FILLER_WORDS
+from .retrieval import detect_genre, genre_slug, key_pitch_class
+
+DEFAULT_MODEL_PATH = "knowledge_base/progression_model.json"
+DEFAULT_CORPUS_PATH = "knowledge_base/finetuning_data.json"
+# Below this confidence the agent falls back to the LLM.
+DEFAULT_CONFIDENCE_THRESHOLD = 0.5
+MODEL_VERSION = 1
+BACKOFF = 0.4
+MAX_BARS = 32
+
+ROMAN = (
+    "I", "bII", "II", "bIII", "III", "IV", "#IV", "V", "bVI", "VI", "bVII", "VII"
+)
+SHARP_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+FLAT_NAMES = ("C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B")
+_ROMAN_RE = re.compile(r"([b#]?(?:VII|VI|V|IV|III|II|I))(.*)$")
+_CHORD_RE = re.compile(r"([A-G][#b]?)(.*)$")
+
+START = "<s>"
+END = "</s>"
+
+MODE_ALIASES = {"ionian": "major", "aeolian": "minor"}
+MODE_FAMILIES = {
+    "major": "major",
+    "lydian": "major",
+    "mixolydian": "major",
+    "minor": "minor",
+    "harmonic_minor": "minor",
+    "melodic_minor": "minor",
+    "dorian": "minor",
+    "phrygian": "minor",
+    "locrian": "minor",
+}
+# Semitones from the relative major's tonic up to the mode's tonic, to pick
+# the key signature (and so sharp or flat chord names).
+MODE_OFFSETS = {
+    "major": 0,
+    "dorian": 2,
+    "phrygian": 4,
+    "lydian": 5,
+    "mixolydian": 7,
+    "minor": 9,
+    "harmonic_minor": 9,
+    "melodic_minor": 9,
+    "locrian": 11,
+}
+_FLAT_MAJOR_KEYS = {5, 10, 3, 8, 1}  # F, Bb, Eb, Ab, Db
+
+def normalize_mode(mode: str) -> str:
+    mode = mode.lower().replace(" ", "_")
+    return MODE_ALIASES.get(mode, mode)
+
+
+def to_roman(chord: str, tonic: int) -> Optional[str]:
+    """
+    Degree token of a chord relative to a tonic pitch class: ("Am7", 0) -> "VIm7".
+    None for names that can't be transposed this way (e.g. "Bm7/E7").
+    """
+    match = _CHORD_RE.match(chord.strip())
+    if not match or re.search(r"/[A-G]", match.group(2)):
+        return None
+    root = key_pitch_class(match.group(1))
+    if root is None:
+        return None
+    return ROMAN[(root - tonic) % 12] + match.group(2)
+
+
+def from_roman(token: str, tonic: int, flats: bool = False) -> str:
+    """Chord name of a degree token in a key: ("VIm7", 0) -> "Am7"."""
+    match = _ROMAN_RE.match(token)
+    if not match:
+        raise ValueError(f"Not a Roman numeral chord: {token!r}")
+    names = FLAT_NAMES if flats else SHARP_NAMES
+    return names[(tonic + ROMAN.index(match.group(1))) % 12] + match.group(2)
+
+
+def enharmonic_spellings(chords: Iterable[str]) -> Set[str]:
+    """The chord names plus their other root spelling ("A#m7" also as "Bbm7")."""
+    names = set()
+    for chord in chords:
+        names.add(chord)
+        match = _CHORD_RE.match(chord)
+        pitch_class = key_pitch_class(match.group(1)) if match else None
+        if pitch_class is not None:
+            names.add(SHARP_NAMES[pitch_class] + match.group(2))
+            names.add(FLAT_NAMES[pitch_class] + match.group(2))
+    return names
+
+
+def prefers_flats(root: str, mode: str) -> bool:
+    """Whether chords in this key are conventionally spelled with flats."""
+    if len(root) > 1:
+        return root[1] == "b"
+    tonic = key_pitch_class(root)
+    if tonic is None:
+        return False
+    relative_major = (tonic - MODE_OFFSETS.get(normalize_mode(mode), 0)) % 12
+    return relative_major in _FLAT_MAJOR_KEYS
+
+
+def _parse_key(key: str) -> Optional[Tuple[str, str]]:
+    match = re.match(r"\s*([A-Ga-g][#b]?)\s+([A-Za-z_]+)", key or "")
+    if not match:
+        return None
+    return match.group(1), normalize_mode(match.group(2))
+
+
+def _record_fields(record: Dict) -> Tuple[Sequence[str], str, str]:
+    """
+    (chords, key, genre) of a corpus record: either a fine-tuning example
+    (`output` string and `metadata`) or a plain {"chords", "key", "genre"} object.
+    """
+    if "chords" in record:
+        return record["chords"], record.get("key", ""), record.get("genre", "")
+    metadata = record.get("metadata", {})
+    chords = record["output"]
+    if isinstance(chords, str):
+        chords = ast.literal_eval(chords)
+    return chords, metadata.get("key", ""), metadata.get("genre", "")
+
+
+def load_corpus(path: str) -> List[Dict]:
+    """Records from a JSON list or a JSONL file."""
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+@dataclass(frozen=True)
+class Progression:
+    chords: Tuple[str, ...]
+    numerals: Tuple[str, ...]
+    confidence: float
+
+
+class ProgressionModel:
+    """
+    Roman-numeral n-gram counts by context. `order` is the n of the n-grams
+    (3 = each chord is conditioned on the two before it).
+    """
+
+    def __init__(self, order: int = 3) -> None:
+        if order < 1:
+            raise ValueError("order must be at least 1")
+        self.order = order
+        self.progressions = 0
+        self.genres: List[str] = []
+        # context -> history (tokens joined by spaces) -> next token -> count
+        self.counts: Dict[str, Dict[str, Counter]] = defaultdict(
+            lambda: defaultdict(Counter)
+        )
+        self._step_cache: Dict[Tuple, List[Tuple[str, float]]] = {}
+
+    @staticmethod
+    def _context_keys(genre: Optional[str], mode: str) -> List[str]:
+        keys = [f"mode={mode}"]
+        if genre:
+            keys.insert(0, f"genre={genre}|mode={mode}")
+        family = MODE_FAMILIES.get(mode)
+        if family:
+            keys.append(f"family={family}")
+        return keys
+
+    def add(self, chords: Sequence[str], key: str, genre: str = "") -> bool:
+        """
+        Counts one progression. Returns False (and skips it) if the key or a
+        chord can't be read.
+        """
+        key_info = _parse_key(key)
+        tonic = key_pitch_class(key_info[0]) if key_info else None
+        if tonic is None or not chords:
+            return False
+        tokens = [to_roman(chord, tonic) for chord in chords]
+        if None in tokens:
+            return False
+
+        genre = genre_slug(genre) if genre else None
+        contexts = [
+            self.counts[name] for name in self._context_keys(genre, key_info[1])
+        ]
+        sequence = [START] * (self.order - 1) + tokens + [END]
+        for i in range(self.order - 1, len(sequence)):
+            for length in range(self.order):
+                history = " ".join(sequence[i - length:i])
+                for counts in contexts:
+                    counts[history][sequence[i]] += 1
+        self.progressions += 1
+        self._step_cache.clear()
+        if genre and genre not in self.genres:
+            self.genres = sorted([*self.genres, genre])
+        return True
+
+    @classmethod
+    def train(cls, records: Iterable[Dict], order: int = 3) -> "ProgressionModel":
+        model = cls(order)
+        for record in records:
+            try:
+                model.add(*_record_fields(record))
+            except (KeyError, ValueError, SyntaxError):
+                continue
+        return model
+
+    # --- Persistence ---
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": MODEL_VERSION,
+            "order": self.order,
+            "progressions": self.progressions,
+            "genres": self.genres,
+            "counts": {
+                context: {history: dict(nexts) for history, nexts in histories.items()}
+                for context, histories in self.counts.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ProgressionModel":
+        if data.get("version") != MODEL_VERSION:
+            raise ValueError(
+                f"Unsupported progression model version: {data.get('version')}"
+            )
+        model = cls(data["order"])
+        model.progressions = data["progressions"]
+        model.genres = list(data["genres"])
+        for context, histories in data["counts"].items():
+            for history, nexts in histories.items():
+                model.counts[context][history] = Counter(nexts)
+        return model
+
+    def save(self, path: str = DEFAULT_MODEL_PATH) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> "ProgressionModel":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    # --- Prompts ---
+
+    def resolve_genres(self, query: str) -> List[str]:
+        """
+        Genres of the model a prompt asks for: the genre it names ("trip hop"),
+        else every genre sharing a word with it ("house" -> acid, progressive
+        and tech house).
+        """
+        genre = detect_genre(query, self.genres)
+        if genre:
+            return [genre]
+        words = set(normalize_prompt(query).split()) - FILLER_WORDS
+        return [genre for genre in self.genres if words & set(genre.split("_"))]
+
+    def has_mode(self, mode: str) -> bool:
+        """Whether the model saw this mode itself (not only through its family)."""
+        return f"mode={normalize_mode(mode)}" in self.counts
+
+    def unknown_words(self, words: Iterable[str]) -> List[str]:
+        """
+        The words that don't name one of the model's genres, e.g. of a
+        prompt's `PromptIntent.remainder`. A request is simple when none are left.
+        """
+        genre_words = {word for genre in self.genres for word in genre.split("_")}
+        return [word for word in words if word not in genre_words]
+
+    # --- Generation ---
+
+    def _levels(
+        self,
+        genres: Tuple[str, ...],
+        mode: str
+    ) -> List[List[Dict[str, Counter]]]:
+        """Contexts to back off through, most specific first."""
+        levels = [
+            [f"genre={genre}|mode={mode}" for genre in genres],
+            [f"mode={mode}"],
+            [f"family={MODE_FAMILIES[mode]}"] if mode in MODE_FAMILIES else [],
+        ]
+        # A requested genre without data in this mode still costs its backoff
+        # steps, so the confidence reflects that the genre was ignored.
+        return [
+            [self.counts[key] for key in keys if key in self.counts]
+            for i, keys in enumerate(levels)
+            if keys and (i == 0 or any(key in self.counts for key in keys))
+        ]
+
+    def _steps(
+        self,
+        genres: Tuple[str, ...],
+        mode: str,
+        history: Tuple[str, ...]
+    ) -> List[Tuple[str, float]]:
+        """
+        (token, log score) of the chords that may follow `history` (the last
+        `order - 1` tokens, padded with START). Candidates are what followed the
+        longest known history at each level, not the whole vocabulary. Scores
+        don't depend on the key, so they're cached across calls.
+        """
+        cache_key = (genres, mode, history)
+        steps = self._step_cache.get(cache_key)
+        if steps is not None:
+            return steps
+
+        levels = self._levels(genres, mode)
+        distributions = []
+        for level in levels:
+            for length in range(len(history), -1, -1):
+                key = " ".join(history[len(history) - length:]) if length else ""
+                contexts = [counts[key] for counts in level if key in counts]
+                nexts = contexts[0] if len(contexts) == 1 else sum(contexts, Counter())
+                distributions.append((nexts, sum(nexts.values())))
+
+        def score(token: str) -> float:
+            penalty = 1.0
+            for nexts, total in distributions:
+                count = nexts.get(token)
+                if count:
+                    return penalty * count / total
+                penalty *= BACKOFF
+            return 0.0
+
+        found: Dict[str, None] = {}
+        per_level = len(history) + 1
+        for level in range(len(levels)):
+            level_distributions = distributions[
+                level * per_level:(level + 1) * per_level
+            ]
+            for nexts, total in level_distributions:
+                if total > nexts.get(END, 0):
+                    found.update(dict.fromkeys(nexts))
+                    break
+        steps = [
+            (token, math.log(score(token)))
+            for token in [*found, END]
+            if score(token) > 0
+        ]
+        self._step_cache[cache_key] = steps
+        return steps
+
+    def generate(
+        self,
+        root: str,
+        mode: str,
+        bars: int,
+        genres: Sequence[str] = (),
+        vocabulary: Optional[Container[str]] = None,
+        beam_width: int = 8,
+    ) -> Optional[Progression]:
+        """
+        Most likely progression of `bars` chords (one per bar) in the key, or
+        None if the model has nothing for this mode.
+
+        Args:
+            genres: Genre slugs to condition on; their counts are pooled.
+            vocabulary: Chord names that may be emitted (e.g. the chord library).
+                Degrees that can't be spelled as one of them are skipped.
+        """
+        tonic = key_pitch_class(root)
+        mode = normalize_mode(mode)
+        genres = tuple(sorted(genres))
+        if tonic is None or not 0 < bars <= MAX_BARS:
+            return None
+        if not any(self._levels(genres, mode)):
+            return None
+
+        flats = prefers_flats(root, mode)
+        spellings: Dict[str, Optional[str]] = {}
+
+        def spell(token: str) -> Optional[str]:
+            if token not in spellings:
+                # Flat and sharp degrees keep their accidental ("bVI" of D is Bb).
+                prefer_flats = token[0] == "b" or (token[0] != "#" and flats)
+                names = [
+                    from_roman(token, tonic, prefer_flats),
+                    from_roman(token, tonic, not prefer_flats),
+                ]
+                spellings[token] = next(
+                    (
+                        name for name in names
+                        if vocabulary is None or name in vocabulary
+                    ),
+                    None,
+                )
+            return spellings[token]
+
+        start = (START,) * (self.order - 1)
+        beams: List[Tuple[float, Tuple[str, ...]]] = [(0.0, ())]
+        for _ in range(bars):
+            expanded = []
+            for log_score, tokens in beams:
+                history = (start + tokens)[len(tokens):]
+                for token, step in self._steps(genres, mode, history):
+                    if token != END and spell(token):
+                        expanded.append((log_score + step, tokens + (token,)))
+            if not expanded:
+                return None
+            beams = sorted(expanded, key=lambda beam: (-beam[0], beam[1]))[:beam_width]
+
+        # Prefer progressions that end the way training progressions end.
+        finished = []
+        for log_score, tokens in beams:
+            steps = dict(self._steps(genres, mode, (start + tokens)[len(tokens):]))
+            finished.append((log_score + steps.get(END, math.log(1e-6)), tokens))
+        log_score, tokens = min(finished, key=lambda beam: (-beam[0], beam[1]))
+        return Progression(
+            chords=tuple(spell(token) for token in tokens),
+            numerals=tokens,
+            confidence=math.exp(log_score / (bars + 1)),
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Train or sample the chord progression model."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="Train from JSON/JSONL corpora.")
+    train.add_argument("corpora", nargs="*", default=[DEFAULT_CORPUS_PATH],
+                       help="Fine-tuning style JSON files or "
+                            "{\"chords\", \"key\", \"genre\"} JSONL.")
+    train.add_argument("--order", type=int, default=3)
+    train.add_argument("--output", default=DEFAULT_MODEL_PATH)
+
+    sample = commands.add_parser("sample", help="Generate a progression.")
+    sample.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    sample.add_argument("--key", required=True, help='e.g. "F minor"')
+    sample.add_argument("--bars", type=int, default=8)
+    sample.add_argument("--genre", default="",
+                        help="Genre name or word, e.g. \"house\".")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        records = [record for path in args.corpora for record in load_corpus(path)]
+        model = ProgressionModel.train(records, order=args.order)
+        model.save(args.output)
+        print(f"✅ Trained on {model.progressions}/{len(records)} progressions "
+              f"({len(model.genres)} genres), saved to {args.output}.")
+        return 0
+
+    key_info = _parse_key(args.key)
+    if not key_info:
+        print(f"🔴 Could not read key {args.key!r}.", file=sys.stderr)
+        return 1
+    model = ProgressionModel.load(args.model)
+    genres = model.resolve_genres(args.genre) if args.genre else ()
+    progression = model.generate(*key_info, args.bars, genres=genres)
+    if progression is None:
+        print(f"⚠️ No progression for {args.key}.", file=sys.stderr)
+        return 1
+    print(progression.chords)
+    print(" - ".join(progression.numerals))
+    print(f"confidence: {progression.confidence:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
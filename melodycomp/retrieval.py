@@ -0,0 +1,237 @@
+"""
+Retrieval of genre context and few-shot examples for chord prompts.
+
+The prompt is embedded once and that embedding is used for both collections
+(recent query embeddings are cached by the embedding function itself, see
+`LocalEmbeddingFunction.embed_query`). The genre and key of the
+prompt's intent (see `melodycomp.intent`) become metadata filters, so the
+vector search only ranks the chunks of the requested genre and the examples in
+the requested genre/key, however many genres the knowledge base holds. Filters
+are relaxed step by step when they leave too few results.
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .cache import normalize_prompt
+from .gen_chord_lib import NOTE_MAP
+from .tracing import tracer
+
+Where = Optional[Dict[str, Any]]
+
+
+def genre_slug(name: str) -> str:
+    """Normalizes a genre name: "Trip-Hop" and "trip hop" both become "trip_hop"."""
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def detect_genre(query: str, genres: Iterable[str]) -> Optional[str]:
+    """Returns the genre slug mentioned in the query, preferring the longest match."""
+    normalized = f" {normalize_prompt(query)} "
+    for genre in sorted(genres, key=len, reverse=True):
+        if f" {genre.replace('_', ' ')} " in normalized:
+            return genre
+    return None
+
+
+def key_pitch_class(root: str) -> Optional[int]:
+    """Pitch class of a key root ("A", "f#", "Bb"), or None if unknown."""
+    midi_note = NOTE_MAP.get(root[:1].upper() + root[1:].lower()) if root else None
+    return None if midi_note is None else midi_note % 12
+
+
+def parse_key_metadata(key: str) -> Tuple[Optional[int], Optional[str]]:
+    """Splits example metadata like "F# minor" or "E major/blues" into (pc, mode)."""
+    match = re.match(r"\s*([A-Ga-g][#b]?)\s+([A-Za-z]+)", key or "")
+    if not match:
+        return None, None
+    return key_pitch_class(match.group(1)), match.group(2).lower()
+
+
+def example_metadata(example: Dict) -> Dict[str, Any]:
+    """Flat, filterable Chroma metadata for a few-shot example."""
+    info = example.get("metadata", {})
+    key_pc, key_mode = parse_key_metadata(info.get("key", ""))
+    metadata = {
+        "output": example["output"],
+        "instruction": example["instruction"],
+        "genre": genre_slug(info.get("genre", "")),
+        "emotion_tags": ",".join(info.get("emotion_tags", [])),
+    }
+    # Chroma metadata values can't be None; leave unknown keys out instead.
+    if key_pc is not None:
+        metadata["key_pc"] = key_pc
+        metadata["key_mode"] = key_mode
+    return metadata
+
+
+@dataclass(frozen=True)
+class RetrievalResult:
+    genre_context: str
+    few_shot_examples: str
+    genre: Optional[str] = None
+    key: Optional[Tuple[str, str]] = None
+
+
+class Retriever:
+    """
+    Genre context and few-shot examples for a prompt, from the two Chroma
+    collections built by `MelodyCompAgent`. Both collections must use the
+    same embedding function as `embedding_function`; `intent_parser` maps a
+    prompt to its `PromptIntent`.
+    """
+
+    def __init__(
+        self,
+        genre_collection: Any,
+        examples_collection: Any,
+        embedding_function: Callable[[List[str]], Sequence],
+        intent_parser: Callable[[str], Any],
+        n_genre_results: int = 5,
+        n_examples: int = 2,
+    ) -> None:
+        self.genre_collection = genre_collection
+        self.examples_collection = examples_collection
+        self.embedding_function = embedding_function
+        self.intent_parser = intent_parser
+        self.n_genre_results = n_genre_results
+        self.n_examples = n_examples
+
+        self.genres = self._collection_genres(genre_collection)
+        self.example_genres = self._collection_genres(examples_collection)
+
+    @staticmethod
+    def _collection_genres(collection: Any) -> List[str]:
+        metadatas = collection.get(include=["metadatas"])["metadatas"] or []
+        return sorted({
+            metadata["genre"]
+            for metadata in metadatas
+            if metadata and metadata.get("genre")
+        })
+
+    def embed_query(self, query: str) -> List[float]:
+        # Prefer the function's query path (e.g. `LocalEmbeddingFunction`,
+        # which caches queries in memory and keeps them out of its on-disk
+        # document cache).
+        embed = getattr(self.embedding_function, "embed_query", self.embedding_function)
+        with tracer.span("query_embedding"):
+            return [float(x) for x in embed([query])[0]]
+
+    @staticmethod
+    def _search(
+        collection: Any,
+        embedding: List[float],
+        n_results: int,
+        filters: Sequence[Where],
+        min_results: Optional[int] = None,
+    ) -> Tuple[List[str], List[Dict], List[float]]:
+        """
+        Runs the query with each filter in turn (strictest first) until at
+        least `min_results` (default: `n_results`) distinct documents were found.
+        """
+        min_results = n_results if min_results is None else min_results
+        documents: List[str] = []
+        metadatas: List[Dict] = []
+        distances: List[float] = []
+        seen = set()
+        for where in filters:
+            results = collection.query(
+                query_embeddings=[embedding],
+                n_results=n_results,
+                where=where,
+            )
+            for doc_id, document, metadata, distance in zip(
+                results["ids"][0],
+                results["documents"][0],
+                results["metadatas"][0],
+                results["distances"][0],
+            ):
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                documents.append(document)
+                metadatas.append(metadata)
+                distances.append(distance)
+            if len(documents) >= min_results:
+                break
+        return documents[:n_results], metadatas[:n_results], distances[:n_results]
+
+    def _genre_filters(self, genre: Optional[str]) -> List[Where]:
+        return [{"genre": genre}, None] if genre else [None]
+
+    def _example_filters(
+        self,
+        genre: Optional[str],
+        key: Optional[Tuple[str, str]]
+    ) -> List[Where]:
+        key_pc = key_pitch_class(key[0]) if key else None
+        key_where = (
+            [{"key_pc": key_pc}, {"key_mode": key[1].lower()}]
+            if key_pc is not None else []
+        )
+        filters: List[Where] = []
+        if genre and key_where:
+            filters.append({"$and": [{"genre": genre}, *key_where]})
+        if genre:
+            filters.append({"genre": genre})
+        if key_where:
+            filters.append({"$and": key_where})
+        filters.append(None)
+        return filters
+
+    def retrieve(self, query: str) -> RetrievalResult:
+        with tracer.span("retrieval") as span:
+            intent = self.intent_parser(query)
+            genre, key = intent.genre, intent.key
+            # Examples are tagged with their own, finer genre names.
+            example_genre = detect_genre(query, self.example_genres)
+            span.update(genre=genre, key=" ".join(key) if key else None)
+
+            genre_count = self.genre_collection.count()
+            example_count = self.examples_collection.count()
+            if not genre_count and not example_count:
+                return RetrievalResult("No genre context available.", "", genre, key)
+            embedding = self.embed_query(query)
+
+            genre_context = "No genre context available."
+            if genre_count:
+                documents, _, _ = self._search(
+                    self.genre_collection,
+                    embedding,
+                    min(self.n_genre_results, genre_count),
+                    self._genre_filters(genre),
+                    # Only widen to other genres if the genre has no chunks.
+                    min_results=1,
+                )
+                genre_context = "\n\n---\n\n".join(documents)
+
+            few_shot_examples = ""
+            if example_count and self.n_examples:
+                few_shot_examples = self._format_examples(*self._search(
+                    self.examples_collection,
+                    embedding,
+                    min(self.n_examples, example_count),
+                    self._example_filters(example_genre, key),
+                ))
+        return RetrievalResult(genre_context, few_shot_examples, genre, key)
+
+    @staticmethod
+    def _format_examples(
+        documents: List[str],
+        metadatas: List[Dict],
+        distances: List[float]
+    ) -> str:
+        if not documents:
+            return ""
+        formatted_examples = "### HIGH-QUALITY EXAMPLES\n"
+        for i, (instruction, metadata, distance) in enumerate(zip(
+            documents, metadatas, distances
+        )):
+            # Convert distance to similarity score (lower distance = higher similarity)
+            similarity_score = 1 - distance
+            formatted_examples += (
+                f"Example {i+1} (Similarity: {similarity_score:.3f}):\n"
+            )
+            formatted_examples += f"- Request: \"{instruction}\"\n"
+            formatted_examples += f"- Response: {metadata['output']}\n\n"
+        return formatted_examples
@@ -0,0 +1,410 @@
+"""
+Latency- and load-aware routing between model backends.
+
+`ModelRouter` is a LangChain runnable in front of several chat models/LLMs
+(e.g. the local MLX model and Gemini), so it can stand wherever the agent
+uses one model: in `conversation_chain` and for the tips calls. Per request
+it:
+
+- ranks the backends by how likely they are to answer within the deadline:
+  backends whose circuit is open go last, then those whose expected latency
+  (a recent latency quantile, multiplied by the requests already queued on
+  them) doesn't fit the remaining time, the rest by expected latency divided
+  by their recent success rate,
+- tries them in that order, failing over on errors and per-attempt timeouts
+  until the deadline runs out,
+- opens a backend's circuit for `cooldown` seconds after `failure_threshold`
+  failures in a row.
+
+Call kwargs (e.g. the `allowed_chords` the agent binds for constrained local
+decoding) are only passed to backends that list them in `Backend.accepts`.
+
+Streams fail over until their first chunk arrives and are committed to their
+backend after that. A synchronous call that times out can't be interrupted:
+it keeps running in its worker thread, and counts as in flight, until it
+returns.
+"""
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterator, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from .model_client import DeadlineExceeded, LatencyTracker
+from .tracing import tracer
+
+_END = object()
+
+
+@dataclass(frozen=True)
+class Backend:
+    """
+    A model behind the router.
+
+    Args:
+        name: Name in stats and traces, e.g. "mlx".
+        model: The LangChain chat model or LLM.
+        accepts: Call kwargs the model understands (others are dropped).
+        max_concurrency: Requests it serves at once; more are assumed to queue.
+        expected_latency: Latency in seconds assumed until calls were observed.
+        timeout: Cap of a single attempt in seconds (default: the deadline).
+    """
+
+    name: str
+    model: Runnable
+    accepts: FrozenSet[str] = frozenset()
+    max_concurrency: int = 1
+    expected_latency: float = 5.0
+    timeout: Optional[float] = None
+
+
+class BackendStats:
+    """Thread-safe rolling latency and health of one backend."""
+
+    def __init__(self, window: int = 100) -> None:
+        self.latency = LatencyTracker(window)
+        self._outcomes: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._counters = {"calls": 0, "failures": 0, "timeouts": 0}
+
+    def start(self) -> float:
+        with self._lock:
+            self.in_flight += 1
+            self._counters["calls"] += 1
+        return time.monotonic()
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(
+        self,
+        started: float,
+        error: Optional[BaseException],
+        failure_threshold: int,
+        cooldown: float
+    ) -> None:
+        with self._lock:
+            self._outcomes.append(error is None)
+            if error is None:
+                self.consecutive_failures = 0
+                self.latency.record(time.monotonic() - started)
+                return
+            self._counters["failures"] += 1
+            if isinstance(error, TimeoutError):
+                self._counters["timeouts"] += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= failure_threshold:
+                self.open_until = time.monotonic() + cooldown
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters, in_flight=self.in_flight)
+        p50, p90 = self.latency.quantile(0.5), self.latency.quantile(0.9)
+        stats.update(
+            error_rate=round(self.error_rate(), 3),
+            p50_ms=None if p50 is None else round(p50 * 1000, 1),
+            p90_ms=None if p90 is None else round(p90 * 1000, 1),
+            circuit_open=self.is_open(),
+        )
+        return stats
+
+
+class ModelRouter(Runnable):
+    """
+    Routes each call to one of `backends` (listed in order of preference,
+    which breaks ties).
+
+    Args:
+        deadline: Seconds a call may take, failovers included.
+        latency_quantile: Recent latency quantile used as a backend's expected
+            latency.
+        min_samples: Calls observed before that quantile replaces
+            `Backend.expected_latency`.
+        window: Calls kept in each backend's rolling stats.
+        failure_threshold: Consecutive failures that open a backend's circuit.
+        cooldown: Seconds a backend with an open circuit is tried last.
+    """
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        deadline: float = 60.0,
+        latency_quantile: float = 0.9,
+        min_samples: int = 5,
+        window: int = 100,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+    ) -> None:
+        if not backends:
+            raise ValueError("ModelRouter needs at least one backend")
+        if len({backend.name for backend in backends}) != len(backends):
+            raise ValueError("Backend names must be unique")
+        self.backends = list(backends)
+        self.deadline = deadline
+        self.latency_quantile = latency_quantile
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._stats = {backend.name: BackendStats(window) for backend in backends}
+        self._executor = ThreadPoolExecutor(
+            max_workers=sum(backend.max_concurrency + 1 for backend in backends),
+            thread_name_prefix="melodycomp-router",
+        )
+
+    def accepts(self, kwarg: str) -> bool:
+        """Whether any backend takes the call kwarg (worth binding at all)."""
+        return any(kwarg in backend.accepts for backend in self.backends)
+
+    def expected_latency(self, backend: Backend) -> float:
+        stats = self._stats[backend.name]
+        observed = stats.latency.quantile(self.latency_quantile, self.min_samples)
+        latency = backend.expected_latency if observed is None else observed
+        # Requests beyond its concurrency wait for the ones ahead of them.
+        return latency * (1 + stats.in_flight // max(1, backend.max_concurrency))
+
+    def plan(self, remaining: Optional[float] = None) -> List[Backend]:
+        """Backends in the order a call with `remaining` seconds would try them."""
+        remaining = self.deadline if remaining is None else remaining
+        ranked = []
+        for i, backend in enumerate(self.backends):
+            stats = self._stats[backend.name]
+            expected = self.expected_latency(backend)
+            success = max(1.0 - stats.error_rate(), 0.05)
+            rank = (stats.is_open(), expected > remaining, expected / success, i)
+            ranked.append((rank, backend))
+        return [backend for _, backend in sorted(ranked, key=lambda item: item[0])]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+    # --- Calls ---
+
+    @staticmethod
+    def _kwargs(backend: Backend, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in kwargs.items() if key in backend.accepts}
+
+    def _attempts(self, deadline: float) -> Iterator[tuple]:
+        """(backend, attempt timeout) in plan order while time is left."""
+        for backend in self.plan(deadline - time.monotonic()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield backend, min(remaining, backend.timeout or remaining)
+
+    def _record(
+        self,
+        backend: Backend,
+        started: float,
+        error: Optional[BaseException]
+    ) -> None:
+        self._stats[backend.name].record(
+            started, error, self.failure_threshold, self.cooldown
+        )
+
+    def _failed(self, errors: List[BaseException]) -> BaseException:
+        if errors and not all(isinstance(error, TimeoutError) for error in errors):
+            return errors[-1]
+        return DeadlineExceeded(
+            f"No model backend answered within {self.deadline:.1f}s"
+        )
+
+    def invoke(
+        self,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any
+    ) -> Any:
+        deadline = time.monotonic() + self.deadline
+        errors: List[BaseException] = []
+        with tracer.span("model_route") as span:
+            for backend, timeout in self._attempts(deadline):
+                span.update(backend=backend.name, attempts=len(errors) + 1)
+                stats = self._stats[backend.name]
+                started = stats.start()
+                context = contextvars.copy_context()
+                future = self._executor.submit(
+                    context.run,
+                    backend.model.invoke,
+                    input,
+                    config,
+                    **self._kwargs(backend, kwargs),
+                )
+                future.add_done_callback(lambda _, stats=stats: stats.release())
+                try:
+                    result = future.result(timeout=timeout)
+                except FutureTimeoutError:
+                    error: BaseException = DeadlineExceeded(
+                        f"{backend.name} took longer than {timeout:.1f}s"
+                    )
+                except Exception as e:
+                    error = e
+                else:
+                    self._record(backend, started, None)
+                    return result
+                self._record(backend, started, error)
+                errors.append(error)
+            raise self._failed(errors)
+
+    async def ainvoke(
+        self,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any
+    ) -> Any:
+        deadline = time.monotonic() + self.deadline
+        errors: List[BaseException] = []
+        with tracer.span("model_route") as span:
+            for backend, timeout in self._attempts(deadline):
+                span.update(backend=backend.name, attempts=len(errors) + 1)
+                stats = self._stats[backend.name]
+                started = stats.start()
+                try:
+                    result = await asyncio.wait_for(
+                        backend.model.ainvoke(
+                            input, config, **self._kwargs(backend, kwargs)
+                        ),
+                        timeout,
+                    )
+                except asyncio.TimeoutError:
+                    error: BaseException = DeadlineExceeded(
+                        f"{backend.name} took longer than {timeout:.1f}s"
+                    )
+                except Exception as e:
+                    error = e
+                else:
+                    self._record(backend, started, None)
+                    return result
+                finally:
+                    stats.release()
+                self._record(backend, started, error)
+                errors.append(error)
+            raise self._failed(errors)
+
+    def stream(
+        self,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any
+    ) -> Iterator[Any]:
+        deadline = time.monotonic() + self.deadline
+        errors: List[BaseException] = []
+        with tracer.span("model_route", streaming=True) as span:
+            for backend, timeout in self._attempts(deadline):
+                span.update(backend=backend.name, attempts=len(errors) + 1)
+                stats = self._stats[backend.name]
+                started = stats.start()
+                chunks = iter(
+                    backend.model.stream(input, config, **self._kwargs(backend, kwargs))
+                )
+                # Only the wait for the first chunk runs in a worker thread.
+                future = self._executor.submit(
+                    contextvars.copy_context().run, next, chunks, _END
+                )
+                try:
+                    first = future.result(timeout=timeout)
+                except FutureTimeoutError:
+                    error: BaseException = DeadlineExceeded(
+                        f"{backend.name} sent nothing for {timeout:.1f}s"
+                    )
+
+                    def abandon(_: Any, chunks=chunks, stats=stats) -> None:
+                        chunks.close()
+                        stats.release()
+
+                    future.add_done_callback(abandon)
+                except Exception as e:
+                    error = e
+                    stats.release()
+                else:
+                    break
+                self._record(backend, started, error)
+                errors.append(error)
+            else:
+                raise self._failed(errors)
+
+            # Committed to this backend: later errors propagate.
+            error = None
+            try:
+                if first is not _END:
+                    yield first
+                    yield from chunks
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                stats.release()
+                self._record(backend, started, error)
+
+    async def astream(
+        self,
+        input: Any,
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        deadline = time.monotonic() + self.deadline
+        errors: List[BaseException] = []
+        with tracer.span("model_route", streaming=True) as span:
+            for backend, timeout in self._attempts(deadline):
+                span.update(backend=backend.name, attempts=len(errors) + 1)
+                stats = self._stats[backend.name]
+                started = stats.start()
+                chunks = backend.model.astream(
+                    input, config, **self._kwargs(backend, kwargs)
+                ).__aiter__()
+                try:
+                    first = await asyncio.wait_for(anext(chunks, _END), timeout)
+                except asyncio.TimeoutError:
+                    error: BaseException = DeadlineExceeded(
+                        f"{backend.name} sent nothing for {timeout:.1f}s"
+                    )
+                except Exception as e:
+                    error = e
+                else:
+                    break
+                stats.release()
+                with contextlib.suppress(Exception):
+                    await chunks.aclose()
+                self._record(backend, started, error)
+                errors.append(error)
+            else:
+                raise self._failed(errors)
+
+            error = None
+            try:
+                if first is not _END:
+                    yield first
+                    async for chunk in chunks:
+                        yield chunk
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                stats.release()
+                self._record(backend, started, error)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,83 @@
+import threading
+import uuid
+from typing import Callable, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+
+def approximate_token_count(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for history budgets."""
+    return len(text) // 4 + 1
+
+
+class ConversationSession:
+    """
+    Conversation state of one user/session, kept apart from the shared agent
+    core (model, indexes, chord library) so concurrent sessions can't see or
+    corrupt each other's history.
+
+    The history is bounded by `max_history_tokens`: when a new exchange pushes
+    it over budget, the oldest exchanges are dropped. If a `summarizer` is given
+    (a callable taking the previous summary and the dropped messages and
+    returning a new summary), dropped exchanges are folded into a running
+    summary that is sent ahead of the remaining history instead.
+    """
+
+    def __init__(
+        self,
+        session_id: Optional[str] = None,
+        max_history_tokens: int = 1000,
+        token_counter: Callable[[str], int] = approximate_token_count,
+        summarizer: Optional[Callable[[str, List[BaseMessage]], str]] = None,
+    ) -> None:
+        self.session_id = session_id or uuid.uuid4().hex
+        self.max_history_tokens = max_history_tokens
+        self.token_counter = token_counter
+        self.summarizer = summarizer
+        self.summary = ""
+        self._messages: List[BaseMessage] = []
+        self._tokens: List[int] = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_empty(self) -> bool:
+        return not self._messages and not self.summary
+
+    def history(self) -> List[BaseMessage]:
+        """Messages to send to the model: the summary (if any) and recent turns."""
+        with self._lock:
+            messages = list(self._messages)
+            summary = self.summary
+        if summary:
+            messages.insert(0, SystemMessage(
+                content=f"Summary of the earlier conversation: {summary}"
+            ))
+        return messages
+
+    def add_exchange(self, user_input: str, output: str) -> None:
+        """Records one user/assistant exchange and trims the history to budget."""
+        with self._lock:
+            exchange = (HumanMessage(content=user_input), AIMessage(content=output))
+            for message in exchange:
+                self._messages.append(message)
+                self._tokens.append(self.token_counter(message.content))
+            dropped = self._trim()
+        if dropped and self.summarizer is not None:
+            summary = self.summarizer(self.summary, dropped)
+            with self._lock:
+                self.summary = summary
+
+    def clear(self) -> None:
+        with self._lock:
+            self._messages.clear()
+            self._tokens.clear()
+            self.summary = ""
+
+    def _trim(self) -> List[BaseMessage]:
+        dropped: List[BaseMessage] = []
+        # Drop whole exchanges, but always keep the latest one.
+        while sum(self._tokens) > self.max_history_tokens and len(self._messages) > 2:
+            dropped.extend(self._messages[:2])
+            del self._messages[:2]
+            del self._tokens[:2]
+        return dropped
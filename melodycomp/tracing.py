@@ -0,0 +1,207 @@
+"""
+Lightweight per-stage tracing for the agent and melody pipelines.
+
+A request is wrapped in `tracer.trace(...)` and each stage in `tracer.span(...)`.
+Finished spans and traces are handed to pluggable hooks; `InMemoryCollector`
+keeps the last N request breakdowns in-process (e.g. for the Streamlit sidebar).
+Spans follow the current request through threads started with
+`asyncio.to_thread` and through asyncio tasks via a context variable.
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Protocol
+
+
+@dataclass
+class Span:
+    """One timed stage. `offset_ms` is relative to the start of its trace."""
+    name: str
+    offset_ms: float
+    duration_ms: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    """All spans recorded for one request."""
+    trace_id: int
+    name: str
+    started_at: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    spans: List[Span] = field(default_factory=list)
+    duration_ms: float = 0.0
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total milliseconds per stage name."""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return totals
+
+
+class TraceHook(Protocol):
+    """Receives spans as they finish and traces when their request ends."""
+
+    def on_span(self, span: Span, trace: Optional[Trace]) -> None:
+        ...
+
+    def on_trace_end(self, trace: Trace) -> None:
+        ...
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "melodycomp_trace", default=None
+)
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self._hooks: List[TraceHook] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: TraceHook) -> TraceHook:
+        with self._lock:
+            if hook not in self._hooks:
+                self._hooks = [*self._hooks, hook]
+        return hook
+
+    def remove_hook(self, hook: TraceHook) -> None:
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    @contextmanager
+    def trace(self, name: str, **attributes: Any) -> Iterator[Trace]:
+        """
+        Wraps one request. Nested calls (e.g. run_conversation inside a batch
+        job's trace) are recorded as a span of the outer trace instead.
+        """
+        parent = _current_trace.get()
+        if parent is not None:
+            with self.span(name, **attributes):
+                yield parent
+            return
+
+        trace = Trace(next(self._ids), name, time.time(), attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            trace.duration_ms = (time.perf_counter() - trace._start) * 1000
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                # Generators may be finalized from another context.
+                _current_trace.set(None)
+            for hook in self._hooks:
+                hook.on_trace_end(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Times one stage. Yields the attribute dict so the stage can attach
+        results such as token counts. Costs next to nothing when there is
+        neither an active trace nor a hook.
+        """
+        trace = _current_trace.get()
+        hooks = self._hooks
+        if trace is None and not hooks:
+            yield attributes
+            return
+
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            span = Span(
+                name,
+                (start - trace._start) * 1000 if trace is not None else 0.0,
+                (end - start) * 1000,
+                attributes
+            )
+            if trace is not None:
+                trace.spans.append(span)
+            for hook in hooks:
+                hook.on_span(span, trace)
+
+    def traced(self, name: str) -> Callable[[Callable], Callable]:
+        """
+        Decorator running a function, coroutine, generator or async generator
+        inside `trace(name)`.
+        """
+        def decorator(fn: Callable) -> Callable:
+            if inspect.isasyncgenfunction(fn):
+                @functools.wraps(fn)
+                async def async_gen_wrapper(*args, **kwargs):
+                    with self.trace(name):
+                        async for item in fn(*args, **kwargs):
+                            yield item
+                return async_gen_wrapper
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def coroutine_wrapper(*args, **kwargs):
+                    with self.trace(name):
+                        return await fn(*args, **kwargs)
+                return coroutine_wrapper
+            if inspect.isgeneratorfunction(fn):
+                @functools.wraps(fn)
+                def gen_wrapper(*args, **kwargs):
+                    with self.trace(name):
+                        yield from fn(*args, **kwargs)
+                return gen_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.trace(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+class InMemoryCollector:
+    """Keeps the last `max_traces` finished traces in memory."""
+
+    def __init__(self, max_traces: int = 50) -> None:
+        self._traces: deque = deque(maxlen=max_traces)
+
+    def on_span(self, span: Span, trace: Optional[Trace]) -> None:
+        pass
+
+    def on_trace_end(self, trace: Trace) -> None:
+        self._traces.append(trace)
+
+    def recent(self, n: Optional[int] = None) -> List[Trace]:
+        """Most recent traces first."""
+        traces = list(self._traces)[::-1]
+        return traces if n is None else traces[:n]
+
+    def clear(self) -> None:
+        self._traces.clear()
+
+
+def usage_attributes(response: Any) -> Dict[str, Any]:
+    """Token counts from a LangChain message's usage metadata, if reported."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    return {
+        key: usage[key]
+        for key in ("input_tokens", "output_tokens", "total_tokens")
+        if key in usage
+    }
+
+
+tracer = Tracer()
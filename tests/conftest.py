@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks.stubs import HashEmbeddingFunction, gemini_stub
+from melodycomp.agent import MelodyCompAgent
+
+
+@pytest.fixture
+def make_agent(tmp_path):
+    """Builds offline agents on the hashing embeddings and a scripted chat model."""
+
+    def make(model=None, **kwargs):
+        agent = MelodyCompAgent(
+            model=model or gemini_stub(),
+            persist_directory=str(tmp_path / "index"),
+            embedding_function=HashEmbeddingFunction(),
+            **kwargs,
+        )
+        assert agent.wait_until_ready()
+        return agent
+
+    return make
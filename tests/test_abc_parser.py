@@ -0,0 +1,176 @@
+from fractions import Fraction
+
+import pytest
+
+from melodycomp.abc_parser import (
+    AbcParseError,
+    iter_abc_notes,
+    key_signature,
+    parse_abc,
+    parse_length,
+)
+
+
+def _notes(abc):
+    """(pitch, start, end) of each note, in quarter notes."""
+    return [(note.pitch, note.start, note.end) for note in parse_abc(abc)]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", Fraction(1)),
+    ("2", Fraction(2)),
+    ("/", Fraction(1, 2)),
+    ("//", Fraction(1, 4)),
+    ("3/2", Fraction(3, 2)),
+    ("/4", Fraction(1, 4)),
+])
+def test_parse_length(text, expected):
+    assert parse_length(text) == expected
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("C", {}),
+    ("G", {"F": 1}),
+    ("Bb", {"B": -1, "E": -1}),
+    ("Dm", {"B": -1}),
+    ("A dorian", {"F": 1}),
+    ("E phrygian", {}),
+    ("H", {}),
+])
+def test_key_signature(key, expected):
+    assert key_signature(key) == expected
+
+
+def test_pitches_octaves_and_default_length():
+    assert _notes("C D c C, c'") == [
+        (60, 0.0, 0.5), (62, 0.5, 1.0), (72, 1.0, 1.5), (48, 1.5, 2.0), (84, 2.0, 2.5)
+    ]
+
+
+def test_tie_merges_equal_pitches():
+    assert _notes("C2-C2 D") == [(60, 0.0, 2.0), (62, 2.0, 2.5)]
+
+
+def test_tie_across_bar_line():
+    assert _notes("C4-|C4|") == [(60, 0.0, 4.0)]
+
+
+def test_tie_between_different_pitches_is_ignored():
+    assert _notes("C2-D2") == [(60, 0.0, 1.0), (62, 1.0, 2.0)]
+
+
+def test_tied_chord():
+    assert _notes("[CE]2-[CE]2") == [(60, 0.0, 2.0), (64, 0.0, 2.0)]
+
+
+@pytest.mark.parametrize("abc, expected", [
+    ("C>D", [(60, 0.0, 0.75), (62, 0.75, 1.0)]),
+    ("C<D", [(60, 0.0, 0.25), (62, 0.25, 1.0)]),
+    ("C>>D", [(60, 0.0, 0.875), (62, 0.875, 1.0)]),
+    ("C2>D2 E", [(60, 0.0, 1.5), (62, 1.5, 2.0), (64, 2.0, 2.5)]),
+])
+def test_broken_rhythm(abc, expected):
+    assert _notes(abc) == expected
+
+
+def test_broken_rhythm_without_preceding_note():
+    with pytest.raises(AbcParseError):
+        parse_abc(">C")
+
+
+def test_triplet():
+    notes = _notes("(3CDE F")
+    assert [pitch for pitch, _, _ in notes] == [60, 62, 64, 65]
+    assert [start for _, start, _ in notes] == pytest.approx([0, 1 / 3, 2 / 3, 1.0])
+    assert notes[-1][2] == pytest.approx(1.5)
+
+
+def test_duplet():
+    notes = _notes("(2C2D2")
+    spans = [(start, end) for _, start, end in notes]
+    assert spans == pytest.approx([(0, 1.5), (1.5, 3.0)])
+
+
+@pytest.mark.parametrize("abc, expected", [
+    ("K:G\nF f", [66, 78]),
+    ("K:Dm\nB E", [70, 64]),
+    ("K:Eb\nA B E c", [68, 70, 63, 72]),
+    ("K:A dor\nF C", [66, 60]),
+])
+def test_key_signature_applies_to_notes(abc, expected):
+    assert [pitch for pitch, _, _ in _notes(abc)] == expected
+
+
+def test_bar_accidentals_last_until_the_bar_line():
+    assert [pitch for pitch, _, _ in _notes("^F F | F")] == [66, 66, 65]
+
+
+def test_bar_accidentals_override_the_key_signature():
+    assert [pitch for pitch, _, _ in _notes("K:G\n=F F | F")] == [65, 65, 66]
+
+
+def test_bar_accidentals_are_per_octave():
+    assert [pitch for pitch, _, _ in _notes("^F f")] == [66, 77]
+
+
+def test_double_accidentals():
+    assert [pitch for pitch, _, _ in _notes("^^C __B =C")] == [62, 69, 60]
+
+
+def test_inline_fields():
+    assert _notes("C [L:1/4] C [K:D] F | [M:3/4] Z C") == [
+        (60, 0.0, 0.5), (60, 0.5, 1.5), (66, 1.5, 2.5), (61, 5.5, 6.5)
+    ]
+
+
+def test_header_fields():
+    assert _notes("X:1\nT:Tune\nM:3/4\nL:1/4\nK:D\nF Z C") == [
+        (66, 0.0, 1.0), (61, 4.0, 5.0)
+    ]
+
+
+def test_chords():
+    assert _notes("[CEG]2 [FAc]") == [
+        (60, 0.0, 1.0), (64, 0.0, 1.0), (67, 0.0, 1.0),
+        (65, 1.0, 1.5), (69, 1.0, 1.5), (72, 1.0, 1.5),
+    ]
+
+
+def test_chord_length_uses_the_first_note():
+    assert _notes("[C2E2]3") == [(60, 0.0, 3.0), (64, 0.0, 3.0)]
+
+
+def test_rests():
+    assert _notes("z C x2 D Z E") == [(60, 0.5, 1.0), (62, 2.0, 2.5), (64, 6.5, 7.0)]
+
+
+def test_annotations_decorations_and_grace_notes_are_skipped():
+    assert _notes('"Am" !p! ~A {g}B .c (d e)') == [
+        (69, 0.0, 0.5), (71, 0.5, 1.0), (72, 1.0, 1.5), (74, 1.5, 2.0), (76, 2.0, 2.5)
+    ]
+
+
+def test_comments_are_skipped():
+    assert _notes("C D % E F") == [(60, 0.0, 0.5), (62, 0.5, 1.0)]
+
+
+def test_streamed_chunks_match_the_full_text():
+    abc = "L:1/4\n| C D- | D E |\n[CEG]2 z G |]"
+    chunks = ["L:1", "/4\n| C", " D-", " | D E |\n[CE", "G]2 z G |]"]
+    streamed = [(note.pitch, note.start, note.end) for note in iter_abc_notes(chunks)]
+    assert streamed == _notes(abc)
+
+
+def test_velocity():
+    assert {note.velocity for note in parse_abc("C D", velocity=64)} == {64}
+
+
+@pytest.mark.parametrize("abc", ["", "X:1\nK:C", "z4 |"])
+def test_no_notes(abc):
+    with pytest.raises(AbcParseError):
+        parse_abc(abc)
+
+
+def test_unexpected_character():
+    with pytest.raises(AbcParseError):
+        parse_abc("C & D")
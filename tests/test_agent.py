@@ -0,0 +1,42 @@
+import pytest
+
+from benchmarks.stubs import gemini_stub
+from melodycomp.cache import ResponseCache
+
+PROMPT = "I want an 8-bar atmospheric trip hop progression in A minor"
+
+
+def test_second_identical_prompt_is_served_from_the_cache(make_agent):
+    model = gemini_stub()
+    agent = make_agent(model)
+    assert isinstance(agent.response_cache, ResponseCache)
+
+    first = agent.run_conversation(PROMPT, session=agent.new_session())
+    calls = model.i
+    second = agent.run_conversation(PROMPT, session=agent.new_session())
+    assert second["chords"] == first["chords"]
+    assert model.i == calls
+    assert agent.response_cache.stats()["hits"] == 1
+
+
+def test_an_empty_cache_passed_in_is_used(make_agent):
+    cache = ResponseCache()
+    assert make_agent(response_cache=cache).response_cache is cache
+
+
+def test_caching_can_be_disabled(make_agent):
+    assert make_agent(response_cache=False).response_cache is None
+
+
+def test_unknown_cache_setting_is_rejected(make_agent):
+    with pytest.raises(ValueError):
+        make_agent(response_cache="fuzzy")
+
+
+def test_mode_written_without_a_separator(make_agent):
+    agent = make_agent(response_cache=False)
+    result = agent.run_conversation("Moody chords in A harmonicminor")
+    assert result["chords"]
+    assert agent.parse_intent("Moody chords in A harmonicminor").key == (
+        "A", "harmonic_minor"
+    )
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+from melodycomp.batch import (
+    CHECKPOINT_FILE,
+    FAILURES_FILE,
+    RESULTS_FILE,
+    BatchRunner,
+    load_checkpoint,
+    prune_failures,
+)
+
+NOTES = [{"pitch": 60, "velocity": 80, "start_time": 0.0, "end_time": 1.0}]
+
+
+class ScriptedAgent:
+    """Answers every prompt with one chord, except those listed in `failing`."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.prompts = []
+
+    def new_session(self):
+        return None
+
+    async def arun_conversation(self, prompt, session=None):
+        self.prompts.append(prompt)
+        if prompt in self.failing:
+            return None
+        return {"chords": ["Am7"], "notes": NOTES, "tips": None}
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_resume_skips_checkpointed_ids(tmp_path):
+    (tmp_path / CHECKPOINT_FILE).write_text("a\n")
+    agent = ScriptedAgent()
+    runner = BatchRunner(agent, str(tmp_path), retries=0)
+
+    completed, failed = asyncio.run(
+        runner.run_to_files([("a", "first prompt"), ("b", "second prompt")])
+    )
+
+    assert (completed, failed) == (1, 0)
+    assert agent.prompts == ["second prompt"]
+    assert [record["id"] for record in read_jsonl(tmp_path / RESULTS_FILE)] == ["b"]
+    assert (tmp_path / "midi" / "b.mid").read_bytes().startswith(b"MThd")
+    assert load_checkpoint(str(tmp_path)) == {"a", "b"}
+
+
+def test_failures_are_recorded_and_retried_on_the_next_run(tmp_path):
+    prompts = [("a", "good prompt"), ("b", "bad prompt")]
+    agent = ScriptedAgent(failing={"bad prompt"})
+    runner = BatchRunner(agent, str(tmp_path), retries=0)
+    assert asyncio.run(runner.run_to_files(prompts)) == (1, 1)
+    assert [record["id"] for record in read_jsonl(tmp_path / FAILURES_FILE)] == ["b"]
+
+    agent = ScriptedAgent()
+    runner = BatchRunner(agent, str(tmp_path), retries=0)
+    assert asyncio.run(runner.run_to_files(prompts)) == (1, 0)
+    assert agent.prompts == ["bad prompt"]
+    assert read_jsonl(tmp_path / FAILURES_FILE) == []
+
+
+def test_prune_failures_keeps_only_the_latest_failure_per_id(tmp_path):
+    failures = [
+        {"id": "a", "error": "first"},
+        {"id": "b", "error": "only"},
+        {"id": "a", "error": "second"},
+        {"id": "c", "error": "since completed"},
+    ]
+    (tmp_path / FAILURES_FILE).write_text(
+        "".join(json.dumps(record) + "\n" for record in failures)
+    )
+
+    prune_failures(str(tmp_path), done={"c"})
+
+    assert read_jsonl(tmp_path / FAILURES_FILE) == [
+        {"id": "b", "error": "only"},
+        {"id": "a", "error": "second"},
+    ]
+
+
+def test_prune_failures_without_a_failures_file(tmp_path):
+    prune_failures(str(tmp_path), done=set())
+    assert not (tmp_path / FAILURES_FILE).exists()
@@ -0,0 +1,100 @@
+import pytest
+
+from melodycomp.intent import IntentParser
+
+MODES = [
+    "major", "minor", "harmonic_minor", "melodic_minor", "dorian",
+    "phrygian", "lydian", "mixolydian", "locrian",
+]
+GENRES = ["chicago_house", "detroit_techno", "idm", "shoegaze", "trip_hop"]
+
+
+@pytest.fixture
+def parser():
+    return IntentParser(MODES, GENRES, moods=["dreamy", "melancholic"])
+
+
+@pytest.mark.parametrize("prompt, key", [
+    ("Chords in A minor", ("A", "minor")),
+    ("in the key of A-flat major", ("Ab", "major")),
+    ("a F#m vamp", ("F#", "minor")),
+    ("Bb dorian groove", ("Bb", "dorian")),
+    ("E harmonic minor", ("E", "harmonic_minor")),
+    ("in A harmonic-minor", ("A", "harmonic_minor")),
+    ("in A harmonicminor", ("A", "harmonic_minor")),
+    ("in A harmonic_minor", ("A", "harmonic_minor")),
+    ("in f# melodicminor", ("F#", "melodic_minor")),
+    ("Cmaj please", ("C", "major")),
+    ("D aeolian", ("D", "minor")),
+    ("in c sharp minor", ("C#", "minor")),
+])
+def test_keys(parser, prompt, key):
+    assert parser.parse(prompt).key == key
+
+
+@pytest.mark.parametrize("prompt", [
+    "Am I allowed to ask for something dreamy?",
+    "Am i too late for a shoegaze progression",
+    "a major hit",
+    "I am stuck",
+    "CM vamp",
+])
+def test_words_that_are_not_keys(parser, prompt):
+    assert parser.parse(prompt).key is None
+
+
+def test_key_after_a_question(parser):
+    assert parser.parse("Am I able to get a Cm groove?").key == ("C", "minor")
+
+
+def test_chord_symbol_at_the_start(parser):
+    assert parser.parse("Am, then something darker").key == ("A", "minor")
+
+
+@pytest.mark.parametrize("prompt, bars", [
+    ("8-bar house", 8),
+    ("16 bars of idm", 16),
+    ("eight bar loop", 8),
+    ("twenty-four measures", 24),
+])
+def test_bars(parser, prompt, bars):
+    assert parser.parse(prompt).bars == bars
+
+
+@pytest.mark.parametrize("prompt, bpm", [("at 124 BPM", 124), ("70-85 bpm", 77)])
+def test_bpm(parser, prompt, bpm):
+    assert parser.parse(prompt).bpm == bpm
+
+
+def test_genre_aliases_and_spellings(parser):
+    assert parser.parse("some Trip-Hop").genre == "trip_hop"
+    assert parser.parse("trip hop").genre == "trip_hop"
+    assert parser.parse("braindance chords").genre == "idm"
+    assert parser.parse("Detroit pads").genre == "detroit_techno"
+
+
+def test_full_prompt_and_remainder(parser):
+    intent = parser.parse(
+        "I want an 8-bar dreamy shoegaze progression in D major at 90 bpm with strings"
+    )
+    assert intent.key == ("D", "major")
+    assert intent.genre == "shoegaze"
+    assert intent.bars == 8
+    assert intent.bpm == 90
+    assert intent.moods == ("dreamy",)
+    assert intent.remainder == ("strings",)
+
+
+def test_same_intent_gives_the_same_cache_key(parser):
+    first = parser.parse("8-bar house in F minor")
+    second = parser.parse("8 bar house in F minor!")
+    assert first.cache_key == second.cache_key
+
+
+def test_results_are_cached(parser):
+    assert parser.parse("in A minor") is parser.parse("in A minor")
+    parser.clear_cache()
+    small = IntentParser(MODES, cache_size=1)
+    first = small.parse("in A minor")
+    small.parse("in B minor")
+    assert small.parse("in A minor") is not first
@@ -0,0 +1,155 @@
+import ast
+import asyncio
+import time
+
+import pytest
+
+from melodycomp.local_llm import MLX, ScriptedBackend, StopSequenceFilter
+
+
+class CountingBackend(ScriptedBackend):
+    """Records how many tokens were pulled and whether the stream was closed."""
+
+    def __init__(self, responses, delay=0.0):
+        super().__init__(responses)
+        self.delay = delay
+        self.pulled = 0
+        self.closed = False
+
+    def stream(self, prompt, max_tokens, allowed_chords=None):
+        try:
+            for text in super().stream(prompt, max_tokens, allowed_chords):
+                self.pulled += 1
+                if self.delay:
+                    time.sleep(self.delay)
+                yield text
+        finally:
+            self.closed = True
+
+
+def _feed_all(stop_filter, pieces):
+    return [stop_filter.feed(piece) for piece in pieces]
+
+
+def test_stop_filter_without_stop_sequences_passes_text_through():
+    stop_filter = StopSequenceFilter(None)
+    assert _feed_all(stop_filter, ["a", "</s>", "b"]) == ["a", "</s>", "b"]
+    assert not stop_filter.stopped
+
+
+def test_stop_sequence_split_across_tokens():
+    stop_filter = StopSequenceFilter(["</s>"])
+    pieces = ["ab", "c<", "/", "s", ">tail"]
+    assert _feed_all(stop_filter, pieces) == ["ab", "c", "", "", ""]
+    assert stop_filter.stopped
+
+
+def test_stop_sequence_inside_one_token():
+    stop_filter = StopSequenceFilter(["\n\n"])
+    assert stop_filter.feed("first\n\nsecond") == "first"
+    assert stop_filter.stopped
+
+
+def test_held_back_text_is_released_when_it_is_no_stop_sequence():
+    stop_filter = StopSequenceFilter(["</s>"])
+    assert _feed_all(stop_filter, ["x<", "/", "b>y"]) == ["x", "", "</b>y"]
+    assert not stop_filter.stopped
+
+
+def test_flush_returns_held_back_text():
+    stop_filter = StopSequenceFilter(["</s>"])
+    assert stop_filter.feed("end</") == "end"
+    assert stop_filter.flush() == "</"
+
+
+def test_earliest_of_several_stop_sequences_wins():
+    stop_filter = StopSequenceFilter(["Human:", "\n\n"])
+    assert _feed_all(stop_filter, ["a\nHum", "an:\n\nb"]) == ["a\n", ""]
+    assert stop_filter.stopped
+
+
+def test_invoke_stops_generation_at_the_stop_sequence():
+    backend = CountingBackend(["Hello STOP world and much more text"])
+    llm = MLX(backend=backend, model_path="scripted")
+    assert llm.invoke("prompt", stop=["STOP"]) == "Hello "
+    assert backend.pulled == len("Hello STOP")
+    assert backend.closed
+
+
+def test_stream_stops_generation_at_a_split_stop_sequence():
+    backend = CountingBackend(["one two\n\nthree four"])
+    llm = MLX(backend=backend, model_path="scripted")
+    chunks = list(llm.stream("prompt", stop=["\n\n"]))
+    assert "".join(chunks) == "one two"
+    assert all("\n\n" not in chunk for chunk in chunks)
+    assert backend.pulled == len("one two\n\n")
+    assert backend.closed
+
+
+def test_stream_without_stop_runs_to_the_end_of_the_script():
+    llm = MLX(backend=ScriptedBackend(["abc"]), model_path="scripted")
+    assert "".join(llm.stream("prompt")) == "abc"
+
+
+def test_stream_respects_max_tokens():
+    llm = MLX(backend=ScriptedBackend(["abcdef"]), model_path="scripted")
+    assert llm.invoke("prompt", max_tokens=3) == "abc"
+
+
+def test_astream_stops_generation_at_the_stop_sequence():
+    backend = CountingBackend(["Hello STOP world and much more text"])
+    llm = MLX(backend=backend, model_path="scripted")
+
+    async def collect():
+        return [chunk async for chunk in llm.astream("prompt", stop=["STOP"])]
+
+    assert "".join(asyncio.run(collect())) == "Hello "
+    assert backend.pulled == len("Hello STOP")
+    assert backend.closed
+
+
+def test_astream_stops_the_producer_when_the_consumer_quits():
+    backend = CountingBackend(["x" * 200], delay=0.005)
+    llm = MLX(backend=backend, model_path="scripted")
+
+    async def first_chunk():
+        async for chunk in llm.astream("prompt"):
+            return chunk
+
+    assert asyncio.run(first_chunk()) == "x"
+    deadline = time.monotonic() + 2
+    while not backend.closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend.closed
+    assert backend.pulled < 200
+
+
+def test_allowed_chords_reject_an_off_palette_chord():
+    allowed = ["Am", "C", "F", "G"]
+    backend = ScriptedBackend(["['Am', 'Bb7', 'C', 'G']"])
+    llm = MLX(backend=backend, model_path="scripted")
+    output = llm.invoke("prompt", allowed_chords=allowed)
+    chords = ast.literal_eval(output)
+    assert isinstance(chords, list) and chords
+    assert set(chords) <= set(allowed)
+    assert "Bb7" not in output
+
+
+def test_allowed_chords_end_generation_when_the_list_closes():
+    backend = CountingBackend(["['Am', 'C'] and some commentary after the list"])
+    llm = MLX(backend=backend, model_path="scripted")
+    assert llm.invoke("prompt", allowed_chords=["Am", "C"]) == "['Am', 'C']"
+    assert backend.pulled == len("['Am', 'C']")
+
+
+def test_allowed_chords_through_a_binding_and_a_stream():
+    llm = MLX(backend=ScriptedBackend(["['Am', 'Bb7', 'C']"]), model_path="scripted")
+    bound = llm.bind(allowed_chords=["Am", "C"])
+    output = "".join(bound.stream("prompt"))
+    assert set(ast.literal_eval(output)) <= {"Am", "C"}
+
+
+def test_empty_palette_is_rejected():
+    llm = MLX(backend=ScriptedBackend(["['Am']"]), model_path="scripted")
+    with pytest.raises(ValueError):
+        llm.invoke("prompt", allowed_chords=[" "])
@@ -0,0 +1,80 @@
+import io
+
+import numpy as np
+import pretty_midi
+import pytest
+
+from melodycomp.midi import VIOLIN, MidiCache, Track, encode_midi, render_midi
+
+CHORD_NOTES = [
+    {"pitch": 57, "velocity": 80, "start_time": 0.0, "end_time": 2.0},
+    {"pitch": 60, "velocity": 80, "start_time": 0.0, "end_time": 2.0},
+    {"pitch": 64, "velocity": 90, "start_time": 0.0, "end_time": 2.0},
+    {"pitch": 62, "velocity": 70, "start_time": 2.0, "end_time": 4.0},
+]
+
+
+def melody_track():
+    return Track([0.0, 0.5, 1.25], [0.5, 1.25, 3.0], [72, 74, 76], [100, 90, 80],
+                 program=VIOLIN, name="Melody")
+
+
+def parse(data):
+    return pretty_midi.PrettyMIDI(io.BytesIO(data))
+
+
+def sorted_notes(instrument):
+    return sorted(
+        (note.start, note.end, note.pitch, note.velocity)
+        for note in instrument.notes
+    )
+
+
+def test_encode_midi_round_trips_through_pretty_midi():
+    tracks = [Track.from_notes_json(CHORD_NOTES), melody_track()]
+
+    midi = parse(encode_midi(tracks))
+
+    assert len(midi.instruments) == 2
+    for track, instrument in zip(tracks, midi.instruments):
+        assert instrument.program == track.program
+        expected = sorted(zip(track.start, track.end, track.pitch, track.velocity))
+        notes = sorted_notes(instrument)
+        assert [note[2:] for note in notes] == [note[2:] for note in expected]
+        np.testing.assert_allclose(
+            [note[:2] for note in notes], [note[:2] for note in expected],
+            atol=1 / 220,
+        )
+    assert midi.instruments[1].name == "Melody"
+
+
+def test_from_instrument_matches_the_pretty_midi_notes():
+    instrument = parse(encode_midi([melody_track()])).instruments[0]
+    assert Track.from_instrument(instrument).digest == melody_track().digest
+
+
+def test_mismatched_note_arrays_are_rejected():
+    with pytest.raises(ValueError):
+        Track([0.0], [1.0, 2.0], [60], [80])
+
+
+def test_render_midi_serves_equal_tracks_from_the_cache():
+    cache = MidiCache()
+    first = render_midi(melody_track(), cache=cache)
+    second = render_midi(melody_track(), cache=cache)
+
+    assert second is first
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_midi_cache_evicts_least_recently_used_files():
+    cache = MidiCache(max_bytes=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"12345")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.stats()["evictions"] == 1
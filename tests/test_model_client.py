@@ -0,0 +1,283 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from melodycomp.model_client import (
+    ENDPOINT_ENV,
+    ChatGemini,
+    DeadlineExceeded,
+    GeminiClient,
+    ModelClientError,
+    messages_to_contents,
+)
+
+USAGE = {"promptTokenCount": 7, "candidatesTokenCount": 3, "totalTokenCount": 10}
+
+
+def _answer(text, usage=None):
+    content = {"role": "model", "parts": [{"text": text}]}
+    response = {"candidates": [{"content": content}]}
+    if usage:
+        response["usageMetadata"] = usage
+    return response
+
+
+class FakeGemini:
+    """
+    Local stand-in for the Gemini REST API. Scripted replies are served in
+    order, then `default`; every request is recorded.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.replies = []
+        self.default = {"json": _answer("hello", USAGE)}
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                with fake._lock:
+                    fake.requests.append({
+                        "path": self.path,
+                        "headers": dict(self.headers),
+                        "body": json.loads(self.rfile.read(length)),
+                    })
+                    reply = fake.replies.pop(0) if fake.replies else fake.default
+                time.sleep(reply.get("delay", 0))
+                self.send_response(reply.get("status", 200))
+                for name, value in reply.get("headers", {}).items():
+                    self.send_header(name, value)
+                if "chunks" in reply:
+                    self.send_header("content-type", "text/event-stream")
+                    self.end_headers()
+                    for chunk in reply["chunks"]:
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    return
+                data = json.dumps(reply.get("json", {})).encode()
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        ).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def server():
+    fake = FakeGemini()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def client(server):
+    client = GeminiClient(
+        "test-key", endpoint=server.url, requests_per_second=1000, burst=100,
+        timeout=5.0, backoff=0.01, max_backoff=0.05,
+    )
+    yield client
+    client.close()
+
+
+def _rate_limited(retry_after="0.2"):
+    return {
+        "status": 429,
+        "headers": {"retry-after": retry_after},
+        "json": {"error": {"message": "Resource exhausted"}},
+    }
+
+
+def test_generate_sends_the_request(server, client):
+    response = client.generate(
+        [{"role": "user", "parts": [{"text": "hi"}]}],
+        system="Be brief.",
+        generation_config={"temperature": 0.2},
+    )
+    assert response["candidates"][0]["content"]["parts"][0]["text"] == "hello"
+    request, = server.requests
+    assert request["path"] == f"/v1beta/models/{client.model}:generateContent"
+    assert request["headers"]["x-goog-api-key"] == "test-key"
+    assert request["body"] == {
+        "contents": [{"role": "user", "parts": [{"text": "hi"}]}],
+        "systemInstruction": {"parts": [{"text": "Be brief."}]},
+        "generationConfig": {"temperature": 0.2},
+    }
+
+
+def test_retries_429_after_retry_after(server, client):
+    server.replies.append(_rate_limited("0.2"))
+    started = time.monotonic()
+    assert client.generate_text("hi") == "hello"
+    assert time.monotonic() - started >= 0.2
+    assert len(server.requests) == 2
+    assert client.stats()["retries"] == 1
+
+
+def test_retries_server_errors(server, client):
+    server.replies.extend([{"status": 503, "json": {}}, {"status": 500, "json": {}}])
+    assert client.generate_text("hi") == "hello"
+    assert len(server.requests) == 3
+
+
+def test_client_errors_are_not_retried(server, client):
+    server.replies.append({"status": 400, "json": {"error": {"message": "Bad prompt"}}})
+    with pytest.raises(ModelClientError) as error:
+        client.generate_text("hi")
+    assert error.value.status_code == 400
+    assert "Bad prompt" in str(error.value)
+    assert len(server.requests) == 1
+
+
+def test_gives_up_after_the_retries(server, client):
+    server.default = {"status": 503, "json": {}}
+    with pytest.raises(ModelClientError):
+        client.generate_text("hi")
+    assert len(server.requests) == client.retries + 1
+
+
+def test_retry_after_beyond_the_deadline(server, client):
+    server.replies.append(_rate_limited("10"))
+    with pytest.raises(DeadlineExceeded):
+        client.generate_text("hi", timeout=1.0)
+    assert len(server.requests) == 1
+
+
+def test_slow_answer_exceeds_the_deadline(server, client):
+    server.replies.append({"delay": 1.0, "json": _answer("late")})
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.generate_text("hi", timeout=0.3)
+    assert time.monotonic() - started < 1.0
+
+
+def test_hedged_request_wins_over_a_slow_primary(server):
+    client = GeminiClient(
+        "test-key", endpoint=server.url, requests_per_second=1000, burst=100,
+        hedge=True, hedge_min_samples=1,
+    )
+    client.latency.record(0.05)
+    server.replies.append({"delay": 1.0, "json": _answer("primary")})
+    try:
+        started = time.monotonic()
+        assert client.generate_text("hi") == "hello"
+        assert time.monotonic() - started < 1.0
+        assert client.stats()["hedge_wins"] == 1
+    finally:
+        client.close()
+
+
+def test_chat_model_invoke(server, client):
+    llm = ChatGemini(client=client, temperature=0.3)
+    message = llm.invoke([SystemMessage("System."), HumanMessage("Chords please")])
+    assert message.content == "hello"
+    assert message.usage_metadata == {
+        "input_tokens": 7, "output_tokens": 3, "total_tokens": 10
+    }
+    body = server.requests[0]["body"]
+    assert body["systemInstruction"] == {"parts": [{"text": "System."}]}
+    assert body["generationConfig"] == {"temperature": 0.3}
+
+
+def test_chat_model_passes_stop_sequences(server, client):
+    ChatGemini(client=client).invoke("hi", stop=["\n\n"])
+    assert server.requests[0]["body"]["generationConfig"]["stopSequences"] == ["\n\n"]
+
+
+def _stream_reply():
+    return {"chunks": [
+        _answer("['Am7', "),
+        _answer("'G']"),
+        _answer("", USAGE),
+    ]}
+
+
+def test_chat_model_stream(server, client):
+    server.replies.append(_stream_reply())
+    chunks = list(ChatGemini(client=client).stream("hi"))
+    assert "".join(chunk.content for chunk in chunks) == "['Am7', 'G']"
+    assert chunks[-1].usage_metadata["total_tokens"] == 10
+    assert server.requests[0]["path"].endswith(":streamGenerateContent?alt=sse")
+
+
+def test_stream_retries_before_the_first_chunk(server, client):
+    server.replies.extend([_rate_limited("0.1"), _stream_reply()])
+    chunks = list(ChatGemini(client=client).stream("hi"))
+    assert "".join(chunk.content for chunk in chunks) == "['Am7', 'G']"
+    assert len(server.requests) == 2
+
+
+def test_chat_model_ainvoke(server, client):
+    server.replies.append(_rate_limited("0.1"))
+    message = asyncio.run(ChatGemini(client=client).ainvoke("hi"))
+    assert message.content == "hello"
+    assert message.usage_metadata["input_tokens"] == 7
+    assert len(server.requests) == 2
+
+
+def test_chat_model_astream(server, client):
+    server.replies.extend([_rate_limited("0.1"), _stream_reply()])
+
+    async def collect():
+        return [chunk async for chunk in ChatGemini(client=client).astream("hi")]
+
+    chunks = asyncio.run(collect())
+    assert "".join(chunk.content for chunk in chunks) == "['Am7', 'G']"
+    assert chunks[-1].usage_metadata["output_tokens"] == 3
+    assert len(server.requests) == 2
+
+
+def test_from_config_uses_the_endpoint_override(server, tmp_path, monkeypatch):
+    config = tmp_path / "config.yaml"
+    config.write_text("gemini_api_key: file-key\ngemini:\n  retries: 1\n")
+    monkeypatch.setenv(ENDPOINT_ENV, server.url)
+    client = GeminiClient.from_config(str(config))
+    try:
+        assert client.generate_text("hi") == "hello"
+        assert client.retries == 1
+        assert server.requests[0]["headers"]["x-goog-api-key"] == "file-key"
+    finally:
+        client.close()
+
+
+def test_from_config_requires_an_api_key(tmp_path):
+    config = tmp_path / "config.yaml"
+    config.write_text("gemini:\n  retries: 1\n")
+    with pytest.raises(ValueError):
+        GeminiClient.from_config(str(config))
+
+
+def test_messages_to_contents_alternates_roles():
+    system, contents = messages_to_contents([
+        SystemMessage("Rules."),
+        HumanMessage("one"),
+        HumanMessage("two"),
+        AIMessage("answer"),
+        HumanMessage("three"),
+    ])
+    assert system == "Rules."
+    assert contents == [
+        {"role": "user", "parts": [{"text": "one"}, {"text": "two"}]},
+        {"role": "model", "parts": [{"text": "answer"}]},
+        {"role": "user", "parts": [{"text": "three"}]},
+    ]
@@ -0,0 +1,107 @@
+import pytest
+
+from melodycomp.agent import MelodyCompAgent
+from melodycomp.progression_model import (
+    ProgressionModel,
+    enharmonic_spellings,
+    from_roman,
+    prefers_flats,
+    to_roman,
+)
+
+RECORDS = [
+    {"chords": ["Am7", "Fmaj7", "C", "G"], "key": "A minor", "genre": "Trip Hop"},
+    {"chords": ["Dm7", "Bbmaj7", "F", "C"], "key": "D minor", "genre": "Trip Hop"},
+    {"chords": ["C", "G", "Am", "F"], "key": "C major", "genre": "Pop"},
+    {"chords": ["Not a chord"], "key": "C major"},
+]
+
+
+@pytest.fixture(scope="module")
+def model():
+    return ProgressionModel.train(RECORDS)
+
+
+def test_roman_numerals_are_relative_to_the_tonic():
+    assert to_roman("Am7", 0) == "VIm7"
+    assert to_roman("Bm7/E", 0) is None
+    assert from_roman("VIm7", 0) == "Am7"
+    assert from_roman("bVI", 2, flats=True) == "Bb"
+
+
+def test_enharmonic_spellings_add_both_root_names():
+    assert enharmonic_spellings(["A#m7", "C"]) == {"A#m7", "Bbm7", "C"}
+
+
+def test_prefers_flats_follows_the_key_signature():
+    assert prefers_flats("F", "minor")
+    assert prefers_flats("Eb", "major")
+    assert not prefers_flats("E", "minor")
+    assert not prefers_flats("D", "dorian")
+
+
+def test_unreadable_records_are_skipped(model):
+    assert model.progressions == 3
+    assert model.genres == ["pop", "trip_hop"]
+
+
+def test_progressions_are_transposed_to_the_requested_key(model):
+    progression = model.generate("E", "minor", 4, genres=["trip_hop"])
+    assert progression.numerals == ("Im7", "bVImaj7", "bIII", "bVII")
+    assert progression.chords == ("Em7", "Cmaj7", "G", "D")
+    assert 0 < progression.confidence <= 1
+
+
+def test_flat_keys_are_spelled_with_flats(model):
+    assert model.generate("F", "minor", 4, genres=["trip_hop"]).chords == (
+        "Fm7", "Dbmaj7", "Ab", "Eb"
+    )
+
+
+def test_vocabulary_limits_the_chords(model):
+    progression = model.generate("A", "minor", 4, vocabulary={"Am7", "C", "G"})
+    assert progression is None or set(progression.chords) <= {"Am7", "C", "G"}
+
+
+def test_modes_are_known_only_when_trained(model):
+    assert model.has_mode("minor")
+    assert model.has_mode("aeolian")
+    assert not model.has_mode("dorian")
+    # Untrained modes still back off to their major/minor family.
+    assert model.generate("C", "dorian", 4).chords == ("Cm7", "Abmaj7", "Eb", "Bb")
+
+
+def test_save_and_load_round_trip(model, tmp_path):
+    path = str(tmp_path / "model.json")
+    model.save(path)
+    loaded = ProgressionModel.load(path)
+    assert loaded.to_dict() == model.to_dict()
+    assert loaded.generate("E", "minor", 4) == model.generate("E", "minor", 4)
+
+
+def test_fast_path_stays_in_the_requested_mode(make_agent):
+    agent = make_agent(response_cache=False)
+    for prompt in [
+        "8-bar progression in D dorian",
+        "An 8-bar trip hop progression in A minor",
+        "4 bars in F minor house",
+    ]:
+        result = agent._fast_path_response(prompt, agent.new_session())
+        assert result is not None, prompt
+        palette = agent._get_diatonic_palette(*agent.parse_intent(prompt).key)
+        assert set(result["chords"]) <= enharmonic_spellings(palette), prompt
+    assert agent.model.i == 0
+
+
+def test_fast_path_leaves_untrained_modes_to_the_llm(make_agent, monkeypatch):
+    # Chords diatonic to both F major and F lydian, learned in major only.
+    model = ProgressionModel.train(
+        [{"chords": ["C", "Am", "Em", "C"], "key": "C major"}] * 4
+    )
+    monkeypatch.setattr(
+        MelodyCompAgent, "progression_model", property(lambda self: model)
+    )
+    agent = make_agent(response_cache=False)
+    assert model.generate("F", "lydian", 4) is not None
+    assert agent._fast_path_response("4 bars in F lydian", agent.new_session()) is None
+    assert agent._fast_path_response("4 bars in F major", agent.new_session())
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from benchmarks.stubs import gemini_stub, mlx_stub
+from melodycomp import agent as agent_module
+from melodycomp.model_client import DeadlineExceeded, GeminiClient
+from melodycomp.router import Backend, ModelRouter
+
+
+class FailingModel(FakeListChatModel):
+    def _call(self, *args, **kwargs):
+        raise RuntimeError("backend down")
+
+
+@pytest.fixture
+def agent_router(make_agent, monkeypatch):
+    """The agent's own local="auto" router, on the offline stand-ins."""
+    monkeypatch.setattr(
+        agent_module.MLX, "from_model_path", lambda *args, **kwargs: mlx_stub()
+    )
+    client = GeminiClient("test-key", endpoint="http://127.0.0.1:9")
+    monkeypatch.setattr(agent_module, "get_gemini_client", lambda: client)
+    router = make_agent(response_cache=False)._build_router()
+    yield router
+    router.close()
+    client.close()
+
+
+def test_agent_router_prefers_an_idle_local_model(agent_router):
+    assert [backend.name for backend in agent_router.plan()] == ["mlx", "gemini"]
+
+
+def test_agent_router_offloads_while_the_local_model_is_busy(agent_router):
+    agent_router._stats["mlx"].start()
+    assert agent_router.plan()[0].name == "gemini"
+    agent_router._stats["mlx"].release()
+    assert agent_router.plan()[0].name == "mlx"
+
+
+def test_agent_router_offloads_when_the_local_model_is_slow(agent_router):
+    for _ in range(5):
+        agent_router._stats["mlx"].latency.record(30.0)
+    assert agent_router.plan()[0].name == "gemini"
+
+
+def test_calls_go_to_the_first_backend():
+    router = ModelRouter([
+        Backend("a", FakeListChatModel(responses=["from a"])),
+        Backend("b", FakeListChatModel(responses=["from b"])),
+    ])
+    try:
+        assert router.invoke("hi").content == "from a"
+        assert router.stats()["a"]["calls"] == 1
+        assert router.stats()["b"]["calls"] == 0
+    finally:
+        router.close()
+
+
+def test_fails_over_and_opens_the_circuit():
+    router = ModelRouter([
+        Backend("down", FailingModel(responses=["x"])),
+        Backend("up", FakeListChatModel(responses=["ok"])),
+    ], failure_threshold=1, cooldown=60)
+    try:
+        assert router.invoke("hi").content == "ok"
+        stats = router.stats()
+        assert stats["down"]["failures"] == 1 and stats["down"]["circuit_open"]
+        assert [backend.name for backend in router.plan()] == ["up", "down"]
+    finally:
+        router.close()
+
+
+def test_all_backends_failing_raises_the_last_error():
+    router = ModelRouter([Backend("down", FailingModel(responses=["x"]))])
+    try:
+        with pytest.raises(RuntimeError, match="backend down"):
+            router.invoke("hi")
+    finally:
+        router.close()
+
+
+def test_backend_slower_than_the_deadline_is_tried_last():
+    router = ModelRouter([
+        Backend("slow", FakeListChatModel(responses=["a"]), expected_latency=30.0),
+        Backend("fast", FakeListChatModel(responses=["b"]), expected_latency=1.0),
+    ], deadline=10.0)
+    try:
+        assert [backend.name for backend in router.plan()] == ["fast", "slow"]
+    finally:
+        router.close()
+
+
+def test_timeout_raises_deadline_exceeded():
+    router = ModelRouter([
+        Backend("slow", FakeListChatModel(responses=["late"], sleep=1.0)),
+    ], deadline=0.2)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            router.invoke("hi")
+    finally:
+        router.close()
+
+
+def test_call_kwargs_only_reach_backends_that_accept_them():
+    router = ModelRouter([
+        Backend("mlx", mlx_stub(), accepts=frozenset({"allowed_chords"})),
+        Backend("gemini", gemini_stub()),
+    ])
+    try:
+        assert router.accepts("allowed_chords")
+        assert router._kwargs(router.backends[1], {"allowed_chords": ["Am"]}) == {}
+        output = router.invoke("chords", allowed_chords=["Am7", "Gmaj7"])
+        assert "Fmaj7" not in output
+    finally:
+        router.close()
+
+
+def test_stream_and_async_calls():
+    router = ModelRouter([Backend("a", FakeListChatModel(responses=["abc", "de"]))])
+
+    async def collect():
+        message = await router.ainvoke("hi")
+        chunks = [chunk.content async for chunk in router.astream("hi")]
+        return message.content, chunks
+
+    try:
+        assert "".join(chunk.content for chunk in router.stream("hi")) == "abc"
+        assert asyncio.run(collect()) == ("de", ["a", "b", "c"])
+        assert router.stats()["a"]["calls"] == 3
+        assert router.stats()["a"]["in_flight"] == 0
+    finally:
+        router.close()
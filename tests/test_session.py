@@ -0,0 +1,63 @@
+from melodycomp.session import ConversationSession
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_history_is_trimmed_to_the_token_budget():
+    session = ConversationSession(max_history_tokens=10, token_counter=count_words)
+    for i in range(5):
+        session.add_exchange(f"prompt {i}", f"answer number {i}")
+
+    history = session.history()
+    assert sum(count_words(message.content) for message in history) <= 10
+    assert [message.content for message in history] == [
+        "prompt 3", "answer number 3", "prompt 4", "answer number 4"
+    ]
+
+
+def test_the_latest_exchange_is_kept_even_over_budget():
+    session = ConversationSession(max_history_tokens=2, token_counter=count_words)
+    session.add_exchange("first prompt", "first answer")
+    session.add_exchange("a much longer second prompt", "and a long answer too")
+
+    assert [message.content for message in session.history()] == [
+        "a much longer second prompt", "and a long answer too"
+    ]
+
+
+def test_dropped_exchanges_are_folded_into_the_summary():
+    calls = []
+
+    def summarizer(summary, dropped):
+        calls.append([message.content for message in dropped])
+        return (summary + " " + dropped[0].content).strip()
+
+    session = ConversationSession(
+        max_history_tokens=4, token_counter=count_words, summarizer=summarizer
+    )
+    session.add_exchange("one", "uno")
+    session.add_exchange("two", "dos")
+    session.add_exchange("three", "tres")
+
+    assert calls == [["one", "uno"]]
+    history = session.history()
+    assert history[0].content == "Summary of the earlier conversation: one"
+    assert [message.content for message in history[1:]] == [
+        "two", "dos", "three", "tres"
+    ]
+
+
+def test_clear_resets_history_and_summary():
+    session = ConversationSession(
+        max_history_tokens=2, token_counter=count_words,
+        summarizer=lambda summary, dropped: "earlier",
+    )
+    session.add_exchange("one", "uno")
+    session.add_exchange("two", "dos")
+    assert not session.is_empty
+
+    session.clear()
+    assert session.is_empty
+    assert session.history() == []